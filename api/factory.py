@@ -0,0 +1,115 @@
+"""
+进程级 pipeline 工厂。
+
+movie_agent/run.py 只 import 一次（不再 importlib.reload），Gemini / Runway 管道（ToolCalling）
+按模型配置在每个进程里只构建一次，OpenAI client 由 base_agent.get_client 进程内共享。
+scripts/story_to_script.py 同样只 import 一次，API 在进程内直接调用它的库入口。
+每个 job 只拿到一个轻量的 ScriptBreakAgent（job 自己的路径 + 三个无状态 BaseAgent），
+job 启动只需毫秒级，也不再需要全局锁串行化。
+"""
+import importlib
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+MOVIE_AGENT_DIR = Path(__file__).parent.parent.resolve() / "movie_agent"
+SCRIPTS_DIR = Path(__file__).parent.parent.resolve() / "scripts"
+
+
+class PipelineFactory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run_mod = None
+        self._script_mods: dict = {}
+        self._configs: dict = {}
+        self._tools: dict = {}
+
+    def run_module(self):
+        if self._run_mod is None:
+            with self._lock:
+                if self._run_mod is None:
+                    if str(MOVIE_AGENT_DIR) not in sys.path:
+                        sys.path.insert(0, str(MOVIE_AGENT_DIR))
+                    self._run_mod = importlib.import_module("run")
+        return self._run_mod
+
+    def metering(self):
+        """movie_agent/metering.py：与 run / base_agent 用同一个模块实例，job 的 Meter 才能收到所有调用的用量。"""
+        self.run_module()  # 保证 movie_agent 在 sys.path 上
+        return importlib.import_module("metering")
+
+    def script_module(self, name: str):
+        """import scripts/ 下的模块（如 story_to_script、image_normalize）。"""
+        mod = self._script_mods.get(name)
+        if mod is None:
+            with self._lock:
+                if str(SCRIPTS_DIR) not in sys.path:
+                    sys.path.insert(0, str(SCRIPTS_DIR))
+                mod = self._script_mods[name] = importlib.import_module(name)
+        return mod
+
+    def story_to_script(self):
+        """scripts/story_to_script.py（script synopsis 阶段的库入口）。"""
+        return self.script_module("story_to_script")
+
+    def model_config(self, model_name: str) -> dict:
+        """configs/{model_name}.json，每个进程只读一次。"""
+        if model_name not in self._configs:
+            self._configs[model_name] = self.run_module().load_config(model_name)
+        return dict(self._configs[model_name])
+
+    def apply_model_configs(self, args: SimpleNamespace, *model_names: str) -> SimpleNamespace:
+        for model_name in model_names:
+            for k, v in self.model_config(model_name).items():
+                if not getattr(args, k, None):
+                    setattr(args, k, v)
+        return args
+
+    def tools(self, args: SimpleNamespace):
+        """按模型配置缓存 ToolCalling；其中的管道不含 job 级状态，可以被多个 job 并发复用。"""
+        key = (
+            args.gen_model,
+            args.Image2Video,
+            args.audio_model,
+            getattr(args, "character_photo_path", ""),
+            getattr(args, "scene_style_text", ""),
+            bool(getattr(args, "skip_video", False)),
+        )
+        tools = self._tools.get(key)
+        if tools is None:
+            self.run_module()  # 保证 movie_agent 在 sys.path 上
+            ToolCalling = importlib.import_module("tools").ToolCalling
+            with self._lock:
+                tools = self._tools.get(key)
+                if tools is None:
+                    tools = ToolCalling(
+                        args,
+                        sample_model=args.gen_model,
+                        audio_model=args.audio_model,
+                        talk_model=args.talk_model,
+                        Image2Video=args.Image2Video,
+                        photo_audio_path=args.character_photo_path,
+                        characters_list=[],
+                        save_mode="video",
+                    )
+                    self._tools[key] = tools
+        return tools
+
+    def new_agent(self, args: SimpleNamespace):
+        """为单个 job 创建 ScriptBreakAgent，复用进程内共享的管道与 client。"""
+        ScriptBreakAgent = self.run_module().ScriptBreakAgent
+        return ScriptBreakAgent(
+            args,
+            sample_model=args.gen_model,
+            audio_model=args.audio_model,
+            talk_model=args.talk_model,
+            Image2Video=args.Image2Video,
+            script_path=args.script_path,
+            character_photo_path=args.character_photo_path,
+            save_mode="video",
+            tools=self.tools(args),
+        )
+
+
+factory = PipelineFactory()
@@ -1,36 +1,378 @@
 """
-线程安全的任务状态管理（内存存储）。
-生产环境可替换为 Redis。
+任务状态管理（SQLite 持久化存储，WAL 模式）。
+
+多个 uvicorn worker 共享同一个数据库文件，重启后任务状态不丢失。
+progress / step 这类高频字段先在进程内合并，按 JOBS_PROGRESS_FLUSH_INTERVAL 批量落盘；
+status / video_url / error 等字段立即写入（同时带上该 job 尚未落盘的 progress）。
+除固定列外的字段（如用量统计）存进 extra JSON 列，get() 时合并返回。
+排队本身也在这张表里（enqueue / claim，见 api/scheduler.py）：所有 uvicorn worker 共用一个队列，
+queue_position 在 get() 时按表现算，不回写。
+在进程池 worker 里（api/worker_pool.py）update() 被转发到 IPC 队列，由 API 进程统一写库。
+
+批量落盘由每个进程一个长期存活的后台线程完成（只用它自己的一个连接），它同时定期写本进程的心跳。
+每个 job 记下创建 / 执行它的进程（owner）；owner 的心跳超过 3 个 JOBS_HEARTBEAT_INTERVAL 没更新
+（进程崩溃、重启）时，它名下 running 的 job 和还没上传完（未入队）的 job 被标记为 error，
+已入队的 job 留在队列里由其他进程接着跑 —— 启动时（start()）做一次，之后随心跳定期做。
+
+Environment variables (optional):
+  JOBS_DB_PATH                   default <tmp>/movieagent_jobs/jobs.db
+  JOBS_PROGRESS_FLUSH_INTERVAL   default 1.0 (seconds)
+  JOBS_HEARTBEAT_INTERVAL        default 10 (seconds)
 """
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
 import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
 from typing import Optional
 
-_lock = threading.Lock()
-_store: dict = {}
+JOBS_DB_PATH = os.environ.get(
+    "JOBS_DB_PATH",
+    str(Path(tempfile.gettempdir()) / "movieagent_jobs" / "jobs.db"),
+)
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("JOBS_PROGRESS_FLUSH_INTERVAL", "1.0"))
+HEARTBEAT_INTERVAL = float(os.environ.get("JOBS_HEARTBEAT_INTERVAL", "10"))
+INSTANCE_LEASE = 3 * HEARTBEAT_INTERVAL
+
+# 本进程的标识（写进 jobs.owner 与 instances 表）
+INSTANCE_ID = uuid.uuid4().hex
+
+_COLUMNS = ("status", "progress", "step", "video_url", "error")
+_BATCHED_FIELDS = frozenset({"progress", "step"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id     TEXT PRIMARY KEY,
+    status     TEXT NOT NULL,
+    progress   INTEGER NOT NULL DEFAULT 0,
+    step       TEXT NOT NULL DEFAULT '',
+    video_url  TEXT,
+    error      TEXT,
+    extra      TEXT NOT NULL DEFAULT '{}',
+    owner      TEXT,
+    priority   INTEGER NOT NULL DEFAULT 0,
+    payload    TEXT,
+    queued_at  REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    heartbeat   REAL NOT NULL
+);
+"""
+
+# 旧版数据库缺少的列：(列名, 定义)
+_MIGRATIONS = (
+    ("owner", "TEXT"),
+    ("priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("payload", "TEXT"),
+    ("queued_at", "REAL"),
+)
+# 已入队（上传完成、payload 已写入）的排队 job；claim 的顺序与 queue_position 都按 _QUEUE_ORDER
+_QUEUED = "status = 'queued' AND payload IS NOT NULL"
+_QUEUE_ORDER = "priority DESC, queued_at, job_id"
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+# 尚未落盘的 progress/step：job_id -> {field: value}
+_pending_lock = threading.Lock()
+_pending: dict = {}
+_pending_event = threading.Event()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+# 非 None 时 update() 不写库，而是交给它转发（子进程 -> API 进程）
+_forwarder = None
+
+
+# ── connection ────────────────────────────────────────────────────────────────
+
+def _conn() -> sqlite3.Connection:
+    """每个线程一个连接（sqlite3 连接不能跨线程共享）。"""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        Path(JOBS_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None：autocommit，事务由下面显式 BEGIN 控制
+        conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        _local.conn = conn
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                have = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+                for name, decl in _MIGRATIONS:
+                    if name not in have:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, {_QUEUE_ORDER})")
+                _schema_ready = True
+    return conn
+
+
+def _write(conn: sqlite3.Connection, job_id: str, fields: dict, now: float):
+    """在调用方已开启的事务中写入一个 job 的字段。"""
+    cols = {k: v for k, v in fields.items() if k in _COLUMNS}
+    extra = {k: v for k, v in fields.items() if k not in _COLUMNS}
+    sets = [f"{k} = ?" for k in cols]
+    params = list(cols.values())
+    if extra:
+        row = conn.execute("SELECT extra FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        merged = json.loads(row["extra"] or "{}")
+        merged.update(extra)
+        sets.append("extra = ?")
+        params.append(json.dumps(merged, ensure_ascii=False, default=str))
+    sets.append("updated_at = ?")
+    params.extend([now, job_id])
+    conn.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE job_id = ?", params)
+
+
+# ── batched progress writes ───────────────────────────────────────────────────
+
+def flush():
+    """把进程内缓存的 progress/step 一次性写入（单个事务）。"""
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return
+    conn = _conn()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for job_id, fields in batch.items():
+            _write(conn, job_id, fields, now)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _writer_loop():
+    """后台写库线程：有待写的 progress 时攒 PROGRESS_FLUSH_INTERVAL 再一次写入；每 HEARTBEAT_INTERVAL 续约心跳并回收失联 job。"""
+    next_beat = 0.0
+    while True:
+        if _pending_event.wait(timeout=max(0.0, next_beat - time.time())):
+            time.sleep(PROGRESS_FLUSH_INTERVAL)
+            _pending_event.clear()
+            try:
+                flush()
+            except Exception:
+                traceback.print_exc()
+        if time.time() >= next_beat:
+            try:
+                heartbeat()
+                reconcile()
+            except Exception:
+                traceback.print_exc()
+            next_beat = time.time() + HEARTBEAT_INTERVAL
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="jobs-writer", daemon=True)
+            _writer.start()
+
+
+def _shutdown():
+    flush()
+    if _writer is not None:
+        # 正常退出：立即注销，下次启动不必等心跳过期就能回收本进程留下的 job
+        _conn().execute("DELETE FROM instances WHERE instance_id = ?", (INSTANCE_ID,))
+
+
+atexit.register(_shutdown)
+
+
+# ── liveness ──────────────────────────────────────────────────────────────────
+
+def heartbeat():
+    _conn().execute(
+        "INSERT OR REPLACE INTO instances (instance_id, heartbeat) VALUES (?, ?)",
+        (INSTANCE_ID, time.time()),
+    )
+
+
+def reconcile() -> int:
+    """
+    把 owner 已失联（心跳过期 / 已注销）的 running job 与未入队的 queued job 标记为 error，返回处理的条数。
+    已入队的 job 不受影响：payload 在表里，任何进程都能 claim。
+    """
+    now = time.time()
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        n = conn.execute(
+            "UPDATE jobs SET status = 'error', error = ?, updated_at = ? "
+            "WHERE (status = 'running' OR (status = 'queued' AND payload IS NULL)) AND (owner IS NULL OR owner NOT IN "
+            "(SELECT instance_id FROM instances WHERE heartbeat >= ?))",
+            ("interrupted: the server process running this job exited", now, now - INSTANCE_LEASE),
+        ).rowcount
+        conn.execute("DELETE FROM instances WHERE heartbeat < ?", (now - 10 * INSTANCE_LEASE,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if n:
+        print(f"[jobs] {n} 个 job 的进程已退出，标记为 error")
+    return n
+
+
+def start():
+    """API 进程启动时调用：登记心跳、回收上次遗留的 job，并启动后台写库线程。"""
+    heartbeat()
+    reconcile()
+    _ensure_writer()
+
+
+# ── public API ────────────────────────────────────────────────────────────────
+
+def set_forwarder(fn):
+    """设置 update() 的转发函数 fn(job_id, fields)；传 None 恢复直接写库。"""
+    global _forwarder
+    _forwarder = fn
 
 
 def create(job_id: str):
-    with _lock:
-        _store[job_id] = {
-            "status": "queued",   # queued | running | done | error
-            "progress": 0,
-            "step": "",
-            "video_url": None,
-            "error": None,
-        }
+    now = time.time()
+    _conn().execute(
+        "INSERT OR REPLACE INTO jobs (job_id, status, progress, step, video_url, error, extra, owner, created_at, updated_at) "
+        "VALUES (?, ?, 0, '', NULL, NULL, '{}', ?, ?, ?)",
+        (job_id, "queued", INSTANCE_ID, now, now),   # status: queued | running | done | error
+    )
 
 
 def update(job_id: str, **kwargs):
-    with _lock:
-        if job_id in _store:
-            _store[job_id].update(kwargs)
+    if not kwargs:
+        return
+    if _forwarder is not None:
+        _forwarder(job_id, kwargs)
+        return
+    if set(kwargs) <= _BATCHED_FIELDS:
+        with _pending_lock:
+            _pending.setdefault(job_id, {}).update(kwargs)
+        _ensure_writer()
+        _pending_event.set()
+        return
+    with _pending_lock:
+        fields = _pending.pop(job_id, {})
+    fields.update(kwargs)
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _write(conn, job_id, fields, time.time())
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
 
 
 def get(job_id: str) -> Optional[dict]:
-    with _lock:
-        return dict(_store.get(job_id, {}))
+    row = _conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return {}
+    out = {k: row[k] for k in _COLUMNS}
+    out.update(json.loads(row["extra"] or "{}"))
+    out["queue_position"] = _position(_conn(), row) if row["status"] == "queued" and row["payload"] else None
+    # 本进程尚未落盘的 progress 也反映出来
+    with _pending_lock:
+        out.update(_pending.get(job_id, {}))
+    return out
 
 
 def exists(job_id: str) -> bool:
-    with _lock:
-        return job_id in _store
+    return _conn().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+
+# ── queue（api/scheduler.py 使用）────────────────────────────────────────────
+
+def _position(conn: sqlite3.Connection, row) -> int:
+    """排在 row 前面的已入队 job 数 + 1（顺序同 _QUEUE_ORDER）。"""
+    return conn.execute(
+        f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED} AND (priority > ? OR (priority = ? AND "
+        "(queued_at < ? OR (queued_at = ? AND job_id <= ?))))",
+        (row["priority"], row["priority"], row["queued_at"], row["queued_at"], row["job_id"]),
+    ).fetchone()[0]
+
+
+def enqueue(job_id: str, priority: int, payload: dict, max_queue: int) -> Optional[int]:
+    """把已创建的 job 放进队列并返回排队位置（1 起）；所有进程合计的排队数已达 max_queue 时返回 None。"""
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        depth = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {_QUEUED}").fetchone()[0]
+        if depth >= max_queue:
+            conn.execute("ROLLBACK")
+            return None
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET priority = ?, payload = ?, queued_at = ?, updated_at = ? WHERE job_id = ?",
+            (priority, json.dumps(payload, ensure_ascii=False), now, now, job_id),
+        )
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        position = _position(conn, row)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return position
+
+
+def claim(max_running: int) -> Optional[tuple[str, dict]]:
+    """
+    原子地取出队首的 job 并标记为 running（owner 为本进程），返回 (job_id, payload)。
+    队列为空，或所有进程合计在跑的 job 已达 max_running 时返回 None。
+    """
+    conn = _conn()
+    # 先不加写锁看一眼，空闲 worker 轮询时不去抢数据库的写锁
+    if conn.execute(f"SELECT 1 FROM jobs WHERE {_QUEUED} LIMIT 1").fetchone() is None:
+        return None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+        row = None
+        if running < max_running:
+            row = conn.execute(
+                f"SELECT job_id, payload FROM jobs WHERE {_QUEUED} ORDER BY {_QUEUE_ORDER} LIMIT 1"
+            ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, payload = NULL, updated_at = ? WHERE job_id = ?",
+                (INSTANCE_ID, time.time(), row["job_id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return (row["job_id"], json.loads(row["payload"])) if row is not None else None
+
+
+def queue_stats() -> dict:
+    """所有进程合计的 {"queued": 已入队数, "running": 在跑数}。"""
+    row = _conn().execute(
+        f"SELECT SUM({_QUEUED}) AS queued, SUM(status = 'running') AS running FROM jobs"
+    ).fetchone()
+    return {"queued": row["queued"] or 0, "running": row["running"] or 0}
+
+
+def queue_position(job_id: str) -> Optional[int]:
+    conn = _conn()
+    row = conn.execute(f"SELECT * FROM jobs WHERE job_id = ? AND {_QUEUED}", (job_id,)).fetchone()
+    return _position(conn, row) if row is not None else None
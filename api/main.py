@@ -5,6 +5,17 @@ Input (POST /generate):
   - story_title       : str  (Form)
   - events_json       : str  (Form) — JSON array of event titles, e.g. '["机场等待","到达酒店"]'
   - photos_0, photos_1, … : List[UploadFile]  (File) — photos for each event in order
+                            (any number of photos_N fields; N indexes events_json)
+  - priority          : int  (Form, optional) — larger runs first
+
+Jobs are queued on a bounded scheduler (JOB_WORKERS / JOB_MAX_QUEUE env vars) whose queue lives
+in the SQLite job store, so the limits hold across all uvicorn workers; when the queue is full
+POST /generate returns 429. GET /status reports queue_position, computed when it is read.
+Set JOB_EXECUTION_MODE=process to render each job in a pre-warmed worker process.
+Uploads are copied to disk in chunks off the event loop; a request whose photos exceed
+MAX_UPLOAD_BYTES (default 500 MB) is rejected with 413. Each saved photo is normalized
+(EXIF rotation, downscale to VISION_MAX_EDGE, JPEG) in a thread pool while the rest of the
+upload is still being written; vision calls read that derivative instead of the original.
 
 Character reference photos are baked in on the server (CHARACTER_PHOTOS_PATH env var).
 
@@ -14,20 +25,58 @@ Run locally:
   uvicorn api.main:app --reload --port 8000
 """
 
+import asyncio
 import json
 import os
+import re
+import shutil
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
 
-from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, Security, UploadFile
+from fastapi import Depends, FastAPI, Form, HTTPException, Request, Security, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.responses import JSONResponse
 
 from api import jobs
+from api.factory import factory
 from api.pipeline import JOBS_BASE_DIR, run_pipeline
+from api.scheduler import JOB_WORKERS, JobScheduler, QueueFullError
+from api.worker_pool import JOB_EXECUTION_MODE, PipelinePool
 
-app = FastAPI(title="MovieAgent API", version="1.0")
+# 有界调度：所有 uvicorn worker 合计 JOB_WORKERS 个 pipeline 并发，最多排队 JOB_MAX_QUEUE 个（队列在 job store 里）。
+# JOB_EXECUTION_MODE=process 时每个 job 在预热好的子进程里跑，API 进程只负责 HTTP。
+pipeline_pool = PipelinePool(run_pipeline, workers=JOB_WORKERS) if JOB_EXECUTION_MODE == "process" else None
+scheduler = JobScheduler(pipeline_pool.run if pipeline_pool else run_pipeline)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jobs.start()
+    if pipeline_pool:
+        pipeline_pool.start()
+    scheduler.start()
+    yield
+    scheduler.shutdown()
+    if pipeline_pool:
+        pipeline_pool.shutdown()
+
+
+app = FastAPI(title="MovieAgent API", version="1.0", lifespan=lifespan)
+
+# ── upload limits ─────────────────────────────────────────────────────────────
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+_UPLOAD_CHUNK = 1024 * 1024
+_PHOTO_FIELD = re.compile(r"^photos_(\d+)$")
+
+# 上传照片的视觉派生图（scripts/image_normalize.py）在这个线程池里生成
+_normalize_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("NORMALIZE_WORKERS", "4")),
+    thread_name_prefix="photo-normalize",
+)
 
 # ── auth ──────────────────────────────────────────────────────────────────────
 
@@ -46,37 +95,67 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(_BEARER)):
 
 # ── helpers ───────────────────────────────────────────────────────────────────
 
-def _save_upload(file: UploadFile, dest: Path) -> str:
+def _queue_full() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many queued jobs, please retry later",
+        headers={"Retry-After": "30"},
+    )
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Uploaded photos exceed {MAX_UPLOAD_BYTES} bytes")
+
+
+class _ByteBudget:
+    """单个请求的上传字节预算。"""
+
+    def __init__(self, limit: int):
+        self.remaining = limit
+
+    def consume(self, n: int):
+        self.remaining -= n
+        if self.remaining < 0:
+            raise _too_large()
+
+
+def _save_upload(file: UploadFile, dest: Path, budget: _ByteBudget) -> str:
+    """分块拷贝到磁盘（在线程池里执行，不阻塞事件循环），不把整张照片读进内存。"""
     dest.parent.mkdir(parents=True, exist_ok=True)
-    content = file.file.read()
+    file.file.seek(0)
     with open(dest, "wb") as f:
-        f.write(content)
+        while True:
+            chunk = file.file.read(_UPLOAD_CHUNK)
+            if not chunk:
+                break
+            budget.consume(len(chunk))
+            f.write(chunk)
     return str(dest)
 
 
+def _photo_fields(form) -> dict[int, list[UploadFile]]:
+    """收集所有 photos_N 字段：{N: [UploadFile, ...]}，N 不限于 0~9。"""
+    out: dict[int, list[UploadFile]] = {}
+    for key in set(form.keys()):
+        m = _PHOTO_FIELD.match(key)
+        if m:
+            out[int(m.group(1))] = [f for f in form.getlist(key) if not isinstance(f, str)]
+    return out
+
+
 # ── routes ────────────────────────────────────────────────────────────────────
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "scheduler": scheduler.stats()}
 
 
 @app.post("/generate", dependencies=[Depends(verify_token)])
 async def generate(
-    background_tasks: BackgroundTasks,
+    request: Request,
     story_title: str = Form(..., description="故事标题"),
     events_json: str = Form(..., description='事件标题 JSON 数组，如 ["机场等待", "到达酒店"]'),
-    # iOS sends photos_0, photos_1, ... as separate multipart fields
-    photos_0: List[UploadFile] = File(default=[]),
-    photos_1: List[UploadFile] = File(default=[]),
-    photos_2: List[UploadFile] = File(default=[]),
-    photos_3: List[UploadFile] = File(default=[]),
-    photos_4: List[UploadFile] = File(default=[]),
-    photos_5: List[UploadFile] = File(default=[]),
-    photos_6: List[UploadFile] = File(default=[]),
-    photos_7: List[UploadFile] = File(default=[]),
-    photos_8: List[UploadFile] = File(default=[]),
-    photos_9: List[UploadFile] = File(default=[]),
+    priority: int = Form(0, description="调度优先级，越大越先执行"),
 ):
     # ── parse events ──────────────────────────────────────────────────────
     try:
@@ -86,10 +165,16 @@ async def generate(
     except Exception:
         raise HTTPException(status_code=400, detail="events_json must be a non-empty JSON array of strings")
 
-    all_photo_fields = [
-        photos_0, photos_1, photos_2, photos_3, photos_4,
-        photos_5, photos_6, photos_7, photos_8, photos_9,
-    ]
+    # ── admission control：队列满了就不再接收上传 ─────────────────────────
+    if scheduler.is_full():
+        raise _queue_full()
+
+    if int(request.headers.get("content-length") or 0) > MAX_UPLOAD_BYTES:
+        raise _too_large()
+
+    # iOS sends photos_0, photos_1, ... as separate multipart fields；
+    # Form 参数已经触发过解析，这里拿到的是同一份缓存（文件已在 SpooledTemporaryFile 里）
+    photo_fields = _photo_fields(await request.form())
 
     # ── create job & save uploaded files ─────────────────────────────────
     job_id = str(uuid.uuid4())
@@ -97,28 +182,49 @@ async def generate(
 
     jdir = JOBS_BASE_DIR / job_id
     event_photo_paths: list[list[str]] = []
+    budget = _ByteBudget(MAX_UPLOAD_BYTES)
+    loop = asyncio.get_running_loop()
+    vision_input = factory.script_module("image_normalize").vision_input
+    normalizing = []
 
-    for i, title in enumerate(event_titles):
-        uploaded = all_photo_fields[i] if i < len(all_photo_fields) else []
-        saved = []
-        for j, f in enumerate(uploaded):
-            if not f.filename:
-                continue
-            ext = Path(f.filename).suffix or ".jpg"
-            dest = jdir / "events" / str(i) / f"{j:04d}{ext}"
-            saved.append(_save_upload(f, dest))
-        event_photo_paths.append(saved)
-
-    # ── launch background pipeline ────────────────────────────────────────
-    background_tasks.add_task(
-        run_pipeline,
-        job_id=job_id,
-        story_title=story_title,
-        event_titles=event_titles,
-        event_photo_paths=event_photo_paths,
-    )
+    try:
+        for i, title in enumerate(event_titles):
+            saved = []
+            for j, f in enumerate(photo_fields.get(i, [])):
+                if not f.filename:
+                    continue
+                ext = Path(f.filename).suffix or ".jpg"
+                dest = jdir / "events" / str(i) / f"{j:04d}{ext}"
+                path = await run_in_threadpool(_save_upload, f, dest, budget)
+                saved.append(path)
+                # 边收边处理：这张写完就交给线程池生成派生图，不等后面的照片
+                normalizing.append(loop.run_in_executor(_normalize_pool, vision_input, path))
+            event_photo_paths.append(saved)
+        await asyncio.gather(*normalizing)
+    except BaseException as e:
+        # 任何失败（超限、磁盘写满、损坏的图片……）都把 job 标成 error 并删掉已写的文件，不留下永远不会被调度的 queued 行；
+        # 先等其余派生图任务结束（忽略它们的异常，不掩盖原始错误）再删目录
+        await asyncio.gather(*normalizing, return_exceptions=True)
+        detail = e.detail if isinstance(e, HTTPException) else repr(e)
+        jobs.update(job_id, status="error", error=f"rejected: {detail}")
+        shutil.rmtree(str(jdir), ignore_errors=True)
+        raise
+
+    # ── enqueue pipeline ──────────────────────────────────────────────────
+    try:
+        position = scheduler.submit(
+            job_id,
+            priority=priority,
+            story_title=story_title,
+            event_titles=event_titles,
+            event_photo_paths=event_photo_paths,
+        )
+    except QueueFullError:
+        jobs.update(job_id, status="error", error="rejected: job queue is full")
+        shutil.rmtree(str(jdir), ignore_errors=True)
+        raise _queue_full()
 
-    return {"job_id": job_id, "status": "queued"}
+    return {"job_id": job_id, "status": "queued", "queue_position": position}
 
 
 @app.get("/status/{job_id}", dependencies=[Depends(verify_token)])
@@ -131,7 +237,6 @@ def status(job_id: str):
 @app.delete("/jobs/{job_id}", dependencies=[Depends(verify_token)])
 def delete_job(job_id: str):
     """Manually clean up a job's temp files."""
-    import shutil
     jdir = JOBS_BASE_DIR / job_id
     if jdir.exists():
         shutil.rmtree(str(jdir), ignore_errors=True)
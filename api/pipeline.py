@@ -1,6 +1,6 @@
 """
 MovieAgent pipeline runner for a single job.
-Called from main.py as a background task.
+Called from main.py through the bounded job scheduler (api/scheduler.py).
 
 Environment variables required:
   OPENAI_API_KEY
@@ -12,30 +12,29 @@ Environment variables required:
 
 Optional:
   LLM_MODEL           default gpt4-o
+  PIPELINE_STREAMING  default 0   设为 1 时场景规划 / 镜头规划 / 关键帧视频生成按 Sub-Script 流水线重叠执行
+  FUSED_PLANNING      default 0   设为 1 时每个 Sub-Script 一次 LLM 请求同时规划 scene 与镜头
+  STREAM_SHOTS        default 0   与 PIPELINE_STREAMING 合用：镜头规划流式返回，每个 Shot 写完即开始生成
   AWS_DEFAULT_REGION  default ap-southeast-1
+
+每个 job 的 LLM / vision / 关键帧 / 图生视频 用量（请求数、token、耗时、估算费用，见 movie_agent/metering.py）
+在 /status 的 usage 字段里随进度更新，job 结束（成功或失败）时完整明细写入 job 目录下的 usage.json。
 """
 
 import json
 import os
 import shutil
-import subprocess
-import sys
 import tempfile
-import threading
 from pathlib import Path
 from types import SimpleNamespace
 
 import boto3
 
 from api import jobs
-
-# 保证同一时刻只有一个 job 在进行 module reload + agent 初始化，避免并发时状态污染
-_PIPELINE_LOCK = threading.Lock()
+from api.factory import factory
 
 # ── paths ─────────────────────────────────────────────────────────────────────
 REPO_ROOT = Path(__file__).parent.parent.resolve()
-MOVIE_AGENT_DIR = REPO_ROOT / "movie_agent"
-SCRIPTS_DIR = REPO_ROOT / "scripts"
 
 CHARACTER_PHOTOS_PATH = os.environ.get(
     "CHARACTER_PHOTOS_PATH",
@@ -44,6 +43,9 @@ CHARACTER_PHOTOS_PATH = os.environ.get(
 S3_BUCKET = os.environ.get("S3_BUCKET", "")
 AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "ap-southeast-1")
 LLM_MODEL = os.environ.get("LLM_MODEL", "gpt4-o")
+PIPELINE_STREAMING = os.environ.get("PIPELINE_STREAMING", "0") == "1"
+FUSED_PLANNING = os.environ.get("FUSED_PLANNING", "0") == "1"
+STREAM_SHOTS = os.environ.get("STREAM_SHOTS", "0") == "1"
 
 JOBS_BASE_DIR = Path(tempfile.gettempdir()) / "movieagent_jobs"
 
@@ -71,6 +73,51 @@ def _upload_to_s3(local_path: str, job_id: str) -> str:
     return url
 
 
+def _build_args(**overrides) -> SimpleNamespace:
+    """API 固定使用 Gemini 关键帧 + Runway 图生视频，model config 由工厂缓存。"""
+    args = SimpleNamespace(
+        LLM=LLM_MODEL,
+        gen_model="Gemini",
+        audio_model="NoAudio",
+        talk_model=None,
+        Image2Video="Runway",
+        script_path="",
+        character_photo_path=CHARACTER_PHOTOS_PATH,
+        save_path="",
+        video_save_path="",
+        resume_from_shots=False,
+        skip_existing_keyframes=False,
+        only_first_scene=False,
+        only_planning=False,
+        fused_planning=FUSED_PLANNING,
+        stream_shots=STREAM_SHOTS,
+        crossfade=0.1,
+        final_name="final",
+        scene_style_text="",
+    )
+    for k, v in overrides.items():
+        setattr(args, k, v)
+    return factory.apply_model_configs(args, args.gen_model, args.Image2Video)
+
+
+def warmup():
+    """提前 import movie_agent/run.py 及其依赖（moviepy 等）并构建共享管道，供进程池 worker 启动时调用。"""
+    factory.run_module()
+    factory.story_to_script()
+    try:
+        factory.tools(_build_args())
+    except Exception as e:
+        # 缺 key 等问题留到真正跑 job 时再报错
+        print(f"[warmup] 共享管道初始化失败，将在首个 job 时重试: {e}")
+
+
+def _usage_summary(meter) -> dict:
+    """/status 里只放汇总（total / by_stage / by_provider），逐行明细留给 usage.json。"""
+    snap = meter.snapshot()
+    snap.pop("rows", None)
+    return snap
+
+
 # ── main pipeline ─────────────────────────────────────────────────────────────
 
 def run_pipeline(
@@ -85,6 +132,19 @@ def run_pipeline(
     event_photo_paths[i] = list of saved file paths for events[i].
     Characters are taken from CHARACTER_PHOTOS_PATH directory names if not provided.
     """
+    metering = factory.metering()
+    with metering.job() as meter:
+        try:
+            _run_pipeline(job_id, story_title, event_titles, event_photo_paths, characters, meter)
+        finally:
+            try:
+                meter.save(_job_dir(job_id) / "usage.json")
+                jobs.update(job_id, usage=_usage_summary(meter))
+            except Exception as e:
+                print(f"[usage] job {job_id} 用量写入失败: {e}")
+
+
+def _run_pipeline(job_id, story_title, event_titles, event_photo_paths, characters, meter):
     try:
         jdir = _job_dir(job_id)
 
@@ -120,73 +180,40 @@ def run_pipeline(
         jobs.update(job_id, progress=15, step="generating script synopsis")
         script_synopsis_path = jdir / "script_synopsis.json"
         events_detail_path = jdir / "events_detail.json"
-        result = subprocess.run(
-            [
-                sys.executable,
-                str(SCRIPTS_DIR / "story_to_script.py"),
-                str(config_path),
-                "-o", str(script_synopsis_path),
-                "--llm", LLM_MODEL,
-                "--save-events", str(events_detail_path),
-            ],
-            capture_output=True,
-            text=True,
-            cwd=str(REPO_ROOT),
+
+        def _on_event(done: int, total: int, _event: dict):
+            jobs.update(
+                job_id,
+                progress=15 + int(10 * done / max(total, 1)),
+                step=f"generating script synopsis ({done}/{total} events)",
+            )
+
+        vision_cache = {"hits": 0, "misses": 0}
+        factory.story_to_script().generate_script_synopsis(
+            story_config,
+            script_synopsis_path,
+            llm=LLM_MODEL,
+            save_events=events_detail_path,
+            progress_callback=_on_event,
+            cache_stats=vision_cache,
         )
-        if result.returncode != 0:
-            raise RuntimeError(f"story_to_script failed:\n{result.stderr[-2000:]}")
+        jobs.update(job_id, vision_cache=vision_cache, usage=_usage_summary(meter))
 
         # ── 4. build ScriptBreakAgent args namespace ───────────────────────
         jobs.update(job_id, progress=25, step="planning scenes & shots")
-        with _PIPELINE_LOCK:
-            # module reload 必须在锁内执行，避免并发 reload 导致模块状态混乱
-            if str(MOVIE_AGENT_DIR) not in sys.path:
-                sys.path.insert(0, str(MOVIE_AGENT_DIR))
-            import importlib
-            run_mod = importlib.reload(importlib.import_module("run"))
-            ScriptBreakAgent = run_mod.ScriptBreakAgent
-            load_config = run_mod.load_config
-
         video_save_path = jdir / "video"
         video_save_path.mkdir(exist_ok=True)
 
-        args = SimpleNamespace(
-            LLM=LLM_MODEL,
-            gen_model="Gemini",
-            audio_model="NoAudio",
-            talk_model=None,
-            Image2Video="Runway",
+        args = _build_args(
             script_path=str(script_synopsis_path),
-            character_photo_path=CHARACTER_PHOTOS_PATH,
             save_path=str(jdir / "results"),
             video_save_path=str(video_save_path),
-            resume_from_shots=False,
-            skip_existing_keyframes=False,
-            only_first_scene=False,
-            only_planning=False,
-            crossfade=0.1,
-            final_name="final",
-            scene_style_text="",
         )
-        # load model configs
-        for model_name in ("Gemini", "Runway"):
-            cfg = load_config(model_name)
-            for k, v in cfg.items():
-                if not getattr(args, k, None):
-                    setattr(args, k, v)
 
         # ── 5. run pipeline ────────────────────────────────────────────────
-        # chdir 已删除：load_config 改为用 __file__ 的绝对路径，不再依赖 CWD
-        agent = ScriptBreakAgent(
-            args,
-            sample_model=args.gen_model,
-            audio_model=args.audio_model,
-            talk_model=args.talk_model,
-            Image2Video=args.Image2Video,
-            script_path=str(script_synopsis_path),
-            character_photo_path=CHARACTER_PHOTOS_PATH,
-            save_mode="video",
-        )
+        # 工厂复用进程内已 import 的 run 模块、共享的 Gemini/Runway 管道和 OpenAI client，
+        # 这里只创建本 job 的轻量 agent，无需全局锁
+        agent = factory.new_agent(args)
         # override save paths to job dir
         agent.save_path = str(jdir / "results")
         agent.video_save_path = str(video_save_path)
@@ -223,16 +250,41 @@ def run_pipeline(
             json.dumps(step1, ensure_ascii=False, indent=4), encoding="utf-8"
         )
 
-        jobs.update(job_id, progress=45, step="ScenePlanning")
-        agent.ScenePlanning()
+        if PIPELINE_STREAMING:
+            jobs.update(job_id, progress=45, step="planning & generating (pipelined)")
+
+            shown = [45]
+
+            def _on_shot(done: int, planned: int, planning_done: bool):
+                # 规划没结束时镜头总数未知：先按已规划镜头估计且不超过 70，进度只增不减
+                span = 45 if planning_done else 25
+                shown[0] = max(shown[0], 45 + int(span * done / max(planned, 1)))
+                jobs.update(
+                    job_id,
+                    progress=shown[0],
+                    step=f"generating keyframes & video ({done}/{planned} shots"
+                         + ("" if planning_done else ", planning…") + ")",
+                    usage=_usage_summary(meter),
+                )
+
+            agent.Pipelined(progress_callback=_on_shot)
+        elif FUSED_PLANNING:
+            jobs.update(job_id, progress=45, step="planning scenes & shots (fused)")
+            agent.FusedPlanning()
+
+            jobs.update(job_id, progress=65, step="generating keyframes & video", usage=_usage_summary(meter))
+            agent.VideoAudioGen()
+        else:
+            jobs.update(job_id, progress=45, step="ScenePlanning")
+            agent.ScenePlanning()
 
-        jobs.update(job_id, progress=55, step="ShotPlotCreate")
-        agent.ShotPlotCreate()
+            jobs.update(job_id, progress=55, step="ShotPlotCreate")
+            agent.ShotPlotCreate()
 
-        jobs.update(job_id, progress=65, step="generating keyframes & video")
-        agent.VideoAudioGen()
+            jobs.update(job_id, progress=65, step="generating keyframes & video", usage=_usage_summary(meter))
+            agent.VideoAudioGen()
 
-        jobs.update(job_id, progress=90, step="concatenating clips")
+        jobs.update(job_id, progress=90, step="concatenating clips", usage=_usage_summary(meter))
         agent.Final(crossfade=args.crossfade, final_name=args.final_name)
 
         # ── 6. upload to S3 ────────────────────────────────────────────────
@@ -0,0 +1,122 @@
+"""
+有界的多 worker 任务调度器，替代 FastAPI BackgroundTasks。
+
+- 队列就在 job store（SQLite）里，所有 uvicorn worker 共用：submit() 把 job 的参数写进表，
+  worker 线程用 jobs.claim() 原子地取走队首（priority 越大越先跑，同优先级 FIFO），同一个 job 只会被一个进程执行。
+- 同时在跑的 pipeline 数按表里的 running 行统计，所有进程合计不超过 JOB_WORKERS，避免把 Gemini / Runway 配额打满。
+- 所有进程合计的排队数达到 max_queue 时 submit() 抛 QueueFullError，由 main.py 转成 429。
+- queue_position 不写库，/status 读取时由 jobs.get() 按表现算。
+- 其他进程入队 / 跑完的 job 本进程收不到通知，空闲 worker 每 JOB_POLL_INTERVAL 秒查一次表。
+
+Environment variables (optional):
+  JOB_WORKERS         default 2     同时运行的 pipeline 数（所有 uvicorn worker 合计）
+  JOB_MAX_QUEUE       default 20    最多排队的任务数（所有 uvicorn worker 合计），超过返回 429
+  JOB_POLL_INTERVAL   default 1.0   空闲 worker 查询队列的间隔（秒）
+"""
+import os
+import threading
+import traceback
+from typing import Callable, Optional
+
+from api import jobs
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.environ.get("JOB_MAX_QUEUE", "20"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+
+
+class QueueFullError(RuntimeError):
+    """排队任务数已达上限。"""
+
+
+class JobScheduler:
+    def __init__(self, fn: Callable, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE):
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._running: set[str] = set()  # 本进程在跑的 job
+        self._stopping = False
+
+    # ── lifecycle ─────────────────────────────────────────────────────────────
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def shutdown(self, wait: bool = False):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        if wait:
+            for t in threads:
+                t.join()
+
+    # ── queue ─────────────────────────────────────────────────────────────────
+
+    def is_full(self) -> bool:
+        return jobs.queue_stats()["queued"] >= self.max_queue
+
+    def submit(self, job_id: str, priority: int = 0, **kwargs) -> int:
+        """入队（kwargs 须可 JSON 序列化）并返回排队位置（1 起）。队列已满时抛 QueueFullError。"""
+        position = jobs.enqueue(job_id, priority, kwargs, self.max_queue)
+        if position is None:
+            raise QueueFullError(f"job queue is full ({self.max_queue} queued)")
+        with self._cond:
+            self._cond.notify()
+        return position
+
+    def position(self, job_id: str) -> Optional[int]:
+        return jobs.queue_position(job_id)
+
+    def stats(self) -> dict:
+        with self._cond:
+            running_here = len(self._running)
+        return {
+            "workers": self.workers,
+            **jobs.queue_stats(),
+            "running_here": running_here,
+            "max_queue": self.max_queue,
+        }
+
+    # ── worker ────────────────────────────────────────────────────────────────
+
+    def _claim(self):
+        try:
+            return jobs.claim(self.workers)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            claimed = self._claim()
+            if claimed is None:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(timeout=JOB_POLL_INTERVAL)
+                continue
+            job_id, kwargs = claimed
+            with self._cond:
+                self._running.add(job_id)
+            try:
+                self.fn(job_id=job_id, **kwargs)
+            except Exception:
+                # run_pipeline 已把错误写进 job store，这里只保证 worker 不退出
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    # 空出一个全局名额，让本进程空闲的 worker 立刻再试一次
+                    self._cond.notify_all()
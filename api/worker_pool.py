@@ -0,0 +1,101 @@
+"""
+pipeline 进程池（JOB_EXECUTION_MODE=process）。
+
+每个 job 在预先启动、预热好的子进程里运行：moviepy 编码、PIL 补边、base64 编码都不再
+占用 API 进程的 GIL，/status 和 /health 在多部影片同时渲染时依然及时响应。
+子进程里的 jobs.update() 被重定向到一个 multiprocessing 队列，API 进程的监听线程
+把它们写回 job store。
+
+调度仍由 api/scheduler.py 负责：scheduler 的每个 worker 线程把一个 job 交给进程池并等待结果，
+所以每个 API 进程的子进程数 = JOB_WORKERS，排队 / 优先级 / 429 语义不变。
+
+Environment variables (optional):
+  JOB_EXECUTION_MODE   default thread   thread | process
+"""
+import multiprocessing as mp
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from api import jobs
+
+JOB_EXECUTION_MODE = os.environ.get("JOB_EXECUTION_MODE", "thread")
+
+
+# ── child side ────────────────────────────────────────────────────────────────
+
+def _init_worker(queue):
+    """子进程启动时执行：转发 job 更新 + 预热 pipeline 依赖。"""
+    jobs.set_forwarder(lambda job_id, fields: queue.put((job_id, fields)))
+    from api import pipeline
+    pipeline.warmup()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+# ── parent side ───────────────────────────────────────────────────────────────
+
+class PipelinePool:
+    def __init__(self, fn: Callable, workers: int):
+        self.fn = fn
+        self.workers = max(1, workers)
+        # spawn：不 fork 带着 uvicorn 事件循环和线程的父进程
+        self._ctx = mp.get_context("spawn")
+        self._queue = None
+        self._pool = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._queue = self._ctx.Queue()
+        self._listener = threading.Thread(target=self._listen, name="job-progress-listener", daemon=True)
+        self._listener.start()
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_init_worker,
+            initargs=(self._queue,),
+        )
+        # 一次性提交 workers 个任务，让进程池把所有子进程拉起来并完成预热
+        for f in [pool.submit(_ping) for _ in range(self.workers)]:
+            f.result()
+        return pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._queue is not None:
+            self._queue.put(None)
+
+    def _listen(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, fields = item
+            try:
+                jobs.update(job_id, **fields)
+            except Exception:
+                traceback.print_exc()
+
+    def run(self, job_id: str, **kwargs):
+        """在子进程里跑一个 job 并阻塞到结束（由 scheduler 的 worker 线程调用）。"""
+        pool = self._pool
+        try:
+            return pool.submit(self.fn, job_id=job_id, **kwargs).result()
+        except BrokenProcessPool:
+            # 子进程被 OOM killer 等强杀：标记失败并重建进程池
+            jobs.update(job_id, status="error", error="pipeline worker process died unexpectedly")
+            with self._lock:
+                if self._pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = self._new_pool()
+            raise
@@ -1,84 +1,320 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import hashlib
 import json
 import os
+import threading
+import weakref
+
+import cassette
+import llm_cache
+import metering
+from json_stream import JSONItemStream
+from llm_schema import LLMOutputError, repair_json
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 共享连接池大小：所有 agent / 所有 job 的并发 LLM 请求共用这些 keep-alive 连接
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+# use_history=True 时保留的对话历史上限（估算 token）；超出后从最早的一轮开始丢弃，system prompt 始终保留
+LLM_HISTORY_TOKENS = int(os.environ.get("LLM_HISTORY_TOKENS", "8000"))
+# 提示前缀缓存：规划阶段的 CoT system prompt 有 1k～2k token，每次请求都原样重发。
+# 消息总是 system 在前、本次输入在后，前缀逐字节不变，provider 的 prompt caching 才能命中
+# （OpenAI ≥1024 token 自动缓存，DashScope 隐式缓存同理）；OpenAI 另按 system prompt 传 prompt_cache_key，
+# 让同一前缀的请求路由到同一缓存。命中的输入 token 记在 cached_tokens_count 与 metering 里。
+LLM_PROMPT_CACHE = os.environ.get("LLM_PROMPT_CACHE", "1") != "0"
+
+# 进程内共享的 OpenAI client（线程安全，自带连接池），按 endpoint 复用，
+# 避免每个 agent / 每个 job 都新建 client、重新握手
+_clients = {}
+_clients_lock = threading.Lock()
+# AsyncOpenAI 的连接池绑定在创建它的 event loop 上，按 loop 各建一份；loop 被回收后自动丢弃
+_async_clients = weakref.WeakKeyDictionary()
+# 同步调用方（run.py 的 _fan_out、流水线规划线程）共用的常驻 event loop，见 run_coro
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def _estimate_tokens(text):
+    """粗略估算：UTF-8 字节数 / 4（英文约 4 字符一个 token，中文约 1～1.5 字一个 token）。"""
+    return len(str(text or "").encode("utf-8")) // 4 + 1
+
+
+def _check_finish(finish_reason, content=""):
+    """
+    finish_reason == "length"：回复被输出 token 上限截断。截断的 JSON 即使 repair_json 能补齐括号也缺内容，
+    按输出错误处理（调用方会重问），不做修补，也不进回复缓存 / cassette。
+    """
+    if finish_reason == "length":
+        raise LLMOutputError("response truncated by the output token limit (finish_reason=length)", raw=content)
+
+
+def _endpoint(llm_type):
+    return "openai" if llm_type == "gpt4-o" else "dashscope"
+
+
+def _http_client(is_async=False):
+    import httpx
+    try:
+        from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+    except ImportError:  # openai<1.17
+        DefaultHttpxClient, DefaultAsyncHttpxClient = httpx.Client, httpx.AsyncClient
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    return (DefaultAsyncHttpxClient if is_async else DefaultHttpxClient)(limits=limits)
+
+
+def _new_client(key, is_async=False):
+    cls = AsyncOpenAI if is_async else OpenAI
+    if key == "openai":
+        return cls(api_key=cassette.api_key(os.getenv("OPENAI_API_KEY")), http_client=_http_client(is_async))
+    return cls(
+        api_key=cassette.api_key(os.getenv("OPENAI_API_KEY")),  # how to get API Key：https://help.aliyun.com/zh/model-studio/developer-reference/get-api-key
+        base_url=DASHSCOPE_BASE_URL,
+        http_client=_http_client(is_async),
+    )
+
+
+def get_client(llm_type):
+    """gpt4-o 走 OpenAI，其余模型走阿里云百炼兼容接口。"""
+    key = _endpoint(llm_type)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _new_client(key)
+        return _clients[key]
+
+
+def get_async_client(llm_type):
+    """当前 event loop 内共享的 AsyncOpenAI（须在协程里调用）。"""
+    loop = asyncio.get_running_loop()
+    key = _endpoint(llm_type)
+    with _clients_lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        if key not in per_loop:
+            per_loop[key] = _new_client(key, is_async=True)
+        return per_loop[key]
+
+
+def _background_loop():
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+def run_coro(coro):
+    """
+    在进程内常驻的后台 event loop 上运行协程，阻塞到它结束并返回结果；任意线程（可多个同时）调用。
+    代替每次 asyncio.run：不会每个阶段新建 loop、AsyncOpenAI 和连接池，连接跨阶段 / 跨 job 复用。
+    协程在调用方的 contextvars 上下文里运行（当前 job 的 Meter 照常生效）。
+    """
+    loop = _background_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("run_coro() called from the background loop itself; await the coroutine instead")
+    done = concurrent.futures.Future()
+
+    def _start():
+        # 这个回调在调用方 context 的拷贝里执行，task 创建时继承它
+        task = loop.create_task(coro)
+
+        def _finish(t):
+            if t.cancelled():
+                done.cancel()
+            elif t.exception() is not None:
+                done.set_exception(t.exception())
+            else:
+                done.set_result(t.result())
+        task.add_done_callback(_finish)
+
+    loop.call_soon_threadsafe(_start, context=contextvars.copy_context())
+    return done.result()
+
+
+def _shutdown_loop():
+    """进程退出时关闭后台 loop 上的 AsyncOpenAI（释放 keep-alive 连接）并停止 loop。"""
+    loop = _loop
+    if loop is None or not loop.is_running():
+        return
+    clients = list(_async_clients.get(loop, {}).values())
+
+    async def _close():
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), loop).result(timeout=5)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(_shutdown_loop)
+
 
 class BaseAgent:
-    def __init__(self, llm_type, system_prompt="", use_history=True, temp=0, top_p=1):
+    def __init__(self, llm_type, system_prompt="", use_history=True, temp=0, top_p=1, stage=None,
+                 history_tokens=None):
         self.use_history = use_history
+        # use_history=False 时不保留任何对话；True 时按 token 预算保留最近的若干轮（滑动窗口）
+        self.history_tokens = history_tokens or LLM_HISTORY_TOKENS
+        self.history_dropped = 0
+        self.stage = stage  # 阶段名，用于 LLM_CACHE_BYPASS 与缓存命中统计
         self.llm_type = llm_type
-        self.streaming = False
-        if llm_type == "gpt4-o":
-            self.client = OpenAI()
-        elif llm_type == "deepseek-r1":
-            self.client = OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),  # how to get API Key：https://help.aliyun.com/zh/model-studio/developer-reference/get-api-key
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-            )
-            self.streaming = True
-        elif llm_type == "deepseek-v3":
-            self.client = OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),  # how to get API Key：https://help.aliyun.com/zh/model-studio/developer-reference/get-api-key
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-            )
-            self.streaming = True
-        else:
-            self.client = OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),  # how to get API Key：https://help.aliyun.com/zh/model-studio/developer-reference/get-api-key
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-            )
+        self.streaming = llm_type in ("deepseek-r1", "deepseek-v3")
+        self.client = self._get_client(llm_type)
         
         self.system = system_prompt
+        # 同一 system prompt（+ 模型）的 agent 共用一个 key，跨 agent / 跨 job 都能命中同一份前缀缓存
+        self.prompt_cache_key = "movieagent-" + hashlib.sha256(
+            f"{self.model_name}\n{system_prompt}".encode("utf-8")).hexdigest()[:16]
         self.temp = temp
         self.top_p = top_p
         self.input_tokens_count = 0
         self.output_tokens_count = 0
+        self.cached_tokens_count = 0  # provider 前缀缓存命中的输入 token
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._usage_lock = threading.Lock()  # 多线程并发调用同一个 agent 时保护计数
         self.messages = []
         if self.system:
             self.messages.append({"role": "system", "content": system_prompt})
     
     
-    def __call__(self, message, parse=False):
-        self.messages.append({"role": "user", "content": message})
-        result = self.generate(message, parse)
-        self.messages.append({"role": "assistant", "content": result})
+    def _get_client(self, llm_type):
+        return get_client(llm_type)
+
+    def __call__(self, message, parse=False, validate=None, on_item=None):
+        """
+        on_item(path, obj) 可选：流式请求，回复中每个 "Shot N" / "Scene N" / "Sub-Script N" 对象
+        一闭合就回调（见 json_stream.py），不必等整段回复结束。
+        """
+        self._remember({"role": "user", "content": message})
+        result, cache, key = self._generate(message, parse, on_item)
+        return self._finish(result, parse, cache, key, validate)
+
+    def _finish(self, result, parse, cache, key, validate=None):
+        """validate(parsed) 可选：结构不对时抛异常，与 JSON 解析失败一样不会留在缓存里。"""
+        self._remember({"role": "assistant", "content": result})
 
         print(result)
         if parse:
             try:
                 result = self.parse_json(result)
-            except:
-                raise Exception("Error content is list below:\n", result)
+            except LLMOutputError:
+                if cache is not None:
+                    cache.delete(key)  # 解析失败的回复不留在缓存里，重跑时重新请求
+                raise
+            if validate is not None:
+                try:
+                    validate(result)
+                except Exception:
+                    if cache is not None:
+                        cache.delete(key)
+                    raise
             
         return result
         
     
     
     def generate(self, message, json_format):
+        return self._generate(message, json_format)[0]
+
+    def _input_messages(self, message):
         if self.use_history:
-            input_messages = self.messages
-        else:
-            input_messages = [
-                {"role": "system", "content": self.system},
-                {"role": "user", "content": message}
-            ]
-            
-        
+            return list(self.messages)
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": message}
+        ]
+
+    def _cache_lookup(self, input_messages, json_format):
+        """可选的磁盘缓存：完全相同的请求直接返回上次的回复。返回 (cache, key, 命中的回复或 None)。"""
+        cache = llm_cache.get_cache(self.stage)
+        if cache is None:
+            return None, None, None
+        key = llm_cache.fingerprint(self.llm_type, self.model_name, input_messages, self.temp, self.top_p, json_format)
+        cached = cache.get(key)
+        llm_cache.record(self.stage, hit=cached is not None)
+        with self._usage_lock:  # 同一个 agent 会被 _fan_out / 流水线规划并发调用
+            if cached is not None:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        if cached is not None:
+            metering.record(self.stage, _endpoint(self.llm_type), self.model_name, cache_hits=1)
+        return cache, key, cached
+
+    def _generate(self, message, json_format, on_item=None):
+        input_messages = self._input_messages(message)
+        stream = JSONItemStream(on_item) if on_item is not None else None
+        cache, key, result = self._cache_lookup(input_messages, json_format)
+        if result is None:
+            with metering.timed(self.stage, _endpoint(self.llm_type), self.model_name):
+                result = cassette.through(
+                    "llm", self._cassette_payload(input_messages, json_format),
+                    lambda: self._request(input_messages, json_format, stream))
+            if stream is not None and cassette.replaying():
+                stream.feed(result)  # 回放时没有真正的流，一次性喂给解析器
+            if cache is not None and result:
+                cache.put(key, result)
+        elif stream is not None:
+            stream.feed(result)  # 命中缓存时一次性回放所有条目
+        return result, cache, key
+
+    def _cassette_payload(self, input_messages, json_format):
+        """cassette 指纹：与回复缓存相同的请求内容。"""
+        return {"llm_type": self.llm_type, "model": self.model_name, "messages": input_messages,
+                "temperature": self.temp, "top_p": self.top_p, "json_format": bool(json_format)}
+
+    def _request_kwargs(self, input_messages, json_format):
+        kwargs = {"model": self.model_name, "messages": input_messages}
         if self.llm_type == "gpt4-o":
+            kwargs.update(temperature=self.temp, top_p=self.top_p)
             if json_format:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-2024-08-06", # gpt-4
-                    messages=input_messages,
-                    temperature=self.temp,
-                    top_p=self.top_p,
-                    response_format = { "type": "json_object" }
-                    )
-            else:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-2024-08-06", # gpt-4
-                    messages=input_messages,
-                    temperature=self.temp,
-                    top_p=self.top_p,
-                    )
+                kwargs["response_format"] = {"type": "json_object"}
+            if LLM_PROMPT_CACHE and self.system:
+                # extra_body：旧版 openai SDK 的 create() 没有 prompt_cache_key 形参
+                kwargs["extra_body"] = {"prompt_cache_key": self.prompt_cache_key}
+        return kwargs
+
+    def _stream_gpt4o(self, input_messages, json_format, stream):
+        """gpt4-o 流式请求：边收边喂给增量 JSON 解析器；token 用量取最后的 usage chunk。"""
+        completion = self.client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._request_kwargs(input_messages, json_format),
+        )
+        answer_content, finish_reason = "", None
+        for chunk in completion:
+            if getattr(chunk, "usage", None):
+                self.update_tokens_count(chunk)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                answer_content += chunk.choices[0].delta.content
+                stream.feed(chunk.choices[0].delta.content)
+        _check_finish(finish_reason, answer_content)
+        return answer_content
+
+    @property
+    def model_name(self):
+        return "gpt-4o-2024-08-06" if self.llm_type == "gpt4-o" else self.llm_type
+
+    def _request(self, input_messages, json_format, stream=None):
+        if self.llm_type == "gpt4-o" and stream is not None:
+            return self._stream_gpt4o(input_messages, json_format, stream)
+        if self.llm_type == "gpt4-o":
+            response = self.client.chat.completions.create(**self._request_kwargs(input_messages, json_format))
         elif self.llm_type == "deepseek-r1":
             
             if not self.streaming:
@@ -91,18 +327,23 @@ class BaseAgent:
                 reasoning_content = ""  # 定义完整思考过程
                 answer_content = ""     # 定义完整回复
                 is_answering = False   # 判断是否结束思考过程并开始回复
+                finish_reason = None
 
                 completion = self.client.chat.completions.create(
                     model="deepseek-r1",  # 此处以 deepseek-r1 为例，可按需更换模型名称
                     messages=input_messages,
-                    stream=True
+                    stream=True,
+                    stream_options={"include_usage": True},
                 )
                 for chunk in completion:
                     # 如果chunk.choices为空，则打印usage
                     if not chunk.choices:
                         print("\nUsage:")
                         print(chunk.usage)
+                        if chunk.usage:
+                            self.update_tokens_count(chunk)
                     else:
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
                         delta = chunk.choices[0].delta
                         # 打印思考过程
                         if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
@@ -115,6 +356,9 @@ class BaseAgent:
                             # 打印回复过程
                             print(delta.content, end='', flush=True)
                             answer_content += delta.content
+                            if stream is not None:
+                                stream.feed(delta.content)
+                _check_finish(finish_reason, answer_content)
                 return answer_content
         elif self.llm_type == "deepseek-v3":
             
@@ -128,18 +372,23 @@ class BaseAgent:
                 reasoning_content = ""  # 定义完整思考过程
                 answer_content = ""     # 定义完整回复
                 is_answering = False   # 判断是否结束思考过程并开始回复
+                finish_reason = None
 
                 completion = self.client.chat.completions.create(
                     model="deepseek-v3",  # 此处以 deepseek-r1 为例，可按需更换模型名称
                     messages=input_messages,
-                    stream=True
+                    stream=True,
+                    stream_options={"include_usage": True},
                 )
                 for chunk in completion:
                     # 如果chunk.choices为空，则打印usage
                     if not chunk.choices:
                         print("\nUsage:")
                         print(chunk.usage)
+                        if chunk.usage:
+                            self.update_tokens_count(chunk)
                     else:
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
                         delta = chunk.choices[0].delta
                         # 打印思考过程
                         if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
@@ -152,6 +401,9 @@ class BaseAgent:
                             # 打印回复过程
                             print(delta.content, end='', flush=True)
                             answer_content += delta.content
+                            if stream is not None:
+                                stream.feed(delta.content)
+                _check_finish(finish_reason, answer_content)
                 return answer_content
             
         else:
@@ -161,27 +413,143 @@ class BaseAgent:
                         )
             
         self.update_tokens_count(response)
+        content = response.choices[0].message.content
+        _check_finish(response.choices[0].finish_reason, content)
+        if stream is not None:
+            stream.feed(content)
+        return content
+
+    # ── async 接口：任何 BaseAgent 都可以在协程里 await agent.acall(...)，走共享的 AsyncOpenAI ──
+
+    async def acall(self, message, parse=False, validate=None, on_item=None):
+        self._remember({"role": "user", "content": message})
+        result, cache, key = await self._agenerate(message, parse, on_item)
+        return self._finish(result, parse, cache, key, validate)
+
+    async def _agenerate(self, message, json_format, on_item=None):
+        input_messages = self._input_messages(message)
+        stream = JSONItemStream(on_item) if on_item is not None else None
+        cache, key, result = self._cache_lookup(input_messages, json_format)
+        if result is None:
+            with metering.timed(self.stage, _endpoint(self.llm_type), self.model_name):
+                result = await cassette.athrough(
+                    "llm", self._cassette_payload(input_messages, json_format),
+                    lambda: self._arequest(input_messages, json_format, stream))
+            if stream is not None and cassette.replaying():
+                stream.feed(result)
+            if cache is not None and result:
+                cache.put(key, result)
+        elif stream is not None:
+            stream.feed(result)
+        return result, cache, key
+
+    async def _arequest(self, input_messages, json_format, stream=None):
+        client = get_async_client(self.llm_type)
+        kwargs = self._request_kwargs(input_messages, json_format)
+
+        if self.streaming or stream is not None:
+            # 流式回复：只收集正式回答，思考过程（reasoning_content）丢弃；并发时不逐 token 打印
+            kwargs["stream_options"] = {"include_usage": True}
+            answer_content, finish_reason = "", None
+            completion = await client.chat.completions.create(stream=True, **kwargs)
+            async for chunk in completion:
+                if getattr(chunk, "usage", None):
+                    self.update_tokens_count(chunk)
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta
+                if getattr(delta, "reasoning_content", None) is None and delta.content:
+                    answer_content += delta.content
+                    if stream is not None:
+                        stream.feed(delta.content)
+            _check_finish(finish_reason, answer_content)
+            return answer_content
+
+        response = await client.chat.completions.create(**kwargs)
+        self.update_tokens_count(response)
+        _check_finish(response.choices[0].finish_reason, response.choices[0].message.content)
         return response.choices[0].message.content
     
     
     def parse_json(self, response):
-        response = response.replace("```json","")
-        response = response.replace("```","")
-        return json.loads(response)
+        # 代码块标记、前后多余文字、尾随逗号、被截断的括号先在本地修复（llm_schema.repair_json）
+        return repair_json(response)
 
     
     def add(self, message: dict):
-        self.messages.append(message)
+        self._remember(message, force=True)
+
+    def _remember(self, message: dict, force=False):
+        """
+        记录一条对话。use_history=False 时请求只用 system + 当前 message，历史没有用处，直接不保留
+        （长期复用的 agent 不会无限占内存）；force=True（显式 add）除外。
+        保留时超出 history_tokens 就从最早的一轮开始整轮丢弃（user 消息连同其后的 assistant 回复），
+        system prompt 之后总是从 user 消息开始，不会留下没有提问的回复；最新一轮总是保留。
+        常驻大小与丢弃条数记进 metering（history_tokens 取峰值，history_dropped 累加），出现在 usage.json 与 /status。
+        """
+        if not (self.use_history or force):
+            return
+        with self._usage_lock:
+            self.messages.append(message)
+            head = 1 if self.messages and self.messages[0].get("role") == "system" else 0
+            total = sum(_estimate_tokens(m.get("content")) for m in self.messages)
+            dropped_now = 0
+            # 最新一轮的起点：最后一条 user 消息（没有时只保留最新一条）
+            last_turn = next((i for i in range(len(self.messages) - 1, head - 1, -1)
+                              if self.messages[i].get("role") == "user"), len(self.messages) - 1)
+            while total > self.history_tokens and last_turn > head:
+                end = head + 1
+                while end < last_turn and self.messages[end].get("role") != "user":
+                    end += 1
+                dropped = self.messages[head:end]
+                del self.messages[head:end]
+                last_turn -= len(dropped)
+                total -= sum(_estimate_tokens(m.get("content")) for m in dropped)
+                self.history_dropped += len(dropped)
+                dropped_now += len(dropped)
+        metering.record(self.stage, _endpoint(self.llm_type), self.model_name,
+                        history_tokens=total, history_dropped=dropped_now)
+
+    @property
+    def history_size(self):
+        """(常驻消息条数, 估算 token 数)，含 system prompt。"""
+        return len(self.messages), sum(_estimate_tokens(m.get("content")) for m in self.messages)
     
     
     def update_tokens_count(self, response):
-        self.input_tokens_count += response.usage.prompt_tokens
-        self.output_tokens_count += response.usage.completion_tokens
+        with self._usage_lock:
+            self.input_tokens_count += response.usage.prompt_tokens
+            self.output_tokens_count += response.usage.completion_tokens
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            self.cached_tokens_count += (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        metering.record_usage(self.stage, _endpoint(self.llm_type), self.model_name, response.usage)
     
     
     def show_usage(self):
         print(f"Total input tokens used: {self.input_tokens_count}\nTotal output tokens used: {self.output_tokens_count}")
-        
+        if self.cached_tokens_count:
+            share = self.cached_tokens_count / max(self.input_tokens_count, 1)
+            print(f"Prompt cache: {self.cached_tokens_count} cached input tokens ({share:.0%})")
+        if self.cache_hits or self.cache_misses:
+            rate = self.cache_hits / (self.cache_hits + self.cache_misses)
+            print(f"LLM cache: {self.cache_hits} hits / {self.cache_misses} misses ({rate:.0%})")
+        n, tokens = self.history_size
+        print(f"History: {n} messages resident (~{tokens} tokens, {self.history_dropped} dropped)")
+
+
+class AsyncBaseAgent(BaseAgent):
+    """
+    BaseAgent 的 async 版本：await agent(message, parse=True)，等同于 BaseAgent.acall。
+    同一 event loop 里的所有 agent 共用一个 AsyncOpenAI（get_async_client；同步代码用 run_coro 交给常驻的后台 loop），
+    并发请求复用 keep-alive 连接（上限 LLM_MAX_CONNECTIONS），不必每个 agent 各自握手。
+    """
 
+    def _get_client(self, llm_type):
+        return None  # 调用时按当前 event loop 取共享 client
 
+    async def __call__(self, message, parse=False, validate=None, on_item=None):
+        return await self.acall(message, parse, validate, on_item)
 
+    async def generate(self, message, json_format):
+        return (await self._agenerate(message, json_format))[0]
@@ -0,0 +1,362 @@
+"""
+规划阶段的离线批量模式：不赶时间的故事（例如夜间批量回填）不再逐个在线请求 ScenePlanning / ShotPlotCreate，
+而是把许多 job 的请求攒进一个批次文件交给批量接口，用延迟换吞吐 —— 批量请求有单独的配额、不占在线限流，单价也更低。
+
+一次批量运行（run）的状态存在 <PLANNING_BATCH_DIR>/<run_id>/state.json：
+  submit   读各 job 的 Step_1_script_results.json，每个 Sub-Script 一条 ScenePlanning 请求，所有 job 合成一个批次提交。
+  resume   批次结果到了：逐条解析 / 校验，写出各 job 的 Step_2；再把所有 scene 的 ShotPlotCreate 请求合成第二个批次提交；
+           第二批到了就写出 Step_3，之后用原来的 run.py 参数加 --resume_from_shots 生成关键帧与视频。
+           批次里失败 / 缺失 / 修不好的条目只把这一个 Sub-Script / scene 改走在线请求（run._call_with_retry），不重交整批。
+请求体与在线路径相同（同样的 system prompt、temperature、prompt_cache_key），写出的 Step_2 / Step_3 结构也完全相同。
+
+后端可插拔（BACKENDS）：
+  openai   Batch API（gpt4-o 走 OpenAI；deepseek-* 走 DashScope 的 OpenAI 兼容 Batch 接口）
+  local    本地文件替身：批次写成 <run_dir>/<batch_id>.input.jsonl，从同目录的 <batch_id>.output.jsonl 读结果
+           （与 Batch API 输出文件格式相同）。输出文件可以由测试直接写入，也可以用 run-local 子命令逐条同步执行生成。
+
+用法：
+  python movie_agent/batch_planning.py submit Results/a/<cfg>/Step_1_script_results.json Results/b/<cfg>/Step_1_script_results.json
+  python movie_agent/batch_planning.py resume Results/_batches/<run_id>/state.json --wait
+  python movie_agent/batch_planning.py run-local Results/_batches/<run_id>/state.json   # 仅 local 后端
+单个 job 也可以直接 run.py --planning_batch：ScriptBreak 之后提交批次即退出。
+
+Environment variables (optional):
+  PLANNING_BATCH_BACKEND   default openai            openai | local
+  PLANNING_BATCH_DIR       default ./Results/_batches
+  PLANNING_BATCH_WINDOW    default 24h               Batch API 的 completion_window
+  PLANNING_BATCH_POLL      default 60                resume --wait 的轮询间隔（秒）
+"""
+import abc
+import argparse
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import metering
+import run
+from base_agent import BaseAgent, _check_finish, _endpoint, get_client
+from llm_schema import LLMOutputError, SchemaError, validate_scene_annotation, validate_shot_annotation
+from system_prompts import scene_query, shot_query, sys_prompts
+from tools import save_json
+
+PLANNING_BATCH_BACKEND = os.environ.get("PLANNING_BATCH_BACKEND", "openai")
+PLANNING_BATCH_DIR = os.environ.get("PLANNING_BATCH_DIR", "./Results/_batches")
+PLANNING_BATCH_WINDOW = os.environ.get("PLANNING_BATCH_WINDOW", "24h")
+PLANNING_BATCH_POLL = float(os.environ.get("PLANNING_BATCH_POLL", "60"))
+
+STEP_2_NAME = "Step_2_scene_results.json"
+STEP_3_NAME = "Step_3_shot_results.json"
+
+
+# ── backends ──────────────────────────────────────────────────────────────────
+
+def _batch_lines(requests) -> str:
+    """[(custom_id, body)] → Batch API 输入文件（JSONL）。"""
+    return "".join(
+        json.dumps({"custom_id": cid, "method": "POST", "url": "/v1/chat/completions", "body": body},
+                   ensure_ascii=False) + "\n"
+        for cid, body in requests
+    )
+
+
+def _parse_output(text: str) -> dict:
+    """Batch API 输出文件 → {custom_id: chat completion body}；出错的条目不放进结果（由 resume 在线补）。"""
+    out = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        resp = item.get("response") or {}
+        if item.get("error") or resp.get("status_code", 200) != 200:
+            continue
+        out[item["custom_id"]] = resp.get("body") or {}
+    return out
+
+
+class BatchBackend(abc.ABC):
+    """submit(requests, run_dir, tag) -> batch_id；poll(batch_id, run_dir) -> None（未完成）或 {custom_id: body}。"""
+    name = ""
+
+    def __init__(self, llm_type):
+        self.llm_type = llm_type
+
+    @abc.abstractmethod
+    def submit(self, requests, run_dir: Path, tag: str) -> str:
+        ...
+
+    @abc.abstractmethod
+    def poll(self, batch_id: str, run_dir: Path):
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    name = "openai"
+    PENDING = ("validating", "in_progress", "finalizing", "cancelling")
+
+    def submit(self, requests, run_dir, tag):
+        path = run_dir / f"{tag}.input.jsonl"
+        path.write_text(_batch_lines(requests), encoding="utf-8")
+        client = get_client(self.llm_type)
+        with open(path, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window=PLANNING_BATCH_WINDOW,
+        )
+        return batch.id
+
+    def poll(self, batch_id, run_dir):
+        client = get_client(self.llm_type)
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in self.PENDING:
+            counts = batch.request_counts
+            done = f"{counts.completed}/{counts.total}" if counts else "?"
+            print(f"[batch] {batch_id}: {batch.status}（{done}）")
+            return None
+        if batch.status != "completed":
+            # expired / failed / cancelled：有多少拿多少，其余条目在线补
+            print(f"[batch] {batch_id} 结束状态为 {batch.status}，缺失的条目改走在线请求")
+        if not batch.output_file_id:
+            return {}
+        return _parse_output(client.files.content(batch.output_file_id).text)
+
+
+class LocalFileBackend(BatchBackend):
+    name = "local"
+
+    def submit(self, requests, run_dir, tag):
+        batch_id = f"local-{tag}-{uuid.uuid4().hex[:8]}"
+        (run_dir / f"{batch_id}.input.jsonl").write_text(_batch_lines(requests), encoding="utf-8")
+        return batch_id
+
+    def poll(self, batch_id, run_dir):
+        out = run_dir / f"{batch_id}.output.jsonl"
+        if not out.exists():
+            print(f"[batch] {batch_id}: 等待 {out}")
+            return None
+        return _parse_output(out.read_text(encoding="utf-8"))
+
+    def execute(self, batch_id, run_dir):
+        """替身执行：逐条同步调用在线接口，写出与 Batch API 相同格式的输出文件（原子写，poll 不会读到半个文件）。"""
+        client = get_client(self.llm_type)
+        lines = []
+        for line in (run_dir / f"{batch_id}.input.jsonl").read_text(encoding="utf-8").splitlines():
+            req = json.loads(line)
+            body = dict(req["body"])
+            extra = {"prompt_cache_key": body.pop("prompt_cache_key")} if "prompt_cache_key" in body else None
+            try:
+                resp = client.chat.completions.create(**body, extra_body=extra)
+                item = {"custom_id": req["custom_id"], "response": {"status_code": 200, "body": resp.model_dump()}, "error": None}
+            except Exception as e:
+                print(f"[batch local] {req['custom_id']}: {e}")
+                item = {"custom_id": req["custom_id"], "response": None, "error": {"message": str(e)}}
+            lines.append(json.dumps(item, ensure_ascii=False) + "\n")
+        out = run_dir / f"{batch_id}.output.jsonl"
+        tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+        tmp.write_text("".join(lines), encoding="utf-8")
+        os.replace(tmp, out)
+
+
+BACKENDS = {b.name: b for b in (OpenAIBatchBackend, LocalFileBackend)}
+
+
+def get_backend(name: str, llm_type: str) -> BatchBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"unknown batch backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](llm_type)
+
+
+# ── planning units ────────────────────────────────────────────────────────────
+
+def _agents(llm_type):
+    """与 ScriptBreakAgent.init_agent 相同配置的规划 agent（在线补请求也用它们）。"""
+    return (
+        BaseAgent(llm_type, system_prompt=sys_prompts["ScenePlanningCoT-sys"], use_history=False, temp=0.7, stage="sceneplanning"),
+        BaseAgent(llm_type, system_prompt=sys_prompts["ShotPlotCreateCoT-sys"], use_history=False, temp=0.7, stage="shotplotcreate"),
+    )
+
+
+def _request_body(agent, query) -> dict:
+    body = agent._request_kwargs(agent._input_messages(query), json_format=True)
+    body.update(body.pop("extra_body", {}))  # 批次文件里没有 extra_body，直接并进请求体
+    return body
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _resolve(agent, query, body, label, validate):
+    """取批次里这一条的结果；没有或不合格时只把这一条改走在线请求。"""
+    error, reask_for = "missing from batch output", None
+    if body is not None:
+        usage = body.get("usage") or {}
+        metering.record(
+            agent.stage, _endpoint(agent.llm_type), metering.batch_model(agent.model_name), requests=1,
+            input_tokens=usage.get("prompt_tokens", 0),
+            output_tokens=usage.get("completion_tokens", 0),
+            cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+        )
+        try:
+            choice = body["choices"][0]
+            _check_finish(choice.get("finish_reason"), choice["message"]["content"])
+            parsed = agent.parse_json(choice["message"]["content"])
+            validate(parsed)
+            return parsed
+        except (KeyError, IndexError, TypeError) as e:
+            error = f"malformed batch response: {e!r}"
+        except (LLMOutputError, SchemaError) as e:
+            error = reask_for = e
+    print(f"[batch] {label}: {error}，改为在线请求")
+    return run._call_with_retry(agent, query, label, validate=validate, reask_for=reask_for)
+
+
+def _scene_units(jobs, agent):
+    requests, units = [], {}
+    for j, step1_path in enumerate(jobs):
+        data = _read_json(step1_path)
+        for name, sub_script in data["Sub-Script"].items():
+            cid = f"{j}|{name}"
+            units[cid] = {"job": j, "sub_script": name}
+            requests.append((cid, _request_body(agent, scene_query(sub_script["Plot"], data["Relationships"]))))
+    return requests, units
+
+
+def _shot_units(jobs, agent):
+    requests, units = [], {}
+    for j, step1_path in enumerate(jobs):
+        data = _read_json(Path(step1_path).with_name(STEP_2_NAME))
+        for sub_name, sub_script in data["Sub-Script"].items():
+            for scene_name, scene in sub_script["Scene Annotation"]["Scene"].items():
+                cid = f"{j}|{sub_name}|{scene_name}"
+                units[cid] = {"job": j, "sub_script": sub_name, "scene": scene_name}
+                requests.append((cid, _request_body(agent, shot_query(scene))))
+    return requests, units
+
+
+def _apply_scenes(state, results, agent):
+    """写出各 job 的 Step_2（与 ScriptBreakAgent.ScenePlanning 相同的结构）。"""
+    datas = [_read_json(p) for p in state["jobs"]]
+    for cid, unit in state["units"].items():
+        data = datas[unit["job"]]
+        name = unit["sub_script"]
+        query = scene_query(data["Sub-Script"][name]["Plot"], data["Relationships"])
+        data["Sub-Script"][name]["Scene Annotation"] = _resolve(
+            agent, query, results.get(cid), f"job {unit['job']} / {name}", validate_scene_annotation)
+    for step1_path, data in zip(state["jobs"], datas):
+        save_json(data, Path(step1_path).with_name(STEP_2_NAME))
+
+
+def _apply_shots(state, results, agent):
+    """写出各 job 的 Step_3（与 ScriptBreakAgent.ShotPlotCreate 相同的结构）。"""
+    datas = [_read_json(Path(p).with_name(STEP_2_NAME)) for p in state["jobs"]]
+    for cid, unit in state["units"].items():
+        scene = datas[unit["job"]]["Sub-Script"][unit["sub_script"]]["Scene Annotation"]["Scene"][unit["scene"]]
+        scene["Shot Annotation"] = _resolve(
+            agent, shot_query(scene), results.get(cid),
+            f"job {unit['job']} / {unit['sub_script']} / {unit['scene']}", validate_shot_annotation)
+    for step1_path, data in zip(state["jobs"], datas):
+        save_json(data, Path(step1_path).with_name(STEP_3_NAME))
+
+
+# ── run lifecycle ─────────────────────────────────────────────────────────────
+
+def submit(step1_paths, llm_type, backend: str = None, batch_dir: str = None) -> Path:
+    """把这些 job 的 ScenePlanning 请求合成一个批次提交，返回 state.json 路径。"""
+    backend = backend or PLANNING_BATCH_BACKEND
+    run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    run_dir = Path(batch_dir or PLANNING_BATCH_DIR) / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [str(Path(p).resolve()) for p in step1_paths]
+    scene_agent, _ = _agents(llm_type)
+    requests, units = _scene_units(jobs, scene_agent)
+    state = {
+        "run_id": run_id,
+        "llm": llm_type,
+        "backend": backend,
+        "jobs": jobs,
+        "phase": "scene",
+        "batch_id": get_backend(backend, llm_type).submit(requests, run_dir, "scene"),
+        "units": units,
+    }
+    state_path = run_dir / "state.json"
+    save_json(state, state_path)
+    print(f"[batch] 已提交 {len(jobs)} 个 job 的 {len(requests)} 条 ScenePlanning 请求（{backend}: {state['batch_id']}）")
+    print(f"[batch] 结果到了之后：python movie_agent/batch_planning.py resume {state_path}")
+    return state_path
+
+
+def resume(state_path) -> bool:
+    """推进一步：当前批次的结果到了就落盘并进入下一阶段。返回整个 run 是否已完成。"""
+    state_path = Path(state_path)
+    state = _read_json(state_path)
+    if state["phase"] == "done":
+        return True
+    run_dir = state_path.parent
+    backend = get_backend(state["backend"], state["llm"])
+    results = backend.poll(state["batch_id"], run_dir)
+    if results is None:
+        return False
+    scene_agent, shot_agent = _agents(state["llm"])
+
+    if state["phase"] == "scene":
+        print(f"[batch] ScenePlanning 批次完成：{len(results)}/{len(state['units'])} 条可用")
+        _apply_scenes(state, results, scene_agent)
+        requests, units = _shot_units(state["jobs"], shot_agent)
+        state.update(phase="shot", batch_id=backend.submit(requests, run_dir, "shot"), units=units)
+        save_json(state, state_path)
+        print(f"[batch] 已写出 Step_2，提交 {len(requests)} 条 ShotPlotCreate 请求（{state['batch_id']}）")
+        return False
+
+    print(f"[batch] ShotPlotCreate 批次完成：{len(results)}/{len(state['units'])} 条可用")
+    _apply_shots(state, results, shot_agent)
+    state.update(phase="done", units={})
+    save_json(state, state_path)
+    for step1_path in state["jobs"]:
+        print(f"[batch] 完成: {Path(step1_path).with_name(STEP_3_NAME)}")
+    print("[batch] 用原来的 run.py 参数加 --resume_from_shots 继续生成关键帧与视频。")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ScenePlanning / ShotPlotCreate 的离线批量模式")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_submit = sub.add_parser("submit", help="把多个 job 的规划请求合成一个批次提交")
+    p_submit.add_argument("step1_json", nargs="+", help="各 job 的 Step_1_script_results.json")
+    p_submit.add_argument("--llm", type=str, default="gpt4-o", help="gpt4-o / deepseek-v3 / deepseek-r1")
+    p_submit.add_argument("--backend", type=str, default=None, help=f"批量后端：{' | '.join(BACKENDS)}（默认 PLANNING_BATCH_BACKEND）")
+    p_submit.add_argument("--batch_dir", type=str, default=None, help="批次与状态文件目录（默认 PLANNING_BATCH_DIR）")
+    p_resume = sub.add_parser("resume", help="结果到了就写出 Step_2 / Step_3 并推进到下一阶段")
+    p_resume.add_argument("state_json", help="submit 打印的 state.json 路径")
+    p_resume.add_argument("--wait", action="store_true", help="轮询直到整个 run 完成（间隔 PLANNING_BATCH_POLL 秒）")
+    p_local = sub.add_parser("run-local", help="local 后端：同步执行当前批次，写出结果文件")
+    p_local.add_argument("state_json")
+    args = parser.parse_args()
+
+    with metering.job() as meter:
+        if args.command == "submit":
+            submit(args.step1_json, args.llm, backend=args.backend, batch_dir=args.batch_dir)
+        elif args.command == "run-local":
+            state = _read_json(args.state_json)
+            backend = get_backend(state["backend"], state["llm"])
+            if not isinstance(backend, LocalFileBackend):
+                parser.error("run-local 只适用于 local 后端")
+            backend.execute(state["batch_id"], Path(args.state_json).parent)
+        else:
+            while not resume(args.state_json) and args.wait:
+                time.sleep(PLANNING_BATCH_POLL)
+        total = meter.snapshot()["total"]
+        if total["requests"]:
+            print(f"[usage] {total['requests']} requests, {total['input_tokens']} in / {total['output_tokens']} out tokens, "
+                  f"~${total['cost_usd']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+外部调用的录制 / 回放层（cassette），让整条 pipeline 不依赖 OpenAI / Gemini / Runway 的 key 也能离线、确定性地跑。
+
+record 模式照常调用 provider，把「请求指纹 → 结果」存进 cassette 目录；调用写出的文件（关键帧图片、视频）
+按内容 sha256 存一份 blob。replay 模式不发任何请求：按同样的指纹取回结果并把文件原样写回调用方给的路径，
+找不到就抛 CassetteMiss。回放前先 sleep 一段合成延迟（可设为 0、固定秒数或录制时的真实耗时），
+这样既能测编排本身的开销（延迟为 0），也能在不花钱的前提下复现真实的时间线。
+
+接入点：BaseAgent（llm）、scripts/image_to_description.py 与 utils/character_style.py / scene_style.py（vision）、
+Gemini_Image_pipe（keyframe）、Runway_I2V_pipe（image2video）。指纹只含请求内容（模型、messages、prompt、
+参考图 / 关键帧的字节哈希等），不含 job 目录等路径，所以录一次可以在任意目录回放。
+replay 时不检查 API key（缺 key 时用占位值建 client，反正不会真正发请求）。
+
+目录结构：<dir>/<kind>/<key[:2]>/<key>.json，文件 blob 在 <dir>/blobs/<sha256>。
+
+Environment variables (optional):
+  MOVIEAGENT_CASSETTE_MODE      default off   off | record | replay
+  MOVIEAGENT_CASSETTE_DIR       default ./cassettes
+  MOVIEAGENT_CASSETTE_LATENCY   default 0     回放延迟（秒）：一个数字对所有调用生效；recorded 表示用录制时的耗时；
+                                              也可按类型写，如 "llm=recorded,keyframe=8,image2video=30,*=0"
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+MOVIEAGENT_CASSETTE_MODE = os.environ.get("MOVIEAGENT_CASSETTE_MODE", "off").strip().lower() or "off"
+MOVIEAGENT_CASSETTE_DIR = os.environ.get("MOVIEAGENT_CASSETTE_DIR", "./cassettes")
+MOVIEAGENT_CASSETTE_LATENCY = os.environ.get("MOVIEAGENT_CASSETTE_LATENCY", "0")
+
+# replay 时代替缺失 API key 的占位值（client 构造时需要，实际不会发请求）
+REPLAY_API_KEY = "cassette-replay"
+
+_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """replay 模式下 cassette 里没有这次请求（请求内容和录制时不同，或还没录过）。"""
+
+
+def _parse_latency(spec: str) -> dict:
+    out = {}
+    for part in str(spec or "0").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        kind, _, value = part.rpartition("=")
+        value = value.strip().lower()
+        out[kind.strip() or "*"] = value if value == "recorded" else float(value)
+    return out
+
+
+_latency = _parse_latency(MOVIEAGENT_CASSETTE_LATENCY)
+_lock = threading.Lock()
+stats: dict = {}  # {kind: {"recorded": n, "replayed": n}}
+
+
+def configure(mode: str = None, cassette_dir: str = None, latency: str = None):
+    """命令行参数覆盖环境变量（在发出任何请求之前调用）。"""
+    global MOVIEAGENT_CASSETTE_MODE, MOVIEAGENT_CASSETTE_DIR, _latency
+    if mode is not None:
+        if mode not in _MODES:
+            raise ValueError(f"cassette mode must be one of {_MODES}, got {mode!r}")
+        MOVIEAGENT_CASSETTE_MODE = mode
+    if cassette_dir:
+        MOVIEAGENT_CASSETTE_DIR = cassette_dir
+    if latency is not None:
+        _latency = _parse_latency(latency)
+
+
+def enabled() -> bool:
+    return MOVIEAGENT_CASSETTE_MODE in ("record", "replay")
+
+
+def replaying() -> bool:
+    return MOVIEAGENT_CASSETTE_MODE == "replay"
+
+
+def api_key(value):
+    """replay 时给缺失的 key 一个占位值；其余情况原样返回。"""
+    return value or (REPLAY_API_KEY if replaying() else value)
+
+
+def file_digest(path) -> str:
+    """参考图 / 关键帧等输入文件的内容哈希，用于指纹（不依赖路径）。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint(kind: str, payload) -> str:
+    blob = json.dumps({"kind": kind, "payload": payload}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _root() -> Path:
+    return Path(MOVIEAGENT_CASSETTE_DIR)
+
+
+def _entry_path(kind: str, key: str) -> Path:
+    return _root() / kind / key[:2] / f"{key}.json"
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _count(kind: str, what: str):
+    with _lock:
+        stats.setdefault(kind, {"recorded": 0, "replayed": 0})[what] += 1
+
+
+def _store(kind: str, key: str, result, latency_s: float, outputs):
+    blobs = []
+    for path in outputs:
+        digest = file_digest(path)
+        blob = _root() / "blobs" / digest
+        if not blob.exists():
+            _write_atomic(blob, Path(path).read_bytes())
+        blobs.append(digest)
+    entry = {"kind": kind, "result": result, "latency_s": round(latency_s, 3), "files": blobs, "recorded_at": time.time()}
+    _write_atomic(_entry_path(kind, key), json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+    _count(kind, "recorded")
+
+
+def _load(kind: str, key: str, outputs):
+    """取回录制结果并把文件写回 outputs；返回 (result, 应等待的秒数)。"""
+    try:
+        with open(_entry_path(kind, key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        raise CassetteMiss(f"no {kind} recording for {key[:12]}… in {_root()}") from None
+    for digest, path in zip(entry.get("files", []), outputs):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(_root() / "blobs" / digest, path)
+    spec = _latency.get(kind, _latency.get("*", 0.0))
+    wait = entry.get("latency_s", 0.0) if spec == "recorded" else spec
+    _count(kind, "replayed")
+    return entry["result"], wait
+
+
+def through(kind: str, payload, live, outputs=()):
+    """
+    经过 cassette 调用 live()：off 时直接调用；record 时调用并录下结果（须可 JSON 序列化）与 outputs 里的文件；
+    replay 时不调用 live，按 payload 的指纹回放。outputs 为 live() 会写出的文件路径。
+    """
+    if not enabled():
+        return live()
+    key = fingerprint(kind, payload)
+    if replaying():
+        result, wait = _load(kind, key, outputs)
+        if wait:
+            time.sleep(wait)
+        return result
+    start = time.perf_counter()
+    result = live()
+    _store(kind, key, result, time.perf_counter() - start, outputs)
+    return result
+
+
+async def athrough(kind: str, payload, alive, outputs=()):
+    """through 的 async 版本：alive 是返回 awaitable 的函数；回放延迟用 asyncio.sleep，不阻塞 event loop。"""
+    if not enabled():
+        return await alive()
+    key = fingerprint(kind, payload)
+    if replaying():
+        result, wait = _load(kind, key, outputs)
+        if wait:
+            await asyncio.sleep(wait)
+        return result
+    start = time.perf_counter()
+    result = await alive()
+    _store(kind, key, result, time.perf_counter() - start, outputs)
+    return result
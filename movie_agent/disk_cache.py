@@ -0,0 +1,87 @@
+"""
+按内容寻址的磁盘小文件缓存，llm_cache（LLM 回复）与 scripts/description_cache（图片描述）共用。
+
+每条一个小 JSON 文件 <root>/<key[:2]>/<key>.json，内容为 {field: 文本}；key 由调用方算好（sha256 hex）。
+写入先写临时文件再 os.replace，多线程 / 多进程同时写同一条不会读到半个文件。
+目录总大小超过 max_bytes 时按最近使用时间（文件 mtime，命中时刷新）淘汰最旧的条目，降到上限的 90%。
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+class DiskCache:
+    def __init__(self, root: str, max_bytes: int, field: str = "value"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.field = field  # JSON 里存值的字段名（各缓存沿用各自原有的文件格式）
+        self._lock = threading.Lock()
+        self._approx_bytes = None  # 首次写入时扫描一次目录，之后增量维护
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        p = self._path(key)
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                text = json.load(f)[self.field]
+            os.utime(p)  # 刷新 mtime = 最近使用
+            return text
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, value: str):
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({self.field: value}, ensure_ascii=False).encode("utf-8")
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            old_size = p.stat().st_size  # 覆盖已有条目时只计增量
+        except OSError:
+            old_size = 0
+        os.replace(tmp, p)
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = sum(e.stat().st_size for e in self.root.glob("*/*.json"))
+            else:
+                self._approx_bytes += len(data) - old_size
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str):
+        p = self._path(key)
+        try:
+            size = p.stat().st_size
+            p.unlink()
+        except OSError:
+            return
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes -= size
+
+    def _evict(self):
+        """按 mtime 从旧到新删除，直到总大小降到上限的 90%。"""
+        entries = []
+        for e in self.root.glob("*/*.json"):
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, e))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, e in entries:
+            if total <= target:
+                break
+            try:
+                e.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._approx_bytes = total
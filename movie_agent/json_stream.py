@@ -0,0 +1,82 @@
+"""
+流式 LLM 输出的增量 JSON 解析。
+
+模型边写边把文本块 feed() 进来；每当一个 key 形如 "Shot N" / "Scene N" / "Sub-Script N" 的对象闭合，
+立即回调 on_item(path, obj)：path 是从根到该对象的 key 列表（如 ["Shot", "Shot 2"]，
+融合规划里是 ["Scene", "Scene 1", "Shot Annotation", "Shot", "Shot 2"]），obj 是解析好的 dict。
+这样第一个镜头可以在模型还在写第三个镜头时就开始生成关键帧。
+
+只做结构扫描（字符串 / 转义 / 括号深度），不校验整段 JSON；```json 代码块标记等结构外的字符会被忽略。
+"""
+import json
+import re
+
+ITEM_KEY = re.compile(r"^(Shot|Scene|Sub-Script) \d+$")
+
+
+class JSONItemStream:
+    def __init__(self, on_item, key_pattern=ITEM_KEY):
+        self.on_item = on_item
+        self.key_pattern = key_pattern
+        self.buf = []           # 已收到的全部字符
+        self._stack = []        # [(开括号, 该容器在父对象里的 key, 起始下标)]
+        self._in_string = False
+        self._escape = False
+        self._str_start = 0
+        self._last_str = None   # 最近一个完整字符串（可能是 key）
+        self._key_ready = False  # last_str 后面已经跟了 ':'，下一个值属于这个 key
+        self.emitted = 0
+
+    def feed(self, text: str):
+        if not text:
+            return
+        for ch in text:
+            pos = len(self.buf)
+            self.buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    try:
+                        self._last_str = json.loads("".join(self.buf[self._str_start:pos + 1]))
+                    except ValueError:
+                        self._last_str = None
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._str_start = pos
+                self._key_ready = False
+            elif ch == ":":
+                self._key_ready = self._last_str is not None
+            elif ch in "{[":
+                key = self._last_str if self._key_ready else None
+                self._stack.append((ch, key, pos))
+                self._key_ready = False
+                self._last_str = None
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                opener, key, start = self._stack.pop()
+                self._key_ready = False
+                self._last_str = None
+                if opener == "{" and key is not None and self.key_pattern.match(key):
+                    self._emit(key, start, pos)
+            elif ch == ",":
+                self._key_ready = False
+                self._last_str = None
+
+    def _emit(self, key, start, end):
+        try:
+            obj = json.loads("".join(self.buf[start:end + 1]))
+        except ValueError:
+            return
+        path = [k for _, k, _ in self._stack if k is not None] + [key]
+        self.emitted += 1
+        self.on_item(path, obj)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.buf)
@@ -0,0 +1,101 @@
+"""
+LLM 回复的持久化缓存（默认关闭，需显式开启）。
+
+key = sha256(llm_type + model + 完整 messages + temperature + top_p + 是否 JSON 模式)，值为回复文本，
+每条一个小 JSON 文件。job 续跑、--only_planning 重跑或调试时，同样的输入直接命中缓存，不再调用 API。
+目录总大小超过上限时按最近使用时间（文件 mtime，命中时刷新）淘汰最旧的条目（disk_cache.DiskCache）。
+
+注意：planning 阶段 temp=0.7，开启缓存后同样的输入总是得到第一次的回复；想要重新采样某个阶段，
+把它加进 LLM_CACHE_BYPASS（或 run.py --llm_cache_bypass）即可，该阶段既不读也不写缓存。
+
+Environment variables (optional):
+  LLM_CACHE             default 0      设为 1 开启（run.py --llm_cache 同效）
+  LLM_CACHE_DIR         default ~/.cache/movieagent/llm_responses
+  LLM_CACHE_MAX_BYTES   default 256 MB
+  LLM_CACHE_BYPASS      default ""     逗号分隔的阶段名（screenwriter,sceneplanning,shotplotcreate,director），all 表示全部
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from disk_cache import DiskCache
+
+LLM_CACHE = os.environ.get("LLM_CACHE", "0") == "1"
+LLM_CACHE_DIR = os.environ.get(
+    "LLM_CACHE_DIR",
+    str(Path.home() / ".cache" / "movieagent" / "llm_responses"),
+)
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_BYPASS = {s.strip() for s in os.environ.get("LLM_CACHE_BYPASS", "").split(",") if s.strip()}
+
+# 进程内按阶段累计的命中情况：{stage: {"hits": n, "misses": n}}
+stats: dict = {}
+_stats_lock = threading.Lock()
+
+
+def configure(enabled: bool = None, bypass=None, cache_dir: str = None, max_bytes: int = None):
+    """命令行参数覆盖环境变量（在创建任何 BaseAgent 之前调用）。"""
+    global LLM_CACHE, LLM_CACHE_BYPASS, LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, _cache
+    if enabled is not None:
+        LLM_CACHE = enabled
+    if bypass is not None:
+        if isinstance(bypass, str):
+            bypass = bypass.split(",")
+        LLM_CACHE_BYPASS = {s.strip() for s in bypass if s.strip()}
+    if cache_dir:
+        LLM_CACHE_DIR = cache_dir
+    if max_bytes:
+        LLM_CACHE_MAX_BYTES = max_bytes
+    with _cache_lock:
+        _cache = None
+
+
+def is_bypassed(stage: Optional[str]) -> bool:
+    return "all" in LLM_CACHE_BYPASS or (stage is not None and stage in LLM_CACHE_BYPASS)
+
+
+def record(stage: Optional[str], hit: bool):
+    with _stats_lock:
+        s = stats.setdefault(stage or "default", {"hits": 0, "misses": 0})
+        s["hits" if hit else "misses"] += 1
+
+
+def fingerprint(llm_type: str, model: str, messages: list, temp, top_p, json_format: bool) -> str:
+    payload = json.dumps(
+        {
+            "llm_type": llm_type,
+            "model": model,
+            "messages": messages,
+            "temperature": temp,
+            "top_p": top_p,
+            "json_format": bool(json_format),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(DiskCache):
+    """LLM 回复缓存：存储与淘汰见 disk_cache.DiskCache，文件里的字段名为 response。"""
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(root, max_bytes, field="response")
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(stage: Optional[str] = None) -> Optional[ResponseCache]:
+    """进程内共享的缓存实例；未开启或该阶段被 bypass 时返回 None。"""
+    global _cache
+    if not LLM_CACHE or is_bypassed(stage):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+        return _cache
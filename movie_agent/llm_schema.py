@@ -0,0 +1,159 @@
+"""
+规划阶段 LLM 输出的本地修复与结构校验。
+
+repair_json：先按原样解析，失败再做几种便宜的本地修复 —— 去掉 ```json 代码块标记、截掉 JSON 前后的多余文字、
+删除尾随逗号、补齐被截断的字符串与括号。修不好才算失败，不必为此多花一次请求。
+
+validate_*：Step_1（ScriptBreak）、Step_2（ScenePlanning 的 Scene Annotation）、Step_3（ShotPlotCreate 的 Shot Annotation）
+以及融合规划回复的最小结构要求 —— 只检查下游（VideoAudioGen 等）真正会读的字段，不合格抛 SchemaError。
+解析或校验失败时调用方只重问出错的那个 Sub-Script / scene（见 run.py 的 _acall_with_retry）。
+"""
+import json
+import re
+
+
+class LLMOutputError(Exception):
+    """LLM 回复无法解析成 JSON（修复后仍失败）；raw 为原始回复。"""
+
+    def __init__(self, message, raw=""):
+        super().__init__(message)
+        self.raw = raw
+
+
+class SchemaError(ValueError):
+    """JSON 能解析，但缺少下游需要的字段。"""
+
+
+# ── repair ────────────────────────────────────────────────────────────────────
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def _close_truncated(text: str) -> str:
+    """补齐被截断的字符串和括号（回复因 max_tokens 等原因在中途结束）。"""
+    stack, in_string, escape = [], False, False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _outer_object(text: str) -> str:
+    """截取第一个 '{' 到与之配对的 '}'（找不到配对时取到结尾，交给 _close_truncated）。"""
+    start = text.find("{")
+    if start < 0:
+        return text
+    depth, in_string, escape = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def repair_json(text: str):
+    """解析 LLM 回复里的 JSON，必要时做本地修复；仍失败抛 LLMOutputError。"""
+    if text is None:
+        raise LLMOutputError("empty response", raw="")
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    candidate = _outer_object(_FENCE.sub("", text)).strip()
+    attempts = (
+        candidate,
+        _TRAILING_COMMA.sub(r"\1", candidate),
+        _TRAILING_COMMA.sub(r"\1", _close_truncated(candidate)),
+    )
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            continue
+    raise LLMOutputError(f"unparseable JSON response ({len(text)} chars)", raw=text)
+
+
+# ── schemas ───────────────────────────────────────────────────────────────────
+
+SUB_SCRIPT_FIELDS = ("Plot",)
+SCENE_FIELDS = ("Involving Characters", "Plot", "Scene Description", "Emotional Tone", "Key Props", "Cinematography Notes")
+SHOT_FIELDS = ("Involving Characters", "Plot/Visual Description")
+
+
+def _require_dict(obj, key, where):
+    value = obj.get(key) if isinstance(obj, dict) else None
+    if not isinstance(value, dict) or not value:
+        raise SchemaError(f"{where}: missing or empty '{key}'")
+    return value
+
+
+def _require_fields(obj, fields, where):
+    if not isinstance(obj, dict):
+        raise SchemaError(f"{where}: expected an object")
+    missing = [k for k in fields if k not in obj]
+    if missing:
+        raise SchemaError(f"{where}: missing {missing}")
+
+
+def validate_step1(data):
+    """ScriptBreak 回复 / Step_1_script_results.json。"""
+    if not isinstance(data, dict) or "Relationships" not in data:
+        raise SchemaError("Step_1: missing 'Relationships'")
+    for name, sub_script in _require_dict(data, "Sub-Script", "Step_1").items():
+        _require_fields(sub_script, SUB_SCRIPT_FIELDS, f"Step_1 / {name}")
+
+
+def validate_scene_annotation(data):
+    """ScenePlanning 回复（Step_2 中每个 Sub-Script 的 Scene Annotation）。"""
+    for name, scene in _require_dict(data, "Scene", "Scene Annotation").items():
+        _require_fields(scene, SCENE_FIELDS, f"Scene Annotation / {name}")
+
+
+def validate_shot(shot, where="Shot"):
+    """单个镜头（流式回复里提前闭合的 "Shot N" 也用它校验）。"""
+    _require_fields(shot, SHOT_FIELDS, where)
+
+
+def validate_shot_annotation(data):
+    """ShotPlotCreate 回复（Step_3 中每个 scene 的 Shot Annotation）。"""
+    for name, shot in _require_dict(data, "Shot", "Shot Annotation").items():
+        validate_shot(shot, f"Shot Annotation / {name}")
+
+
+def validate_fused(data):
+    """融合规划回复：必须能拆成与分阶段相同的 Step_2 / Step_3 结构。"""
+    validate_scene_annotation(data)
+    for name, scene in data["Scene"].items():
+        if not isinstance(scene.get("Shot Annotation"), dict):
+            raise SchemaError(f"Scene Annotation / {name}: missing 'Shot Annotation'")
+        validate_shot_annotation(scene["Shot Annotation"])
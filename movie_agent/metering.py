@@ -0,0 +1,196 @@
+"""
+按 job 统计所有外部调用的用量：请求数、失败数、token（含 cached）、耗时与估算费用，按 阶段 / provider / model 分组。
+use_history 的 agent 另记对话历史的峰值大小（history_tokens）与被滑动窗口丢弃的消息数（history_dropped），
+LLM_HISTORY_TOKENS 设得太小时能在 usage 里看出来。
+
+当前 job 的 Meter 放在 contextvar 里：API 的 run_pipeline 和 run.py main 用 `with metering.job() as meter:` 包住整个 job，
+各处调用点只需 metering.record(...) / metering.timed(...)，没有 Meter 时什么都不做。
+线程不会自动继承 contextvar：提交到线程池或新线程的函数要先用 metering.bind(fn) 包一下。
+
+费用按 PRICES 估算（USD）：LLM / vision 按每百万 token（输入, 输出, 缓存命中的输入），
+关键帧 / 图生视频按每次调用（units）。可用 METERING_PRICES（JSON 字符串或 JSON 文件路径）覆盖或补充。
+Batch API 的用量记在 "<model>@batch" 下（见 batch_model）；PRICES 里没有这个条目时按在线价 × METERING_BATCH_DISCOUNT 估算。
+
+Environment variables (optional):
+  METERING_PRICES           例如 '{"gpt-4o-2024-08-06": [2.5, 10, 1.25], "Runway": 0.25}'
+  METERING_BATCH_DISCOUNT   default 0.5   Batch API 相对在线价的折扣（OpenAI / 百炼 batch 均为半价）
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+PRICES = {
+    # model: (input, output, cached input) USD / 1M tokens
+    "gpt-4o-2024-08-06": (2.50, 10.00, 1.25),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "deepseek-v3": (0.27, 1.10, 0.07),
+    "deepseek-r1": (0.55, 2.19, 0.14),
+    # provider: USD / call
+    "Gemini": 0.039,
+    "Runway": 0.25,
+}
+
+
+def _load_price_overrides():
+    raw = os.environ.get("METERING_PRICES", "").strip()
+    if not raw:
+        return
+    try:
+        if not raw.startswith("{"):
+            with open(raw, "r", encoding="utf-8") as f:
+                raw = f.read()
+        for k, v in json.loads(raw).items():
+            PRICES[k] = tuple(v) if isinstance(v, list) else v
+    except (OSError, ValueError) as e:
+        print(f"[metering] 忽略无效的 METERING_PRICES: {e}")
+
+
+_load_price_overrides()
+
+METERING_BATCH_DISCOUNT = float(os.environ.get("METERING_BATCH_DISCOUNT", "0.5"))
+BATCH_SUFFIX = "@batch"
+
+_FIELDS = ("requests", "errors", "cache_hits", "input_tokens", "output_tokens", "cached_tokens", "units", "latency_s",
+           "history_dropped", "history_tokens")
+# 取最大值而不是累加的字段：history_tokens = use_history agent 常驻对话历史（估算 token）的峰值
+_PEAK_FIELDS = frozenset({"history_tokens"})
+
+
+def batch_model(model: str) -> str:
+    """Batch API 请求记账用的 model 名：与在线请求分行统计，按 batch 价估算。"""
+    return f"{model}{BATCH_SUFFIX}"
+
+
+def _price(provider: str, model: str):
+    if model in PRICES:
+        return PRICES[model]
+    if model.endswith(BATCH_SUFFIX):
+        online = _price(provider, model[:-len(BATCH_SUFFIX)])
+        if isinstance(online, tuple):
+            return tuple(p * METERING_BATCH_DISCOUNT for p in online)
+        if isinstance(online, (int, float)):
+            return online * METERING_BATCH_DISCOUNT
+        return online
+    return PRICES.get(provider)
+
+
+def estimate_cost(provider: str, model: str, row: dict) -> float:
+    price = _price(provider, model)
+    if isinstance(price, tuple):
+        p_in, p_out = price[0], price[1]
+        p_cached = price[2] if len(price) > 2 else p_in
+        uncached = row["input_tokens"] - row["cached_tokens"]
+        return (uncached * p_in + row["cached_tokens"] * p_cached + row["output_tokens"] * p_out) / 1e6
+    if isinstance(price, (int, float)):
+        return row["units"] * price
+    return 0.0
+
+
+class Meter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: dict = {}  # (stage, provider, model) -> {field: value}
+        self.started_at = time.time()
+
+    def record(self, stage, provider, model, **counts):
+        key = (stage or "other", provider or "", model or "")
+        with self._lock:
+            row = self._rows.setdefault(key, dict.fromkeys(_FIELDS, 0))
+            for k, v in counts.items():
+                row[k] = max(row[k], v or 0) if k in _PEAK_FIELDS else row[k] + (v or 0)
+
+    def snapshot(self) -> dict:
+        """JSON 友好的汇总：total / by_stage / by_provider / 明细 rows。"""
+        with self._lock:
+            rows = [
+                {"stage": s, "provider": p, "model": m, **dict(r), "cost_usd": estimate_cost(p, m, r)}
+                for (s, p, m), r in sorted(self._rows.items())
+            ]
+
+        def _sum(items):
+            out = dict.fromkeys(_FIELDS + ("cost_usd",), 0)
+            for r in items:
+                for k in out:
+                    out[k] = max(out[k], r[k]) if k in _PEAK_FIELDS else out[k] + r[k]
+            out["latency_s"] = round(out["latency_s"], 3)
+            out["cost_usd"] = round(out["cost_usd"], 6)
+            return out
+
+        for r in rows:
+            r["latency_s"] = round(r["latency_s"], 3)
+            r["cost_usd"] = round(r["cost_usd"], 6)
+        return {
+            "total": _sum(rows),
+            "by_stage": {s: _sum([r for r in rows if r["stage"] == s]) for s in dict.fromkeys(r["stage"] for r in rows)},
+            "by_provider": {p: _sum([r for r in rows if r["provider"] == p]) for p in dict.fromkeys(r["provider"] for r in rows)},
+            "rows": rows,
+            "wall_s": round(time.time() - self.started_at, 3),
+        }
+
+    def save(self, path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("movieagent_meter", default=None)
+
+
+def current() -> Optional[Meter]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def job(meter: Meter = None):
+    """在当前上下文里启用一个 Meter（整个 job 期间）。"""
+    meter = meter or Meter()
+    token = _current.set(meter)
+    try:
+        yield meter
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    """让 fn 在提交它的线程的上下文（含当前 Meter）里运行；每次调用用一份独立拷贝，可被多个线程同时执行。"""
+    ctx = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return _run
+
+
+def record(stage, provider, model, **counts):
+    meter = _current.get()
+    if meter is not None:
+        meter.record(stage, provider, model, **counts)
+
+
+def record_usage(stage, provider, model, usage):
+    """记录 OpenAI 兼容接口返回的 usage（prompt_tokens / completion_tokens / prompt_tokens_details.cached_tokens）。"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    record(
+        stage, provider, model,
+        input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        output_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        cached_tokens=(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+    )
+
+
+@contextlib.contextmanager
+def timed(stage, provider, model="", units=0):
+    """记录一次请求的耗时；抛异常时计为 errors（异常照常向上抛）。"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(stage, provider, model, requests=1, errors=1, latency_s=time.perf_counter() - start)
+        raise
+    record(stage, provider, model, requests=1, units=units, latency_s=time.perf_counter() - start)
@@ -6,6 +6,8 @@
 import os
 from pathlib import Path
 
+import cassette
+
 
 def _build_contents(refer_image, prompt_text):
     """构建 Gemini 多模态 contents：参考图最多 8 张（多方向）+ 文本 prompt。"""
@@ -71,8 +73,7 @@ class Gemini_Image_pipe:
         用 Gemini 以 1～2 张参考图 + 文本生成一张图，保存到 save_path。
         双人镜时 refer_image 为 [角色1图, 角色2图]，直接传两张，无需拼图。
         """
-        client = self._get_client()
-        if not self._api_key:
+        if not self._api_key and not cassette.replaying():
             raise RuntimeError("请设置环境变量 GOOGLE_API_KEY 或 GEMINI_API_KEY")
 
         raw_list = refer_image if isinstance(refer_image, (list, tuple)) else [refer_image]
@@ -202,25 +203,31 @@ class Gemini_Image_pipe:
                 + "画面内容："
             ) + scene_desc
 
-        contents = _build_contents(ref_list, prompt)
-        try:
-            from google.genai.types import GenerateContentConfig, Modality
-            config = GenerateContentConfig(response_modalities=[Modality.TEXT, Modality.IMAGE])
-        except (ImportError, AttributeError):
-            config = None
-        if config is not None:
-            print("[Gemini PROMPT]", prompt)
-            response = client.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=config,
-            )
-        else:
-            print("[Gemini PROMPT]", prompt)
-            response = client.models.generate_content(
-                model=self.model,
-                contents=contents,
-            )
+        print("[Gemini PROMPT]", prompt)
+
+        def _generate():
+            client = self._get_client()
+            contents = _build_contents(ref_list, prompt)
+            try:
+                from google.genai.types import GenerateContentConfig, Modality
+                config = GenerateContentConfig(response_modalities=[Modality.TEXT, Modality.IMAGE])
+            except (ImportError, AttributeError):
+                config = None
+            if config is not None:
+                response = client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config,
+                )
+            else:
+                response = client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                )
+            _save_response_image(response, save_path)
 
-        _save_response_image(response, save_path)
+        # 录制 / 回放（cassette.py）：指纹用参考图内容而不是路径，生成的关键帧作为文件录下
+        payload = {"model": self.model, "prompt": prompt,
+                   "refs": [cassette.file_digest(p) for p in ref_list[:8]]} if cassette.enabled() else None
+        cassette.through("keyframe", payload, _generate, outputs=[save_path])
         return prompt, save_path
@@ -6,10 +6,13 @@
 import os
 import time
 import base64
+import hashlib
 import requests
 from pathlib import Path
 from typing import Optional
 
+import cassette
+
 RUNWAY_API_BASE = os.environ.get("RUNWAY_API_BASE", "https://api.dev.runwayml.com/v1")
 RUNWAY_VERSION = "2024-11-06"
 
@@ -71,7 +74,7 @@ def _image_to_data_uri(image_path: str, size_hint: Optional[tuple] = None) -> st
 
 def _get_api_key() -> str:
     # 官方文档用 RUNWAYML_API_SECRET，兼容 RUNWAY_API_KEY
-    key = (os.environ.get("RUNWAYML_API_SECRET") or os.environ.get("RUNWAY_API_KEY") or "").strip()
+    key = cassette.api_key((os.environ.get("RUNWAYML_API_SECRET") or os.environ.get("RUNWAY_API_KEY") or "").strip())
     if not key:
         raise ValueError("请设置环境变量 RUNWAYML_API_SECRET（或 RUNWAY_API_KEY）")
     return key
@@ -107,82 +110,93 @@ class Runway_I2V_pipe:
         )
         duration_int = max(2, min(10, int(self.duration) if self.duration is not None else 2))
 
-        task_id = None
-        try:
-            from runwayml import RunwayML
-            client = RunwayML(api_key=self._api_key)
-            task = client.image_to_video.create(
-                model=str(self.model),
-                prompt_image=prompt_image_payload,
-                prompt_text=prompt_text,
-                ratio=str(self.ratio),
-                duration=duration_int,
-            )
-            task_id = getattr(task, "id", None) or (task if isinstance(task, str) else None)
-        except ImportError:
-            pass
-        except Exception as e:
-            if "400" in str(e) or "Bad Request" in str(e):
-                raise RuntimeError(f"Runway 400 (SDK): {e}") from e
-            raise
-
-        if not task_id:
-            # 使用 requests
+        def _generate():
+            task_id = None
+            try:
+                from runwayml import RunwayML
+                client = RunwayML(api_key=self._api_key)
+                task = client.image_to_video.create(
+                    model=str(self.model),
+                    prompt_image=prompt_image_payload,
+                    prompt_text=prompt_text,
+                    ratio=str(self.ratio),
+                    duration=duration_int,
+                )
+                task_id = getattr(task, "id", None) or (task if isinstance(task, str) else None)
+            except ImportError:
+                pass
+            except Exception as e:
+                if "400" in str(e) or "Bad Request" in str(e):
+                    raise RuntimeError(f"Runway 400 (SDK): {e}") from e
+                raise
+
+            if not task_id:
+                # 使用 requests
+                headers = {
+                    "Authorization": f"Bearer {self._api_key}",
+                    "X-Runway-Version": RUNWAY_VERSION,
+                    "Content-Type": "application/json",
+                }
+                body = {
+                    "model": str(self.model),
+                    "promptImage": prompt_image_payload,
+                    "promptText": prompt_text,
+                    "ratio": str(self.ratio),
+                    "duration": duration_int,
+                }
+                r = requests.post(
+                    f"{RUNWAY_API_BASE}/image_to_video",
+                    headers=headers,
+                    json=body,
+                    timeout=30,
+                )
+                if r.status_code == 401:
+                    raise RuntimeError(
+                        "Runway 401 Unauthorized。请设置 RUNWAYML_API_SECRET，并在同一终端 export 后再运行。"
+                    ) from None
+                if r.status_code == 400:
+                    raw = (r.text or "")[:1200]
+                    raise RuntimeError(f"Runway 400 Bad Request。完整响应: {raw}") from None
+                r.raise_for_status()
+                task_id = r.json().get("id")
+
+            if not task_id:
+                raise RuntimeError("Runway API did not return task id")
+
             headers = {
                 "Authorization": f"Bearer {self._api_key}",
                 "X-Runway-Version": RUNWAY_VERSION,
-                "Content-Type": "application/json",
-            }
-            body = {
-                "model": str(self.model),
-                "promptImage": prompt_image_payload,
-                "promptText": prompt_text,
-                "ratio": str(self.ratio),
-                "duration": duration_int,
             }
-            r = requests.post(
-                f"{RUNWAY_API_BASE}/image_to_video",
-                headers=headers,
-                json=body,
-                timeout=30,
-            )
-            if r.status_code == 401:
-                raise RuntimeError(
-                    "Runway 401 Unauthorized。请设置 RUNWAYML_API_SECRET，并在同一终端 export 后再运行。"
-                ) from None
-            if r.status_code == 400:
-                raw = (r.text or "")[:1200]
-                raise RuntimeError(f"Runway 400 Bad Request。完整响应: {raw}") from None
-            r.raise_for_status()
-            task_id = r.json().get("id")
-
-        if not task_id:
-            raise RuntimeError("Runway API did not return task id")
-
-        headers = {
-            "Authorization": f"Bearer {self._api_key}",
-            "X-Runway-Version": RUNWAY_VERSION,
-        }
-        # 轮询任务
-        while True:
-            tr = requests.get(f"{RUNWAY_API_BASE}/tasks/{task_id}", headers=headers, timeout=30)
-            tr.raise_for_status()
-            data = tr.json()
-            status = data.get("status", "").upper()
-            if status == "SUCCEEDED":
-                outputs = data.get("output") or []
-                if not outputs:
-                    raise RuntimeError("Runway task succeeded but no output")
-                out_url = outputs[0] if isinstance(outputs[0], str) else outputs[0].get("url")
-                break
-            if status in ("FAILED", "CANCELLED", "ABORTED"):
-                raise RuntimeError(f"Runway task {status}: {data.get('failure', data)}")
-            time.sleep(6)
-
-        # 下载视频
-        Path(video_save_path).parent.mkdir(parents=True, exist_ok=True)
-        vr = requests.get(out_url, timeout=120)
-        vr.raise_for_status()
-        with open(video_save_path, "wb") as f:
-            f.write(vr.content)
+            # 轮询任务
+            while True:
+                tr = requests.get(f"{RUNWAY_API_BASE}/tasks/{task_id}", headers=headers, timeout=30)
+                tr.raise_for_status()
+                data = tr.json()
+                status = data.get("status", "").upper()
+                if status == "SUCCEEDED":
+                    outputs = data.get("output") or []
+                    if not outputs:
+                        raise RuntimeError("Runway task succeeded but no output")
+                    out_url = outputs[0] if isinstance(outputs[0], str) else outputs[0].get("url")
+                    break
+                if status in ("FAILED", "CANCELLED", "ABORTED"):
+                    raise RuntimeError(f"Runway task {status}: {data.get('failure', data)}")
+                time.sleep(6)
+
+            # 下载视频
+            Path(video_save_path).parent.mkdir(parents=True, exist_ok=True)
+            vr = requests.get(out_url, timeout=120)
+            vr.raise_for_status()
+            with open(video_save_path, "wb") as f:
+                f.write(vr.content)
+
+        # 录制 / 回放（cassette.py）：指纹用发给 Runway 的关键帧内容与参数，下载的视频作为文件录下
+        payload = {
+            "model": str(self.model),
+            "prompt_text": prompt_text,
+            "prompt_image": hashlib.sha256(prompt_image_uri.encode("utf-8")).hexdigest(),
+            "ratio": str(self.ratio),
+            "duration": duration_int,
+        } if cassette.enabled() else None
+        cassette.through("image2video", payload, _generate, outputs=[video_save_path])
         return image_path
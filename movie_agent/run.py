@@ -1,17 +1,32 @@
+import asyncio
+import copy
 import os
+import queue
 import re
 import shutil
+import threading
+import time
 from datetime import datetime
 import argparse
 
-from base_agent import BaseAgent
-from system_prompts import sys_prompts
+from base_agent import BaseAgent, run_coro
+import cassette
+import llm_cache
+import metering
+from llm_schema import (LLMOutputError, SchemaError, validate_step1, validate_scene_annotation,
+                        validate_shot, validate_shot_annotation, validate_fused)
+from system_prompts import sys_prompts, scene_query, shot_query
 from tools import ToolCalling, save_json
 import json
 from moviepy import VideoFileClip, concatenate_videoclips
 from pathlib import Path
 import yaml
 
+# 规划阶段（ScenePlanning / ShotPlotCreate）同时在途的 LLM 请求数；1 表示逐个串行（原行为）
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))
+# 并发模式下单个请求（一个 Sub-Script / 一个 scene）失败后的重试次数，只重试失败的那一个
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "2"))
+
 def parse_args():
     
     # parser = argparse.ArgumentParser(description='MovieAgent', formatter_class=argparse.RawTextHelpFormatter)
@@ -105,6 +120,63 @@ def parse_args():
         default="final_video",
         help="最终视频文件名（不含扩展名）(default: final_video)",
     )
+    parser.add_argument(
+        "--llm_concurrency",
+        type=int,
+        default=LLM_CONCURRENCY,
+        help="ScenePlanning / ShotPlotCreate 同时在途的 LLM 请求数，1 为串行 (default: LLM_CONCURRENCY 或 4)",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="流水线模式：每个 Sub-Script 场景规划完立即规划镜头，每个 scene 镜头规划完立即生成关键帧/视频，不等其他 Sub-Script",
+    )
+    parser.add_argument(
+        "--stream_shots",
+        action="store_true",
+        help="与 --pipelined 合用：镜头规划流式返回，每个 Shot 一写完就开始生成关键帧，不等整段回复",
+    )
+    parser.add_argument(
+        "--fused_planning",
+        action="store_true",
+        help="融合规划：每个 Sub-Script 一次 LLM 请求同时生成 scene 与镜头（代替 ScenePlanning + ShotPlotCreate 两次往返）",
+    )
+    parser.add_argument(
+        "--planning_batch",
+        action="store_true",
+        help="批量规划：ScriptBreak 之后把 ScenePlanning 请求提交到批量接口即退出（PLANNING_BATCH_BACKEND），"
+             "之后用 batch_planning.py resume 等结果写出 Step_2 / Step_3，再加 --resume_from_shots 继续",
+    )
+    parser.add_argument(
+        "--llm_cache",
+        action="store_true",
+        help="开启 LLM 回复磁盘缓存（同 LLM_CACHE=1）：完全相同的请求直接复用上次回复，续跑/重跑规划不再花钱",
+    )
+    parser.add_argument(
+        "--llm_cache_bypass",
+        type=str,
+        default=None,
+        help="逗号分隔的阶段名，这些阶段不读写缓存（重新采样）：screenwriter,sceneplanning,shotplotcreate 或 all",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=str,
+        choices=("off", "record", "replay"),
+        default=None,
+        help="录制 / 回放所有 LLM、vision、Gemini、Runway 调用（见 cassette.py；默认 MOVIEAGENT_CASSETTE_MODE）；replay 不需要任何 API key",
+    )
+    parser.add_argument(
+        "--cassette_dir",
+        type=str,
+        default=None,
+        help="cassette 目录 (default: MOVIEAGENT_CASSETTE_DIR 或 ./cassettes)",
+    )
+    parser.add_argument(
+        "--cassette_latency",
+        type=str,
+        default=None,
+        help="回放延迟：秒数 / recorded / 按类型如 llm=recorded,keyframe=8,*=0 (default: MOVIEAGENT_CASSETTE_LATENCY 或 0)",
+    )
 
     args = parser.parse_args()
 
@@ -189,9 +261,95 @@ def _resolve_character_names(character_names, character_photo_path, mapping, dir
     return out
 
 
+def _scene_only(scene_annotation):
+    """去掉各 scene 的 Shot Annotation，得到 Step_2 里的 Scene Annotation。"""
+    out = copy.deepcopy(scene_annotation)
+    for scene in out["Scene"].values():
+        scene.pop("Shot Annotation", None)
+    return out
+
+
+REASK_HINT = (
+    "\n\nYour previous answer could not be used ({error}). "
+    "Reply again with the complete JSON object only, following the required output format exactly."
+)
+
+
+def _reask(query, error):
+    """在原始 query 末尾附上一次（且只一次）上次回复的错误说明。"""
+    return query + REASK_HINT.format(error=error)
+
+
+def _retry_plan(agent, original, query, label, attempt, retries, error):
+    """
+    重试前的处理：回复本身有问题（JSON 修不好 / 缺字段 / 被截断）时立即重问，
+    重问的 query 总是从原始 query 重新拼，只带这一次的错误说明，提示不会一轮轮叠加；
+    请求出错（网络、限流等）时原样重发，按 1s / 2s / 4s… 退避。返回 (下次的 query, 等待秒数)。
+    """
+    if isinstance(error, (LLMOutputError, SchemaError)):
+        print(f"[{agent.stage or 'llm'}重问 {attempt+1}/{retries}] {label}: {error}")
+        return _reask(original, error), 0
+    wait = 2 ** attempt
+    print(f"[{agent.stage or 'llm'}重试 {attempt+1}/{retries}] {label}: {error}，{wait}s 后重试…")
+    return query, wait
+
+
+async def _acall_with_retry(agent, query, label, retries=None, validate=None, on_item=None):
+    """await agent.acall(query, parse=True)；失败只重试这一个 Sub-Script / scene，最多 retries 次（见 _retry_plan）。"""
+    retries = LLM_RETRIES if retries is None else retries
+    original = query
+    for attempt in range(retries + 1):
+        try:
+            return await agent.acall(query, parse=True, validate=validate, on_item=on_item)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            query, wait = _retry_plan(agent, original, query, label, attempt, retries, e)
+            await asyncio.sleep(wait)
+
+
+def _call_with_retry(agent, query, label, retries=None, validate=None, reask_for=None):
+    """
+    _acall_with_retry 的同步版本，供串行路径（llm_concurrency=1、ScriptBreak）使用。
+    reask_for：上一次（如 batch 里）的回复已经出过这个错，第一次请求就带上重问说明。
+    """
+    retries = LLM_RETRIES if retries is None else retries
+    original = query
+    if reask_for is not None:
+        query = _reask(original, reask_for)
+    for attempt in range(retries + 1):
+        try:
+            return agent(query, parse=True, validate=validate)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            query, wait = _retry_plan(agent, original, query, label, attempt, retries, e)
+            time.sleep(wait)
+
+
+def _fan_out(agent, queries, concurrency, retries=None, labels=None, validate=None):
+    """
+    把互相独立的 query 并发发给同一个 agent（use_history=False），最多 concurrency 个同时在途。
+    在常驻的后台 event loop 上执行（base_agent.run_coro），走 agent.acall 的共享 AsyncOpenAI 连接池；
+    返回解析后的 JSON，顺序与 queries 一致。
+    单个 query 失败（请求出错或 JSON 解析失败）按 1s / 2s / 4s… 退避重试，不影响其他 query。
+    """
+    labels = labels or [f"#{i + 1}" for i in range(len(queries))]
+
+    async def _one(sem, query, label):
+        async with sem:
+            return await _acall_with_retry(agent, query, label, retries, validate)
+
+    async def _all():
+        sem = asyncio.Semaphore(max(1, concurrency))
+        return await asyncio.gather(*[_one(sem, q, l) for q, l in zip(queries, labels)])
+
+    return run_coro(_all())
+
+
 class ScriptBreakAgent:
     def __init__(self, args, sample_model="sdxl-1", audio_model="VALL-E", talk_model = "Hallo2", Image2Video = "CogVideoX",
-                 script_path = "", character_photo_path="", save_mode="img"):
+                 script_path = "", character_photo_path="", save_mode="img", tools=None):
         self.args = args
         self.sample_model = sample_model
         self.audio_model = audio_model
@@ -205,10 +363,14 @@ class ScriptBreakAgent:
 
         self.update_info()
         self.init_agent()
-        self.init_videogen()
+        self.init_videogen(tools)
     
-    def init_videogen(self):
+    def init_videogen(self, tools=None):
         movie_script, characters_list = self.extract_characters_from_json(self.script_path, 40)
+        if tools is not None:
+            # 复用调用方（如 API 的 pipeline 工厂）已建好的 Gemini / Runway 管道
+            self.tools = tools
+            return
 
         self.tools = ToolCalling(self.args, sample_model=self.sample_model, audio_model = self.audio_model, \
                                  talk_model = self.talk_model, Image2Video = self.Image2Video, \
@@ -217,15 +379,25 @@ class ScriptBreakAgent:
     
     def init_agent(self):
         # initialize agent
-        self.screenwriter_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["screenwriterCoT-sys"], use_history=False, temp=0.7)
+        self.screenwriter_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["screenwriterCoT-sys"], use_history=False, temp=0.7, stage="screenwriter")
         # self.supervisor_agent = BaseAgent(system_prompt=sys_prompts["scriptsupervisor-sys"], temp=0.7)
 
-        self.sceneplanning_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["ScenePlanningCoT-sys"], use_history=False, temp=0.7)
+        self.sceneplanning_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["ScenePlanningCoT-sys"], use_history=False, temp=0.7, stage="sceneplanning")
+
+        self.shotplotcreate_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["ShotPlotCreateCoT-sys"], use_history=False, temp=0.7, stage="shotplotcreate")
 
-        self.shotplotcreate_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["ShotPlotCreateCoT-sys"], use_history=False, temp=0.7)
+        # 融合模式：一次请求同时给出 scene 与其镜头（--fused_planning）
+        self.fusedplanning_agent = BaseAgent(self.args.LLM, system_prompt=sys_prompts["FusedPlanningCoT-sys"], use_history=False, temp=0.7, stage="fusedplanning")
         
         
         
+    def show_usage(self):
+        for name in ("screenwriter_agent", "sceneplanning_agent", "shotplotcreate_agent", "fusedplanning_agent"):
+            print(f"[{name}]")
+            getattr(self, name).show_usage()
+        if llm_cache.stats:
+            print("LLM cache by stage:", llm_cache.stats)
+
     def format_results(self, results):
         formatted_text = "Observation:\n\n"
         for item in results:
@@ -294,7 +466,7 @@ class ScriptBreakAgent:
                     Character: {characters_list}
                     """
             
-            task_response = self.screenwriter_agent(query, parse=True)
+            task_response = _call_with_retry(self.screenwriter_agent, query, "ScriptBreak", validate=validate_step1)
             # task_response = task_response.replace("'",'"')
             result = task_response
 
@@ -304,6 +476,41 @@ class ScriptBreakAgent:
         save_json(result, self.sub_script_path)
         # return 
 
+    @property
+    def llm_concurrency(self):
+        return getattr(self.args, "llm_concurrency", None) or LLM_CONCURRENCY
+
+    @property
+    def fused_planning(self):
+        return bool(getattr(self.args, "fused_planning", False))
+
+    @property
+    def stream_shots(self):
+        return bool(getattr(self.args, "stream_shots", False))
+
+    def FusedPlanning(self):
+        """
+        代替 ScenePlanning + ShotPlotCreate：每个 Sub-Script 一次请求同时拿到 scene 与镜头，
+        往返次数减半，也不用把 scene JSON 再发一遍。结果拆开后写出与分阶段完全相同结构的 Step_2 / Step_3。
+        """
+        data = self.read_json(self.sub_script_path)
+        character_relationships = data['Relationships']
+        sub_script_list = data['Sub-Script']
+
+        names = list(sub_script_list)
+        queries = [self._scene_query(sub_script_list[name]["Plot"], character_relationships) for name in names]
+        responses = _fan_out(self.fusedplanning_agent, queries, self.llm_concurrency,
+                             labels=names, validate=validate_fused)
+        data_scene = copy.deepcopy(data)
+        for name, task_response in zip(names, responses):
+            data_scene['Sub-Script'][name]["Scene Annotation"] = _scene_only(task_response)
+            data['Sub-Script'][name]["Scene Annotation"] = task_response
+        save_json(data_scene, self.scene_path)
+        save_json(data, self.shot_path)
+
+    def _scene_query(self, sub_script, character_relationships):
+        return scene_query(sub_script, character_relationships)
+
     def ScenePlanning(self):
         data = self.read_json(self.sub_script_path)
         data_scene = data
@@ -311,14 +518,22 @@ class ScriptBreakAgent:
         character_relationships = data['Relationships']
         sub_script_list = data['Sub-Script']
 
+        if self.llm_concurrency > 1:
+            # 各 Sub-Script 互相独立：并发请求，按原顺序写回，Step_2 只原子写一次
+            names = list(sub_script_list)
+            queries = [self._scene_query(sub_script_list[name]["Plot"], character_relationships) for name in names]
+            responses = _fan_out(self.sceneplanning_agent, queries, self.llm_concurrency, labels=names,
+                                 validate=validate_scene_annotation)
+            for name, task_response in zip(names, responses):
+                data_scene['Sub-Script'][name]["Scene Annotation"] = task_response
+            save_json(data_scene, self.scene_path)
+            return
+
         for sub_script_name in sub_script_list:
             sub_script = sub_script_list[sub_script_name]["Plot"]
-            query = f"""
-                        Given the following inputs:
-                        - Script Synopsis: "{sub_script}"
-                        - Character Relationships: {character_relationships}
-                        """
-            task_response = self.sceneplanning_agent(query, parse=True)
+            query = self._scene_query(sub_script, character_relationships)
+            task_response = _call_with_retry(self.sceneplanning_agent, query, sub_script_name,
+                                             validate=validate_scene_annotation)
             # if "Scene Annotation" not in data_scene[sub_script_name]:
             #     data_scene[sub_script_name]["Scene Annotation"] = []
             
@@ -327,6 +542,9 @@ class ScriptBreakAgent:
             save_json(data_scene, self.scene_path)
             # break
     
+    def _shot_query(self, scene_details):
+        return shot_query(scene_details)
+
     def ShotPlotCreate(self):
         data = self.read_json(self.scene_path)
         data_scene = data
@@ -334,21 +552,28 @@ class ScriptBreakAgent:
         character_relationships = data['Relationships']
         sub_script_list = data['Sub-Script']
 
+        if self.llm_concurrency > 1:
+            # 每个 scene 互相独立：全部 scene 并发请求（总耗时约为最慢的一个），
+            # 失败的 scene 单独重试，按 Sub-Script / Scene 原顺序写回，Step_3 只原子写一次
+            keys = [(sub_script_name, scene_name)
+                    for sub_script_name in sub_script_list
+                    for scene_name in sub_script_list[sub_script_name]["Scene Annotation"]["Scene"]]
+            queries = [self._shot_query(sub_script_list[a]["Scene Annotation"]["Scene"][b]) for a, b in keys]
+            responses = _fan_out(self.shotplotcreate_agent, queries, self.llm_concurrency,
+                                 labels=[f"{a} / {b}" for a, b in keys], validate=validate_shot_annotation)
+            for (sub_script_name, scene_name), task_response in zip(keys, responses):
+                data_scene['Sub-Script'][sub_script_name]["Scene Annotation"]["Scene"][scene_name]["Shot Annotation"] = task_response
+            save_json(data_scene, self.shot_path)
+            return
+
         for sub_script_name in sub_script_list:
             scene_list = sub_script_list[sub_script_name]["Scene Annotation"]["Scene"]
             for scene_name in scene_list:
                 scene_details = scene_list[scene_name]
-                query = f"""
-                            Given the following Scene Details:
-                            - Involving Characters: "{scene_details['Involving Characters']}" 
-                            - Plot: "{scene_details['Plot']}"
-                            - Scene Description: "{scene_details['Scene Description']}"
-                            - Emotional Tone: "{scene_details['Emotional Tone']}"
-                            - Key Props: {scene_details['Key Props']}
-                            - Cinematography Notes: "{scene_details['Cinematography Notes']}"
-                            """
+                query = self._shot_query(scene_details)
                             
-                task_response = self.shotplotcreate_agent(query, parse=True)
+                task_response = _call_with_retry(self.shotplotcreate_agent, query, f"{sub_script_name} / {scene_name}",
+                                                 validate=validate_shot_annotation)
                 # if "Shot Annotation" not in data_scene[sub_script_name]:
                 #     data_scene[sub_script_name]["Shot Annotation"] = []
                 
@@ -357,12 +582,155 @@ class ScriptBreakAgent:
                 save_json(data_scene, self.shot_path)
             #     break
         
+    def _gen_shot(self, sub_script_name, scene_name, shot_name, shot_info):
+        """单个镜头：角色解析 -> 参考图 -> 关键帧（+ 图生视频）。镜头之间没有依赖，可按任意顺序调用。"""
+        involving = shot_info["Involving Characters"]
+        character_box = involving if isinstance(involving, dict) else {}
+        character_names = list(character_box.keys())
+        # 先加载「角色名 -> 文件夹名」映射（分镜里常为 Character 1/2，文件夹为 布布、一二）
+        if not getattr(self, "_character_mapping_loaded", False):
+            _cache = _load_character_mapping_and_dirs(self.character_photo_path)
+            self._character_mapping = _cache["mapping"]
+            self._character_photo_dirs = _cache["dirs"]
+            self._character_mapping_loaded = True
+        character_names = _resolve_character_names(
+            character_names,
+            self.character_photo_path,
+            getattr(self, "_character_mapping", None),
+            getattr(self, "_character_photo_dirs", None),
+        )
+        # Prop/detail shots (no characters): use Plot/Visual Description for full prompt
+        if not character_names:
+            plot = shot_info.get("Plot/Visual Description", shot_info.get("Coarse Plot", ""))
+        elif self.sample_model == "ROICtrl":
+            plot = shot_info["Coarse Plot"]
+        else:
+            plot = shot_info["Plot/Visual Description"]
+        # 画面内容里不写具体角色名，用占位词替换（按本镜实际角色数）
+        _char_label = "这个角色" if len(character_names) == 1 else "两个角色"
+        def _replace_character_names_in_plot(text, dirs, mapping, label):
+            if not text:
+                return text
+            names = set(dirs)
+            if mapping:
+                names |= set(mapping.values())
+            for name in names:
+                text = text.replace(name, label)
+            for i in range(1, 6):
+                text = text.replace(f"Character {i}", label).replace(f"Character{i}", label)
+            return text
+        if len(character_names) <= 1:
+            # 单角色 / 道具镜：统一替换为"这个角色"
+            plot = _replace_character_names_in_plot(
+                plot,
+                getattr(self, "_character_photo_dirs", []),
+                getattr(self, "_character_mapping", None),
+                _char_label,
+            )
+        else:
+            # 多角色镜：把 plot 里所有角色名变体替换为有序占位标签（角色A/B/C/D），
+            # 与 gemini_image.py 里参考图分组 hint 的标签严格对应。
+            # 不管 GPT-4o 输出中文名还是 Character N，都统一清除，避免 Gemini 认错人。
+            _ordered_labels = ["Character A", "Character B", "Character C", "Character D"]
+            _char_mapping = getattr(self, "_character_mapping", {}) or {}
+            for _ci, _cname in enumerate(character_names):
+                _clabel = _ordered_labels[_ci] if _ci < len(_ordered_labels) else f"Character {chr(65+_ci)}"
+                # 替换中文真实名字
+                plot = plot.replace(_cname, _clabel)
+                # 替换 mapping 里的 key（如 "Character 1"）和 value
+                for _orig_key, _mapped_val in _char_mapping.items():
+                    if _mapped_val == _cname:
+                        plot = plot.replace(_orig_key, _clabel)
+                # 替换 Character N 通用占位（数字，如 Character 1）
+                plot = plot.replace(f"Character {_ci+1}", _clabel).replace(f"Character{_ci+1}", _clabel)
+                # 替换 Character A/B/C/D（GPT-4o 把角色A直接英译的变体）
+                _letter = chr(65 + _ci)  # A, B, C, D
+                plot = plot.replace(f"Character {_letter}", _clabel).replace(f"Character{_letter}", _clabel)
+
+        subtitle = shot_info.get("Subtitles") or {}
+        # [Camera: ...] 注入：把分镜里的 Camera Movement 前置到 plot
+        camera_mv = shot_info.get("Camera Movement", "").strip()
+        if camera_mv:
+            plot = f"[Camera: {camera_mv}] " + plot
+        # 参考图：Replicate 用 1～2 张；Gemini 用四方向（front/oblique/side/back）最多 8 张，没有 best
+        def _first_ref_image(char_name):
+            base = os.path.join(self.character_photo_path, char_name.replace(" ", "_"))
+            for direc in ("front", "oblique", "side", "back"):
+                for ext in (".png", ".jpg", ".PNG", ".JPG"):
+                    p = os.path.join(base, direc + ext)
+                    if os.path.isfile(p):
+                        return p
+            return None
+        def _ref_images_up_to_8(char_names):
+            """按角色顺序收四方向（front→oblique→side→back），每角色最多 4 张，共最多 8 张。支持 .jpg/.JPG/.png/.PNG。"""
+            # 每个方向试小写+大写扩展名，兼容 front.JPG 等
+            directions = ("front", "oblique", "side", "back")
+            exts = (".png", ".jpg", ".PNG", ".JPG")
+            out, seen = [], set()
+            for name in char_names:
+                base = os.path.join(self.character_photo_path, name.replace(" ", "_"))
+                for direc in directions:
+                    if len(out) >= 8:
+                        return out
+                    for ext in exts:
+                        p = os.path.join(base, direc + ext)
+                        if os.path.isfile(p) and p not in seen:
+                            out.append(p)
+                            seen.add(p)
+                            break
+            return out
+        if getattr(self.args, "gen_model", None) == "Gemini":
+            gemini_char_dirs = getattr(self, "_character_photo_dirs", [])
+            if not character_names:
+                # 道具镜：传所有角色参考图仅用于画风参考，Gemini 内部识别为 prop shot
+                character_phot_list = _ref_images_up_to_8(gemini_char_dirs)
+            else:
+                # 角色镜：只传本镜实际出现的角色的参考图
+                character_phot_list = _ref_images_up_to_8(character_names)
+            # 不注入 prev_keyframe：前一帧可能是特写/单人镜，注入后 Gemini 会被误导（如双人镜只画出两只手）
+        elif character_names:
+            path0 = _first_ref_image(character_names[0])
+            character_phot_list = [path0] if os.path.isfile(path0) else []
+            if len(character_names) > 1:
+                path1 = _first_ref_image(character_names[1])
+                if os.path.isfile(path1):
+                    character_phot_list.append(path1)
+                else:
+                    print(f"[提示] 本镜有两人但第二角色「{character_names[1]}」参考图不存在 ({path1})，将只使用首角色参考图。请在 character_list 下为该角色放置四方向图（front/oblique/side/back）。")
+        else:
+            character_phot_list = []
+        if character_names and character_phot_list:
+            _ordered_labels = ["Character A", "Character B", "Character C", "Character D"]
+            labels = [
+                _ordered_labels[i] if i < len(_ordered_labels) else f"Character {chr(65+i)}"
+                for i in range(len(character_names))
+            ]
+            print(f"[本镜角色] {labels}，参考图数: {len(character_phot_list)}")
+        save_path = os.path.join(self.video_save_path, sub_script_name + "|" + scene_name + "|" + shot_name + ".jpg")
+        save_path = save_path.replace(" ", "_")
+
+        video_save_path = save_path.replace(".jpg", ".mp4")
+        # 若已存在关键帧且指定了跳过
+        if getattr(self.args, "skip_existing_keyframes", False) and os.path.isfile(save_path):
+            if os.path.isfile(video_save_path):
+                print(f"跳过（关键帧+视频已有）: {save_path}")
+                return
+            # 关键帧已有但视频缺失：只补图生视频
+            print(f"关键帧已有，补生成视频: {video_save_path}")
+            try:
+                with metering.timed("image2video", self.tools.image2video_model, units=1):
+                    self.tools.image2video.predict(plot, save_path, video_save_path, (1024, 512))
+            except Exception as e:
+                print(f"[图生视频失败] 本镜跳过: {save_path}，错误: {e}")
+            return
+        print("Save the video to path:", save_path)
+        self.tools.sample(plot, character_phot_list, character_box, subtitle, save_path, (1024, 512))
+
     def VideoAudioGen(self):
         data = self.read_json(self.shot_path)
         character_relationships = data['Relationships']
         sub_script_list = data['Sub-Script']
 
-        prev_keyframe_path = None  # 上一镜关键帧路径，用于本镜参考服装一致
         for idx_1,sub_script_name in enumerate(sub_script_list):
             scene_list = sub_script_list[sub_script_name]["Scene Annotation"]["Scene"]
             # scene_path = os.path.join(self.video_save_path,shot_name+".jpg")
@@ -371,157 +739,13 @@ class ScriptBreakAgent:
 
             for scene_name in scene_list:
                 shot_lists = scene_list[scene_name]["Shot Annotation"]["Shot"]
-                prev_keyframe_path = None  # scene 边界 reset，不把上一 scene 的服装带入下一 scene
 
                 # scene_path = os.path.join(self.video_save_path,shot_name+".jpg")
                 # if idx_1!=len(sub_script_list)-1:
             #     continue
 
                 for shot_name in shot_lists:
-                    shot_info = shot_lists[shot_name]
-                    involving = shot_info["Involving Characters"]
-                    character_box = involving if isinstance(involving, dict) else {}
-                    character_names = list(character_box.keys())
-                    # 先加载「角色名 -> 文件夹名」映射（分镜里常为 Character 1/2，文件夹为 布布、一二）
-                    if not getattr(self, "_character_mapping_loaded", False):
-                        _cache = _load_character_mapping_and_dirs(self.character_photo_path)
-                        self._character_mapping = _cache["mapping"]
-                        self._character_photo_dirs = _cache["dirs"]
-                        self._character_mapping_loaded = True
-                    character_names = _resolve_character_names(
-                        character_names,
-                        self.character_photo_path,
-                        getattr(self, "_character_mapping", None),
-                        getattr(self, "_character_photo_dirs", None),
-                    )
-                    # Prop/detail shots (no characters): use Plot/Visual Description for full prompt
-                    if not character_names:
-                        plot = shot_info.get("Plot/Visual Description", shot_info.get("Coarse Plot", ""))
-                    elif self.sample_model == "ROICtrl":
-                        plot = shot_info["Coarse Plot"]
-                    else:
-                        plot = shot_info["Plot/Visual Description"]
-                    # 画面内容里不写具体角色名，用占位词替换（按本镜实际角色数）
-                    _char_label = "这个角色" if len(character_names) == 1 else "两个角色"
-                    def _replace_character_names_in_plot(text, dirs, mapping, label):
-                        if not text:
-                            return text
-                        names = set(dirs)
-                        if mapping:
-                            names |= set(mapping.values())
-                        for name in names:
-                            text = text.replace(name, label)
-                        for i in range(1, 6):
-                            text = text.replace(f"Character {i}", label).replace(f"Character{i}", label)
-                        return text
-                    if len(character_names) <= 1:
-                        # 单角色 / 道具镜：统一替换为"这个角色"
-                        plot = _replace_character_names_in_plot(
-                            plot,
-                            getattr(self, "_character_photo_dirs", []),
-                            getattr(self, "_character_mapping", None),
-                            _char_label,
-                        )
-                    else:
-                        # 多角色镜：把 plot 里所有角色名变体替换为有序占位标签（角色A/B/C/D），
-                        # 与 gemini_image.py 里参考图分组 hint 的标签严格对应。
-                        # 不管 GPT-4o 输出中文名还是 Character N，都统一清除，避免 Gemini 认错人。
-                        _ordered_labels = ["Character A", "Character B", "Character C", "Character D"]
-                        _char_mapping = getattr(self, "_character_mapping", {}) or {}
-                        for _ci, _cname in enumerate(character_names):
-                            _clabel = _ordered_labels[_ci] if _ci < len(_ordered_labels) else f"Character {chr(65+_ci)}"
-                            # 替换中文真实名字
-                            plot = plot.replace(_cname, _clabel)
-                            # 替换 mapping 里的 key（如 "Character 1"）和 value
-                            for _orig_key, _mapped_val in _char_mapping.items():
-                                if _mapped_val == _cname:
-                                    plot = plot.replace(_orig_key, _clabel)
-                            # 替换 Character N 通用占位（数字，如 Character 1）
-                            plot = plot.replace(f"Character {_ci+1}", _clabel).replace(f"Character{_ci+1}", _clabel)
-                            # 替换 Character A/B/C/D（GPT-4o 把角色A直接英译的变体）
-                            _letter = chr(65 + _ci)  # A, B, C, D
-                            plot = plot.replace(f"Character {_letter}", _clabel).replace(f"Character{_letter}", _clabel)
-
-                    subtitle = shot_info.get("Subtitles") or {}
-                    # [Camera: ...] 注入：把分镜里的 Camera Movement 前置到 plot
-                    camera_mv = shot_info.get("Camera Movement", "").strip()
-                    if camera_mv:
-                        plot = f"[Camera: {camera_mv}] " + plot
-                    # 参考图：Replicate 用 1～2 张；Gemini 用四方向（front/oblique/side/back）最多 8 张，没有 best
-                    def _first_ref_image(char_name):
-                        base = os.path.join(self.character_photo_path, char_name.replace(" ", "_"))
-                        for direc in ("front", "oblique", "side", "back"):
-                            for ext in (".png", ".jpg", ".PNG", ".JPG"):
-                                p = os.path.join(base, direc + ext)
-                                if os.path.isfile(p):
-                                    return p
-                        return None
-                    def _ref_images_up_to_8(char_names):
-                        """按角色顺序收四方向（front→oblique→side→back），每角色最多 4 张，共最多 8 张。支持 .jpg/.JPG/.png/.PNG。"""
-                        # 每个方向试小写+大写扩展名，兼容 front.JPG 等
-                        directions = ("front", "oblique", "side", "back")
-                        exts = (".png", ".jpg", ".PNG", ".JPG")
-                        out, seen = [], set()
-                        for name in char_names:
-                            base = os.path.join(self.character_photo_path, name.replace(" ", "_"))
-                            for direc in directions:
-                                if len(out) >= 8:
-                                    return out
-                                for ext in exts:
-                                    p = os.path.join(base, direc + ext)
-                                    if os.path.isfile(p) and p not in seen:
-                                        out.append(p)
-                                        seen.add(p)
-                                        break
-                        return out
-                    if getattr(self.args, "gen_model", None) == "Gemini":
-                        gemini_char_dirs = getattr(self, "_character_photo_dirs", [])
-                        if not character_names:
-                            # 道具镜：传所有角色参考图仅用于画风参考，Gemini 内部识别为 prop shot
-                            character_phot_list = _ref_images_up_to_8(gemini_char_dirs)
-                        else:
-                            # 角色镜：只传本镜实际出现的角色的参考图
-                            character_phot_list = _ref_images_up_to_8(character_names)
-                        # 不注入 prev_keyframe：前一帧可能是特写/单人镜，注入后 Gemini 会被误导（如双人镜只画出两只手）
-                    elif character_names:
-                        path0 = _first_ref_image(character_names[0])
-                        character_phot_list = [path0] if os.path.isfile(path0) else []
-                        if len(character_names) > 1:
-                            path1 = _first_ref_image(character_names[1])
-                            if os.path.isfile(path1):
-                                character_phot_list.append(path1)
-                            else:
-                                print(f"[提示] 本镜有两人但第二角色「{character_names[1]}」参考图不存在 ({path1})，将只使用首角色参考图。请在 character_list 下为该角色放置四方向图（front/oblique/side/back）。")
-                    else:
-                        character_phot_list = []
-                    if character_names and character_phot_list:
-                        _ordered_labels = ["Character A", "Character B", "Character C", "Character D"]
-                        labels = [
-                            _ordered_labels[i] if i < len(_ordered_labels) else f"Character {chr(65+i)}"
-                            for i in range(len(character_names))
-                        ]
-                        print(f"[本镜角色] {labels}，参考图数: {len(character_phot_list)}")
-                    save_path = os.path.join(self.video_save_path, sub_script_name + "|" + scene_name + "|" + shot_name + ".jpg")
-                    save_path = save_path.replace(" ", "_")
-
-                    video_save_path = save_path.replace(".jpg", ".mp4")
-                    # 若已存在关键帧且指定了跳过
-                    if getattr(self.args, "skip_existing_keyframes", False) and os.path.isfile(save_path):
-                        if os.path.isfile(video_save_path):
-                            print(f"跳过（关键帧+视频已有）: {save_path}")
-                            prev_keyframe_path = save_path
-                            continue
-                        # 关键帧已有但视频缺失：只补图生视频
-                        print(f"关键帧已有，补生成视频: {video_save_path}")
-                        try:
-                            self.tools.image2video.predict(plot, save_path, video_save_path, (1024, 512))
-                        except Exception as e:
-                            print(f"[图生视频失败] 本镜跳过: {save_path}，错误: {e}")
-                        prev_keyframe_path = save_path
-                        continue
-                    print("Save the video to path:", save_path)
-                    self.tools.sample(plot, character_phot_list, character_box, subtitle, save_path, (1024, 512))
-                    prev_keyframe_path = save_path  # 本镜成片作为下一镜的服装参考
+                    self._gen_shot(sub_script_name, scene_name, shot_name, shot_lists[shot_name])
 
 
                     # break
@@ -531,6 +755,134 @@ class ScriptBreakAgent:
             if getattr(self.args, "only_first_scene", False):
                 break
 
+    def Pipelined(self, progress_callback=None):
+        """
+        流水线模式：代替 ScenePlanning -> ShotPlotCreate -> VideoAudioGen 三道硬屏障。
+        后台线程里每个 Sub-Script 的场景规划一返回就开始规划它各个 scene 的镜头（LLM 并发上限 llm_concurrency），
+        每个 scene 的镜头一规划完就交给当前线程生成关键帧 / 视频，
+        于是 Sub-Script 1 的 Gemini / Runway 与 Sub-Script 5 的 LLM 规划重叠执行。
+        Step_2 / Step_3 在规划全部完成后各原子写一次（结构与分阶段跑完一致，可用于 --resume_from_shots）。
+        stream_shots 开启时镜头规划走流式请求，回复里每个 "Shot N" 一闭合、字段校验通过就开始生成，不等同一 scene 的其余镜头；
+        这条回复随后若被重问，已开始生成的镜头不会重做，Step_3 里记录的是实际生成所用的镜头。
+        progress_callback(done_shots, planned_shots, planning_done) 每生成完一个镜头调用一次（可选）。
+        """
+        data = self.read_json(self.sub_script_path)
+        character_relationships = data['Relationships']
+        sub_script_list = data['Sub-Script']
+        ready = queue.Queue()  # (sub_script_name, scene_name, shot_lists) | Exception | None（规划结束）
+        # 已交给生成线程的镜头 (sub_script, scene, shot) -> 镜头内容；流式提前放出的镜头和重问后的完整回复不重复生成，
+        # 规划结束后按它回写 Step_3（重问后的回复可能与已生成的镜头不同）
+        rendered = {}
+        stop = threading.Event()  # 生成线程退出（含出错）后置位：planner 不再发新请求、不写 Step_2 / Step_3
+
+        def _release(sub_script_name, scene_name, shot_lists):
+            fresh = {n: shot for n, shot in shot_lists.items() if (sub_script_name, scene_name, n) not in rendered}
+            rendered.update(((sub_script_name, scene_name, n), shot) for n, shot in fresh.items())
+            if fresh:
+                ready.put((sub_script_name, scene_name, fresh))
+
+        def _on_shot(sub_script_name, scene_name=None):
+            """流式回调：path 末尾为 [..., "Shot", "Shot N"]；融合规划时 scene 名取自 path[1]。"""
+            if not self.stream_shots:
+                return None
+
+            def on_item(path, obj):
+                if len(path) >= 2 and path[-2] == "Shot":
+                    try:
+                        validate_shot(obj, f"{sub_script_name} / {path[-1]}")
+                    except SchemaError as e:
+                        # 不提前放出；整段回复的校验与重问会处理它
+                        print(f"[stream] 镜头字段不全，等完整回复: {e}")
+                        return
+                    _release(sub_script_name, scene_name or path[1], {path[-1]: obj})
+            return on_item
+
+        def _apply_rendered():
+            """把实际生成所用的镜头写回 data（Step_3），与已生成的关键帧 / 视频一致。"""
+            for (sub_script_name, scene_name, shot_name), shot in rendered.items():
+                scenes = sub_script_list[sub_script_name]["Scene Annotation"]["Scene"]
+                scene = scenes.setdefault(scene_name, {})
+                scene.setdefault("Shot Annotation", {}).setdefault("Shot", {})[shot_name] = shot
+
+        async def _plan_sub_script(sem, sub_script_name):
+            if self.fused_planning:
+                async with sem:
+                    if stop.is_set():
+                        return
+                    scene_annotation = await _acall_with_retry(
+                        self.fusedplanning_agent,
+                        self._scene_query(sub_script_list[sub_script_name]["Plot"], character_relationships),
+                        sub_script_name, validate=validate_fused, on_item=_on_shot(sub_script_name))
+                sub_script_list[sub_script_name]["Scene Annotation"] = scene_annotation
+                for scene_name, scene in scene_annotation["Scene"].items():
+                    _release(sub_script_name, scene_name, scene["Shot Annotation"]["Shot"])
+                return
+
+            async with sem:
+                if stop.is_set():
+                    return
+                scene_annotation = await _acall_with_retry(
+                    self.sceneplanning_agent,
+                    self._scene_query(sub_script_list[sub_script_name]["Plot"], character_relationships),
+                    sub_script_name, validate=validate_scene_annotation)
+            sub_script_list[sub_script_name]["Scene Annotation"] = scene_annotation
+
+            async def _plan_scene(scene_name):
+                scene_details = scene_annotation["Scene"][scene_name]
+                async with sem:
+                    if stop.is_set():
+                        return
+                    scene_details["Shot Annotation"] = await _acall_with_retry(
+                        self.shotplotcreate_agent, self._shot_query(scene_details),
+                        f"{sub_script_name} / {scene_name}", validate=validate_shot_annotation,
+                        on_item=_on_shot(sub_script_name, scene_name))
+                _release(sub_script_name, scene_name, scene_details["Shot Annotation"]["Shot"])
+
+            await asyncio.gather(*[_plan_scene(n) for n in scene_annotation["Scene"]])
+
+        async def _plan_all():
+            sem = asyncio.Semaphore(max(1, self.llm_concurrency))
+            await asyncio.gather(*[_plan_sub_script(sem, n) for n in sub_script_list])
+
+        def _planner():
+            try:
+                run_coro(_plan_all())
+                if stop.is_set():
+                    return  # 生成已失败：不再写 Step_2 / Step_3
+                _apply_rendered()
+                data_scene = copy.deepcopy(data)
+                for sub_script in data_scene['Sub-Script'].values():
+                    sub_script["Scene Annotation"] = _scene_only(sub_script["Scene Annotation"])
+                save_json(data_scene, self.scene_path)
+                save_json(data, self.shot_path)
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+
+        # planner 线程沿用当前 context，规划阶段的用量记进同一个 Meter
+        threading.Thread(target=metering.bind(_planner), name="planner", daemon=True).start()
+
+        done_shots, planned_shots = 0, 0
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                sub_script_name, scene_name, shot_lists = item
+                planned_shots += len(shot_lists)
+                for shot_name in shot_lists:
+                    self._gen_shot(sub_script_name, scene_name, shot_name, shot_lists[shot_name])
+                    done_shots += 1
+                    if progress_callback:
+                        progress_callback(done_shots, planned_shots, False)
+        finally:
+            # 生成失败（或规划出错）时让 planner 不再发起新的 LLM 请求
+            stop.set()
+        if progress_callback:
+            progress_callback(done_shots, planned_shots, True)
+
     def Final(self, crossfade: float = 0.1, final_name: str = "final_video"):
         import natsort
         directory = self.video_save_path
@@ -613,6 +965,22 @@ def update_review_folder(dataset_dir, script_path, character_photo_path, scene_s
 
 def main():
     args = parse_args()
+    with metering.job() as meter:
+        movie_director = _run(args)
+        # 本次运行的请求数 / token / 耗时 / 估算费用（按阶段、provider 分组），写在结果目录下
+        usage_path = os.path.join(movie_director.save_path, "usage.json")
+        meter.save(usage_path)
+        total = meter.snapshot()["total"]
+        print(f"[usage] {total['requests']} requests, {total['input_tokens']} in / {total['output_tokens']} out tokens, "
+              f"~${total['cost_usd']:.4f} -> {usage_path}")
+        if cassette.enabled():
+            print(f"[cassette] {cassette.MOVIEAGENT_CASSETTE_MODE} {cassette.MOVIEAGENT_CASSETTE_DIR}: {cassette.stats}")
+
+
+def _run(args):
+    if args.llm_cache or args.llm_cache_bypass is not None:
+        llm_cache.configure(enabled=True if args.llm_cache else None, bypass=args.llm_cache_bypass)
+    cassette.configure(mode=args.cassette, cassette_dir=args.cassette_dir, latency=args.cassette_latency)
     script_path = args.script_path
     character_photo_path = args.character_photo_path
 
@@ -656,17 +1024,30 @@ def main():
         movie_director.VideoAudioGen()
     else:
         movie_director.ScriptBreak()
-        movie_director.ScenePlanning()
-        movie_director.ShotPlotCreate()
+        if getattr(args, "planning_batch", False):
+            import batch_planning
+            batch_planning.submit([movie_director.sub_script_path], args.LLM)
+            return movie_director
+        # only_planning / only_first_scene 需要分阶段的语义，此时忽略 --pipelined
+        pipelined = args.pipelined and not (args.only_planning or args.only_first_scene)
+        if pipelined:
+            movie_director.Pipelined()
+        elif args.fused_planning:
+            movie_director.FusedPlanning()
+        else:
+            movie_director.ScenePlanning()
+            movie_director.ShotPlotCreate()
         if getattr(args, "only_planning", False):
             print("[only_planning] 分镜规划完成，不生成视频。")
-            return
-        movie_director.VideoAudioGen()
+            movie_director.show_usage()
+            return movie_director
+        if not pipelined:
+            movie_director.VideoAudioGen()
 
     if getattr(args, "skip_video", False):
         print("[skip_video] 关键帧已生成，跳过视频拼接。")
         print(f"关键帧位置: {movie_director.video_save_path}")
-        return
+        return movie_director
     update_review_folder(
         dataset_dir, script_path, character_photo_path,
         scene_style_path=os.path.join(dataset_dir, "scene_style.txt"),
@@ -675,6 +1056,7 @@ def main():
     )
     # movie_director.AudioGen(script_path)
     movie_director.Final(crossfade=args.crossfade, final_name=args.final_name)
+    return movie_director
 
 
 if __name__ == "__main__":
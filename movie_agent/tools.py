@@ -1,9 +1,12 @@
 import sys
 import os
 import json
+import threading
 
 from tqdm import tqdm
 
+import metering
+
 
 
 
@@ -279,6 +282,8 @@ class Image2VideoModel:
 class ToolCalling:
     def __init__(self, args, sample_model, audio_model, talk_model, Image2Video, photo_audio_path, characters_list, save_mode):
         self.args = args
+        self.sample_model = sample_model
+        self.image2video_model = Image2Video
         self.gen = GenModel(args, sample_model, save_mode)
         self.audio_gen = AudioGenModel(audio_model,photo_audio_path,characters_list)
         self.talk_gen = TalkingModel(talk_model)
@@ -289,7 +294,8 @@ class ToolCalling:
 
     def sample(self, prompt, refer_path, character_box, subtitle, save_path, size = (1024, 512)):
         original_plot = prompt  # 保留原始分镜 plot，Runway 需要用这个而不是 Gemini 改写后的指令
-        _unused, content = self.gen.predict(prompt, refer_path, character_box, save_path, size)
+        with metering.timed("keyframe", self.sample_model, units=1):
+            _unused, content = self.gen.predict(prompt, refer_path, character_box, save_path, size)
         video_save_path = save_path.replace(".jpg", ".mp4")
         # --skip_video 时只生成关键帧，跳过图生视频
         if getattr(self.args, "skip_video", False):
@@ -299,7 +305,8 @@ class ToolCalling:
         last_err = None
         for attempt in range(3):
             try:
-                save_path = self.image2video.predict(original_plot, save_path, video_save_path, size)
+                with metering.timed("image2video", self.image2video_model, units=1):
+                    save_path = self.image2video.predict(original_plot, save_path, video_save_path, size)
                 last_err = None
                 break
             except Exception as e:
@@ -320,6 +327,10 @@ class ToolCalling:
 
 
 def save_json(content, file_path):
-    with open(file_path, 'w') as json_file:
+    # 先写临时文件再 rename：中途崩溃或并发读取时不会看到半个 JSON
+    # tmp 名带线程 id：planner 线程与并发回调可能同时写同一个文件
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as json_file:
         json.dump(content, json_file, indent=4)
+    os.replace(tmp_path, file_path)
         
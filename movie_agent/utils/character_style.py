@@ -8,6 +8,9 @@ import base64
 from pathlib import Path
 from typing import List, Tuple
 
+import cassette
+import metering
+
 # 每个角色目录下可放多角度图，按此顺序读取（文件名不含扩展名）
 # 若没有任何角度图，则回退到 best.png / best.jpg
 VIEW_ORDER = [
@@ -74,7 +77,7 @@ def get_character_style_text(character_photo_path: str, cache_path: str = None)
         from openai import OpenAI
     except ImportError:
         return ""
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = OpenAI(api_key=cassette.api_key(os.environ.get("OPENAI_API_KEY")))
     prompt = (
         "以下图片按顺序提供：每个角色依次为其「正面、斜侧面、侧面、背面」（仅包含存在的角度），角色按目录名排序。"
         "请综合这些角度，用一段简洁的中文描述（可夹少量英文关键词）概括：1) 角色整体画风（如卡通、圆润、可爱）；"
@@ -86,12 +89,17 @@ def get_character_style_text(character_photo_path: str, cache_path: str = None)
     for name, label, uri in images:
         content.append({"type": "image_url", "image_url": {"url": uri}})
 
-    resp = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": content}],
-        max_tokens=400,
-    )
-    text = (resp.choices[0].message.content or "").strip()
+    def _live():
+        resp = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": content}],
+            max_tokens=400,
+        )
+        metering.record_usage("character_style", "openai", "gpt-4o", getattr(resp, "usage", None))
+        return resp.choices[0].message.content or ""
+
+    with metering.timed("character_style", "openai", "gpt-4o"):
+        text = cassette.through("vision", {"model": "gpt-4o", "content": content, "max_tokens": 400}, _live).strip()
     if cache_path and text:
         Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
         with open(cache_path, "w", encoding="utf-8") as f:
@@ -6,6 +6,9 @@
 import os
 from pathlib import Path
 
+import cassette
+import metering
+
 
 def _image_to_data_uri(path: str) -> str:
     with open(path, "rb") as f:
@@ -40,7 +43,7 @@ def get_scene_style_text(style_reference_dir: str, cache_path: str = None) -> st
         from openai import OpenAI
     except ImportError:
         return ""
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    client = OpenAI(api_key=cassette.api_key(os.environ.get("OPENAI_API_KEY")))
     prompt = (
         "以下图片仅用于提取「画面风格」描述。\n\n"
         "【必须只描述画面风格，不要描述角色或人物】"
@@ -55,12 +58,17 @@ def get_scene_style_text(style_reference_dir: str, cache_path: str = None) -> st
     for uri in images[:10]:  # 最多 10 张，避免超长
         content.append({"type": "image_url", "image_url": {"url": uri}})
 
-    resp = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": content}],
-        max_tokens=400,
-    )
-    text = (resp.choices[0].message.content or "").strip()
+    def _live():
+        resp = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": content}],
+            max_tokens=400,
+        )
+        metering.record_usage("scene_style", "openai", "gpt-4o", getattr(resp, "usage", None))
+        return resp.choices[0].message.content or ""
+
+    with metering.timed("scene_style", "openai", "gpt-4o"):
+        text = cassette.through("vision", {"model": "gpt-4o", "content": content, "max_tokens": 400}, _live).strip()
     if cache_path and text:
         Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
         with open(cache_path, "w", encoding="utf-8") as f:
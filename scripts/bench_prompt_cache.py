@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+提示前缀缓存基准：对同一份 Step_1（Sub-Script）连续跑几遍完整规划（ScenePlanning → 每个 scene 的 ShotPlotCreate），
+逐个请求测首 token 延迟（TTFT）、输入 token 中被 provider 缓存命中的比例和估算输入费用。
+
+对照组（baseline）在 system prompt 最前面加一个随机串，前缀每次都不同、不可能命中缓存；
+之后的 stable 遍与线上一致（system prompt 原样在前，见 base_agent.LLM_PROMPT_CACHE），
+第一遍 stable 负责把前缀写进缓存，后面几遍应当看到 cached token 上升、TTFT 与输入费用下降。
+
+请求直接走 BaseAgent 的 client 与 _request_kwargs（与线上请求完全相同的 messages / prompt_cache_key），
+流式接收以便测 TTFT；不读写 llm_cache 的回复缓存。会产生真实 API 费用。
+
+用法：
+  python scripts/bench_prompt_cache.py Results/xxx/<model_config>/Step_1_script_results.json --llm gpt4-o
+  python scripts/bench_prompt_cache.py step1.json --passes 3 --max-scenes 4 -o bench_prompt_cache.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+MOVIE_AGENT_DIR = Path(__file__).resolve().parents[1] / "movie_agent"
+if str(MOVIE_AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(MOVIE_AGENT_DIR))
+
+from base_agent import BaseAgent, _endpoint  # noqa: E402
+from llm_schema import LLMOutputError, SchemaError, repair_json, validate_scene_annotation  # noqa: E402
+import metering  # noqa: E402
+from system_prompts import scene_query, shot_query, sys_prompts  # noqa: E402
+
+
+def _stream(agent, query):
+    """流式请求一次，返回 (回复文本, 记录)；记录含 ttft_s / total_s 与 usage。"""
+    kwargs = agent._request_kwargs(agent._input_messages(query), json_format=agent.llm_type == "gpt4-o")
+    start = time.perf_counter()
+    ttft, parts, usage = None, [], None
+    completion = agent.client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    for chunk in completion:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(chunk.choices[0].delta.content)
+    total = time.perf_counter() - start
+    details = getattr(usage, "prompt_tokens_details", None)
+    row = {
+        "stage": agent.stage,
+        "ttft_s": ttft if ttft is not None else total,
+        "total_s": total,
+        "input_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        "output_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+    return "".join(parts), row
+
+
+def _agents(llm, nonce=""):
+    prefix = f"[run {nonce}]\n" if nonce else ""
+    return (
+        BaseAgent(llm, system_prompt=prefix + sys_prompts["ScenePlanningCoT-sys"], use_history=False, temp=0.7, stage="sceneplanning"),
+        BaseAgent(llm, system_prompt=prefix + sys_prompts["ShotPlotCreateCoT-sys"], use_history=False, temp=0.7, stage="shotplotcreate"),
+    )
+
+
+def planning_pass(step1: dict, llm: str, nonce: str = "", max_scenes: int = None) -> list[dict]:
+    """一遍完整规划；解析失败的 scene 跳过（基准只关心请求本身）。"""
+    scene_agent, shot_agent = _agents(llm, nonce)
+    relationships = step1["Relationships"]
+    rows, scenes = [], []
+    for name, sub_script in step1["Sub-Script"].items():
+        text, row = _stream(scene_agent, scene_query(sub_script["Plot"], relationships))
+        rows.append(row)
+        try:
+            annotation = repair_json(text)
+            validate_scene_annotation(annotation)
+        except (LLMOutputError, SchemaError) as e:
+            print(f"  [{name}] scene 回复不可用，跳过其镜头规划: {e}")
+            continue
+        scenes.extend(annotation["Scene"].values())
+    for scene in scenes[:max_scenes]:
+        _, row = _stream(shot_agent, shot_query(scene))
+        rows.append(row)
+    return rows
+
+
+def summarize(label: str, rows: list[dict], provider: str, model: str) -> dict:
+    totals = {k: sum(r[k] for r in rows) for k in ("input_tokens", "cached_tokens", "output_tokens")}
+    input_cost = metering.estimate_cost(provider, model, {**totals, "output_tokens": 0, "units": 0})
+    return {
+        "pass": label,
+        "requests": len(rows),
+        "ttft_median_s": round(statistics.median(r["ttft_s"] for r in rows), 3) if rows else 0,
+        "ttft_mean_s": round(statistics.mean(r["ttft_s"] for r in rows), 3) if rows else 0,
+        **totals,
+        "cached_share": round(totals["cached_tokens"] / max(totals["input_tokens"], 1), 3),
+        "input_cost_usd": round(input_cost, 6),
+        "rows": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量提示前缀缓存对规划阶段 TTFT 与输入费用的影响")
+    parser.add_argument("step1_json", type=str, help="Step_1_script_results.json（含 Relationships 与 Sub-Script）")
+    parser.add_argument("--llm", type=str, default="gpt4-o", help="gpt4-o / deepseek-v3 / deepseek-r1")
+    parser.add_argument("--passes", type=int, default=2, help="stable 遍数（第一遍预热缓存），默认 2")
+    parser.add_argument("--max-scenes", type=int, default=None, help="每遍最多规划多少个 scene 的镜头（控制费用）")
+    parser.add_argument("--no-baseline", action="store_true", help="不跑随机前缀的对照组")
+    parser.add_argument("-o", "--output", type=str, default=None, help="可选：逐请求明细与汇总写入此 JSON")
+    args = parser.parse_args()
+
+    step1 = json.loads(Path(args.step1_json).read_text(encoding="utf-8"))
+    probe = BaseAgent(args.llm, use_history=False)
+    provider, model = _endpoint(args.llm), probe.model_name
+
+    plan = [] if args.no_baseline else [("baseline", uuid.uuid4().hex)]
+    plan += [(f"stable-{i + 1}", "") for i in range(args.passes)]
+    results = []
+    for label, nonce in plan:
+        print(f"[bench] {label} …")
+        results.append(summarize(label, planning_pass(step1, args.llm, nonce, args.max_scenes), provider, model))
+
+    ref = results[0]
+    print(f"\n{'pass':<12}{'reqs':>6}{'TTFT p50':>10}{'TTFT avg':>10}{'input':>9}{'cached':>9}{'share':>7}{'in $':>11}{'vs first':>10}")
+    for r in results:
+        saving = 1 - r["input_cost_usd"] / ref["input_cost_usd"] if ref["input_cost_usd"] else 0.0
+        print(f"{r['pass']:<12}{r['requests']:>6}{r['ttft_median_s']:>9.3f}s{r['ttft_mean_s']:>9.3f}s"
+              f"{r['input_tokens']:>9}{r['cached_tokens']:>9}{r['cached_share']:>7.0%}"
+              f"{r['input_cost_usd']:>11.5f}{saving:>10.0%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"llm": args.llm, "model": model, "passes": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n明细已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
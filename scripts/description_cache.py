@@ -0,0 +1,74 @@
+"""
+图片描述的持久化缓存（按内容寻址）。
+
+key = sha256(发给 vision 的图片字节) + prompt 模板 + model，值为描述文本，每条一个小 JSON 文件。
+prompt 用未填充事件标题的模板：用户重试 job 或只改了标题时，同样的照片直接命中缓存，不再调用 vision。
+目录总大小超过上限时按最近使用时间（文件 mtime，命中时刷新）淘汰最旧的条目（disk_cache.DiskCache）。
+
+Environment variables (optional):
+  VISION_CACHE             default 1      设为 0 关闭缓存
+  VISION_CACHE_DIR         default ~/.cache/movieagent/vision_descriptions
+  VISION_CACHE_MAX_BYTES   default 64 MB
+"""
+import hashlib
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+from image_normalize import vision_input
+
+# 与 llm_cache 共用的磁盘存储在 movie_agent 下
+_MOVIE_AGENT_DIR = str(Path(__file__).resolve().parents[1] / "movie_agent")
+if _MOVIE_AGENT_DIR not in sys.path:
+    sys.path.insert(0, _MOVIE_AGENT_DIR)
+from disk_cache import DiskCache  # noqa: E402
+
+VISION_CACHE = os.environ.get("VISION_CACHE", "1") != "0"
+VISION_CACHE_DIR = os.environ.get(
+    "VISION_CACHE_DIR",
+    str(Path.home() / ".cache" / "movieagent" / "vision_descriptions"),
+)
+VISION_CACHE_MAX_BYTES = int(os.environ.get("VISION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_stats_lock = threading.Lock()
+
+
+def record(stats: Optional[dict], hits: int = 0, misses: int = 0):
+    """把命中/未命中次数累加到调用方传入的 stats 字典（可为 None）。"""
+    if stats is None:
+        return
+    with _stats_lock:
+        stats["hits"] = stats.get("hits", 0) + hits
+        stats["misses"] = stats.get("misses", 0) + misses
+
+
+class DescriptionCache(DiskCache):
+    """图片描述缓存：存储与淘汰见 disk_cache.DiskCache（movie_agent 下），文件里的字段名为 description。"""
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(root, max_bytes, field="description")
+
+    def key(self, image_path: str, prompt: str, model: str) -> str:
+        h = hashlib.sha256()
+        with open(vision_input(image_path), "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        h.update(b"\0" + prompt.encode("utf-8") + b"\0" + model.encode("utf-8"))
+        return h.hexdigest()
+
+
+_cache: Optional[DescriptionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[DescriptionCache]:
+    """进程内共享的缓存实例；VISION_CACHE=0 时返回 None。"""
+    global _cache
+    if not VISION_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DescriptionCache(VISION_CACHE_DIR, VISION_CACHE_MAX_BYTES)
+        return _cache
@@ -24,11 +24,12 @@ def generate_director_script_for_event(
     """
     根据事件标题 + 图片描述列表，用 LLM 生成该事件的编剧导演稿（一段文字）。
     """
-    repo_root = Path(__file__).resolve().parents[1]
-    if str(repo_root) not in sys.path:
-        sys.path.insert(0, str(repo_root))
+    # 与 movie_agent/run.py 用同一个模块名 import，进程内共享 base_agent 的 client 缓存
+    movie_agent_dir = Path(__file__).resolve().parents[1] / "movie_agent"
+    if str(movie_agent_dir) not in sys.path:
+        sys.path.insert(0, str(movie_agent_dir))
 
-    from movie_agent.base_agent import BaseAgent
+    from base_agent import BaseAgent
 
     parts = [f"事件标题：{event_title}"]
     if image_descriptions:
@@ -40,7 +41,7 @@ def generate_director_script_for_event(
     parts.append(f"出镜角色（用这些名字写动作与运镜）：{', '.join(characters)}")
     user_content = "\n".join(parts)
 
-    agent = BaseAgent(llm, system_prompt=DIRECTOR_SCRIPT_SYSTEM, use_history=False, temp=0.6)
+    agent = BaseAgent(llm, system_prompt=DIRECTOR_SCRIPT_SYSTEM, use_history=False, temp=0.6, stage="director")
     out = agent(user_content, parse=False)
     return (out or "").strip()
 
@@ -0,0 +1,59 @@
+"""
+视觉输入预处理：修正 EXIF 方向、按最长边缩小、重新编码为 JPEG。
+派生图与原图放在同一目录（foo.JPG -> foo.vision.jpg），所有视觉调用都读派生图，
+省掉 GPT-4o 用不到的像素带来的带宽、base64 膨胀和 vision token。
+
+API 在照片上传时就在线程池里生成派生图；CLI 场景下第一次看图时按需生成。
+
+Environment variables (optional):
+  VISION_MAX_EDGE       default 1536   派生图最长边（像素）
+  VISION_JPEG_QUALITY   default 85
+"""
+import os
+import threading
+from pathlib import Path
+
+VISION_MAX_EDGE = int(os.environ.get("VISION_MAX_EDGE", "1536"))
+VISION_JPEG_QUALITY = int(os.environ.get("VISION_JPEG_QUALITY", "85"))
+
+DERIVATIVE_TAG = ".vision"
+
+
+def derivative_path(image_path) -> Path:
+    p = Path(image_path)
+    return p.with_name(f"{p.stem}{DERIVATIVE_TAG}.jpg")
+
+
+def is_derivative(image_path) -> bool:
+    return Path(image_path).stem.endswith(DERIVATIVE_TAG)
+
+
+def normalize_image(image_path, max_edge: int = None, quality: int = None) -> str:
+    """生成派生图并返回其路径；派生图已存在且不旧于原图时直接复用。"""
+    from PIL import Image, ImageOps
+
+    src = Path(image_path)
+    dst = derivative_path(src)
+    if dst.exists() and dst.stat().st_mtime >= src.stat().st_mtime:
+        return str(dst)
+    max_edge = max_edge or VISION_MAX_EDGE
+    quality = quality or VISION_JPEG_QUALITY
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        # 先写临时文件再 rename，并发生成同一张派生图时读者不会看到半个文件
+        tmp = dst.with_name(f"{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        img.save(tmp, format="JPEG", quality=quality, optimize=True)
+    os.replace(tmp, dst)
+    return str(dst)
+
+
+def vision_input(image_path) -> str:
+    """视觉调用应读取的文件：派生图；PIL 不可用或无法解码时回退到原图。"""
+    if is_derivative(image_path):
+        return str(image_path)
+    try:
+        return normalize_image(image_path)
+    except Exception as e:
+        print(f"[image_normalize] 无法生成派生图，使用原图 {image_path}: {e}")
+        return str(image_path)
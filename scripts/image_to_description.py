@@ -1,18 +1,84 @@
 """
 用视觉模型（Vision API）看一张或多张图，生成用于编剧/导演稿的文本描述。
 支持 OpenAI GPT-4o 多图输入；单图时也可用。
+发送的是 image_normalize 生成的缩小派生图（修正方向、最长边 VISION_MAX_EDGE），不是原图。
+多张图并发调用（整个进程最多 VISION_CONCURRENCY 个请求同时在途，各 event 共用），每张图单独重试，输出顺序与输入一致。
+
+VISION_MODE=batch 时，同一 event 的多张图打包进一次请求（按 token 预算自适应每包张数），
+模型返回 JSON 数组、每张图一条描述，prompt 和 event 标题只发一次。
+描述结果按「图片内容 + prompt 模板 + model」缓存在磁盘（description_cache.py），重试的 job 直接命中。
 """
 import base64
 import json
+import math
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from description_cache import get_cache, record
+from image_normalize import vision_input
+
+# metering / cassette 在 movie_agent 下；与 run.py 用同一个模块名 import，用量记进当前 job 的 Meter
+_MOVIE_AGENT_DIR = str(Path(__file__).resolve().parents[1] / "movie_agent")
+if _MOVIE_AGENT_DIR not in sys.path:
+    sys.path.insert(0, _MOVIE_AGENT_DIR)
+import cassette  # noqa: E402
+import metering  # noqa: E402
+
+VISION_CONCURRENCY = int(os.environ.get("VISION_CONCURRENCY", "4"))
+VISION_RETRIES = int(os.environ.get("VISION_RETRIES", "2"))
+VISION_MODE = os.environ.get("VISION_MODE", "single")  # single | batch
+VISION_BATCH_TOKEN_BUDGET = int(os.environ.get("VISION_BATCH_TOKEN_BUDGET", "6000"))
+VISION_BATCH_MAX_IMAGES = int(os.environ.get("VISION_BATCH_MAX_IMAGES", "8"))
+
+SINGLE_PROMPT_TEMPLATE = "事件标题：{event_title}\n请针对下面这张图，用一两句话描述：场景、人物在做什么、重要物品或动作。用于后续写短片分镜。"
+BATCH_PROMPT_TEMPLATE = (
+    "事件标题：{event_title}\n"
+    "下面按顺序给出 {count} 张图（每张图前标有「图N」）。请对每张图分别用一两句话描述："
+    "场景、人物在做什么、重要物品或动作。用于后续写短片分镜。\n"
+    '只输出 JSON：{{"descriptions": ["图1的描述", "图2的描述", ...]}}，'
+    "数组长度必须等于 {count}，顺序与图片顺序一致。"
+)
+
+# 进程内共享的 OpenAI client（API 里每个 job 都会调用，避免重复创建）
+_client = None
+_client_lock = threading.Lock()
+# 进程内所有 vision 请求共用的名额：各 event（及 API 里各 job）各自开线程池，
+# 同时在途的请求总数仍不超过 VISION_CONCURRENCY
+_provider_slots = threading.BoundedSemaphore(max(1, VISION_CONCURRENCY))
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    from openai import OpenAI
+                except ImportError:
+                    raise ImportError("需要 openai: pip install openai")
+                _client = OpenAI(api_key=cassette.api_key(os.getenv("OPENAI_API_KEY")))
+    return _client
+
+
+def _complete(client, model: str, **kwargs) -> str:
+    """一次 vision 请求，返回回复文本；顺带记录耗时与 token 用量，可被 cassette 录制 / 回放。"""
+    def _live():
+        resp = client.chat.completions.create(model=model, **kwargs)
+        metering.record_usage("vision", "openai", model, getattr(resp, "usage", None))
+        return resp.choices[0].message.content or ""
+
+    with _provider_slots, metering.timed("vision", "openai", model):
+        return cassette.through("vision", {"model": model, **kwargs}, _live)
+
 
 def _image_to_base64_url(image_path: str) -> str:
-    path = Path(image_path)
-    if not path.exists():
+    if not Path(image_path).exists():
         raise FileNotFoundError(f"Image not found: {image_path}")
+    path = Path(vision_input(image_path))
     with open(path, "rb") as f:
         b64 = base64.standard_b64encode(f.read()).decode("utf-8")
     suffix = path.suffix.lower()
@@ -20,46 +86,196 @@ def _image_to_base64_url(image_path: str) -> str:
     return f"data:{mime};base64,{b64}"
 
 
+def _describe_one(client, image_path: str, prompt: str, model: str, retries: int) -> str:
+    """单张图调用 vision；失败按 1s / 2s / 4s… 退避重试，只重试这一张。"""
+    url = _image_to_base64_url(image_path)
+    content = [
+        {"type": "text", "text": prompt},
+        {"type": "image_url", "image_url": {"url": url}},
+    ]
+    for attempt in range(retries + 1):
+        try:
+            text = _complete(
+                client,
+                model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=300,
+            )
+            return text.strip()
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            wait = 2 ** attempt
+            print(f"[vision重试 {attempt+1}/{retries}] {Path(image_path).name}: {e}，{wait}s 后重试…")
+            time.sleep(wait)
+
+
+def _with_cache(image_paths: list, prompt: str, model: str, describe_missing, cache_stats: dict = None) -> list[str]:
+    """
+    先查描述缓存，只把未命中的图交给 describe_missing(paths) -> descriptions，结果回填缓存。
+    prompt 为参与缓存 key 的 prompt：带事件标题时传未填充的模板，改标题不会让整批照片重新描述。
+    """
+    cache = get_cache()
+    if cache is None:
+        return describe_missing(image_paths)
+    keys = [cache.key(ip, prompt, model) for ip in image_paths]
+    out = [cache.get(k) for k in keys]
+    missing = [i for i, d in enumerate(out) if d is None]
+    record(cache_stats, hits=len(out) - len(missing), misses=len(missing))
+    if missing:
+        for i, d in zip(missing, describe_missing([image_paths[i] for i in missing])):
+            out[i] = d
+            if d:
+                cache.put(keys[i], d)
+    return out
+
+
 def describe_images_with_vision(
     image_paths: list,
     prompt: str = "用一两句话描述这张图：场景、人物在做什么、重要物品或动作。用于后续写短片分镜。",
     model: str = "gpt-4o",
+    max_workers: int = None,
+    retries: int = None,
+    cache_stats: dict = None,
+    cache_prompt: str = None,
 ) -> list[str]:
     """
     对每张图调用 vision API，返回描述列表（与 image_paths 一一对应）。
+    max_workers 为同时在途的请求数（默认 VISION_CONCURRENCY），1 即逐张串行。
+    cache_stats 若传入字典，会累加描述缓存的 hits / misses。
+    cache_prompt 为缓存 key 用的 prompt（默认即 prompt；prompt 由模板填充而来时传模板）。
     """
+    if not image_paths:
+        return []
+    retries = VISION_RETRIES if retries is None else retries
+
+    def _describe(paths):
+        client = _get_client()
+        workers = max(1, min(max_workers or VISION_CONCURRENCY, len(paths)))
+        if workers == 1:
+            return [_describe_one(client, ip, prompt, model, retries) for ip in paths]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision") as pool:
+            # pool.map 按输入顺序返回，总耗时取决于最慢的一张而不是所有图之和
+            describe_one = metering.bind(lambda ip: _describe_one(client, ip, prompt, model, retries))
+            return list(pool.map(describe_one, paths))
+
+    return _with_cache(image_paths, cache_prompt or prompt, model, _describe, cache_stats)
+
+
+def _estimate_image_tokens(image_path: str) -> int:
+    """按 GPT-4o high detail 计费规则估算：先缩进 2048 见方，再把短边缩到 768，每个 512 tile 170 token + 85。"""
     try:
-        from openai import OpenAI
-    except ImportError:
-        raise ImportError("需要 openai: pip install openai")
+        from PIL import Image
+        with Image.open(vision_input(image_path)) as img:
+            w, h = img.size
+    except Exception:
+        return 85 + 170 * 4
+    scale = min(1.0, 2048 / max(w, h))
+    w, h = w * scale, h * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    descriptions = []
+
+def _pack_batches(image_paths: list, token_budget: int, max_images: int) -> list[list[int]]:
+    """按顺序贪心打包：每包图片 token 估算之和不超过 token_budget，张数不超过 max_images。"""
+    batches, cur, cur_tokens = [], [], 0
     for i, ip in enumerate(image_paths):
-        url = _image_to_base64_url(ip)
-        content = [
-            {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": url}},
-        ]
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": content}],
-            max_tokens=300,
+        t = _estimate_image_tokens(ip)
+        if cur and (cur_tokens + t > token_budget or len(cur) >= max_images):
+            batches.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(i)
+        cur_tokens += t
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _describe_chunk(client, image_paths: list, event_title: str, model: str, retries: int) -> list[str]:
+    """一次请求描述多张图；返回条数不符时重试，仍不符则退回逐张描述。"""
+    content = [{"type": "text", "text": BATCH_PROMPT_TEMPLATE.format(
+        event_title=event_title or "（无标题）", count=len(image_paths))}]
+    for i, ip in enumerate(image_paths, 1):
+        content.append({"type": "text", "text": f"图{i}"})
+        content.append({"type": "image_url", "image_url": {"url": _image_to_base64_url(ip)}})
+    for attempt in range(retries + 1):
+        try:
+            text = _complete(
+                client,
+                model,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=150 * len(image_paths),
+                response_format={"type": "json_object"},
+            )
+            data = json.loads(text or "{}")
+            descs = data.get("descriptions") if isinstance(data, dict) else None
+            if not isinstance(descs, list) or len(descs) != len(image_paths):
+                raise ValueError(f"expected {len(image_paths)} descriptions, got {descs!r:.200}")
+            return [str(d).strip() for d in descs]
+        except Exception as e:
+            if attempt >= retries:
+                print(f"[vision batch] {len(image_paths)} 张图打包描述失败，改为逐张描述: {e}")
+                break
+            wait = 2 ** attempt
+            print(f"[vision batch重试 {attempt+1}/{retries}] {e}，{wait}s 后重试…")
+            time.sleep(wait)
+    prompt = SINGLE_PROMPT_TEMPLATE.format(event_title=event_title or "（无标题）")
+    return [_describe_one(client, ip, prompt, model, retries) for ip in image_paths]
+
+
+def describe_images_packed(
+    image_paths: list,
+    event_title: str = "",
+    model: str = "gpt-4o",
+    max_workers: int = None,
+    token_budget: int = None,
+    max_images: int = None,
+    cache_stats: dict = None,
+) -> list[str]:
+    """
+    batch 模式：把多张图打包进少量请求（每包张数按 token_budget 自适应），各包并发执行。
+    返回描述列表（与 image_paths 一一对应）。缓存 key 与 single 模式相同，两种模式的结果可互相命中。
+    """
+    if not image_paths:
+        return []
+
+    def _describe(paths):
+        client = _get_client()
+        batches = _pack_batches(
+            paths,
+            token_budget or VISION_BATCH_TOKEN_BUDGET,
+            max_images or VISION_BATCH_MAX_IMAGES,
         )
-        text = (resp.choices[0].message.content or "").strip()
-        descriptions.append(text)
-    return descriptions
+        chunks = [[paths[i] for i in b] for b in batches]
+        workers = max(1, min(max_workers or VISION_CONCURRENCY, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision") as pool:
+            describe_chunk = metering.bind(lambda c: _describe_chunk(client, c, event_title, model, VISION_RETRIES))
+            results = pool.map(describe_chunk, chunks)
+            return [d for chunk_descs in results for d in chunk_descs]
+
+    return _with_cache(image_paths, SINGLE_PROMPT_TEMPLATE, model, _describe, cache_stats)
 
 
 def describe_images_batch(
     image_paths: list,
     event_title: str = "",
-    prompt_template: str = "事件标题：{event_title}\n请针对下面这张图，用一两句话描述：场景、人物在做什么、重要物品或动作。用于后续写短片分镜。",
+    prompt_template: str = SINGLE_PROMPT_TEMPLATE,
     model: str = "gpt-4o",
+    max_workers: int = None,
+    mode: str = None,
+    cache_stats: dict = None,
 ) -> list[str]:
-    """对多张图逐张调用 vision，带 event 上下文。"""
+    """
+    对多张图调用 vision，带 event 上下文。
+    mode="single"（默认，VISION_MODE）每张图一个请求并发执行；mode="batch" 多图打包成少量请求。
+    """
+    if (mode or VISION_MODE) == "batch":
+        return describe_images_packed(image_paths, event_title=event_title, model=model,
+                                      max_workers=max_workers, cache_stats=cache_stats)
     prompt = prompt_template.format(event_title=event_title or "（无标题）").strip()
-    return describe_images_with_vision(image_paths, prompt=prompt, model=model)
+    return describe_images_with_vision(image_paths, prompt=prompt, model=model, max_workers=max_workers,
+                                       cache_stats=cache_stats, cache_prompt=prompt_template.strip())
 
 
 if __name__ == "__main__":
@@ -68,8 +284,11 @@ if __name__ == "__main__":
     p.add_argument("image_paths", nargs="+", help="图片路径")
     p.add_argument("--event-title", default="", help="事件标题，会放进 prompt")
     p.add_argument("--model", default="gpt-4o")
+    p.add_argument("--concurrency", type=int, default=None, help="同时在途的 vision 请求数（默认 VISION_CONCURRENCY）")
+    p.add_argument("--mode", choices=("single", "batch"), default=None, help="single：每图一个请求；batch：多图打包（默认 VISION_MODE）")
     args = p.parse_args()
-    descs = describe_images_batch(args.image_paths, event_title=args.event_title, model=args.model)
+    descs = describe_images_batch(args.image_paths, event_title=args.event_title, model=args.model,
+                                  max_workers=args.concurrency, mode=args.mode)
     for path, d in zip(args.image_paths, descs):
         print(path, "->", d)
     sys.exit(0)
@@ -0,0 +1,88 @@
+"""
+近重复照片折叠：用户常连拍好几张几乎一样的照片，逐张描述既浪费 vision 调用又让导演稿 prompt 变长。
+对每个 event 的照片计算感知哈希（pHash），把汉明距离不超过阈值的照片聚成一簇，
+只把每簇的代表图（簇内第一张）送去 vision。
+
+pHash 全程 NumPy 向量化：32x32 灰度缩略图堆成 (N, 32, 32)，用 DCT 矩阵一次乘出所有图的 2D DCT，
+取左上 8x8 低频系数与中位数比较得到 64 bit；两两汉明距离也是一次广播运算。
+
+缺少 numpy / Pillow 或图片无法解码时不折叠（每张图自成一簇）。
+
+Environment variables (optional):
+  PHOTO_DEDUP             default 1    设为 0 关闭
+  PHOTO_DEDUP_THRESHOLD   default 10   64 bit 中允许不同的位数
+"""
+import os
+
+from image_normalize import vision_input
+
+PHOTO_DEDUP = os.environ.get("PHOTO_DEDUP", "1") != "0"
+PHOTO_DEDUP_THRESHOLD = int(os.environ.get("PHOTO_DEDUP_THRESHOLD", "10"))
+
+_HASH_SIZE = 8
+_THUMB_SIZE = 32
+
+
+def _dct_matrix(n: int):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+
+def _thumbnail(image_path: str):
+    from PIL import Image
+    import numpy as np
+    with Image.open(vision_input(image_path)) as img:
+        img.draft("L", (_THUMB_SIZE * 4, _THUMB_SIZE * 4))  # JPEG 解码时直接降采样
+        small = img.convert("L").resize((_THUMB_SIZE, _THUMB_SIZE), Image.Resampling.LANCZOS)
+        return np.asarray(small, dtype=np.float32)
+
+
+def phash_many(image_paths: list):
+    """返回 (N, 64) 的 bool 数组，每行一张图的 pHash。"""
+    import numpy as np
+    thumbs = np.stack([_thumbnail(p) for p in image_paths])   # (N, 32, 32)
+    d = _dct_matrix(_THUMB_SIZE).astype(np.float32)
+    coeffs = d @ thumbs @ d.T                                 # 批量 2D DCT
+    low = coeffs[:, :_HASH_SIZE, :_HASH_SIZE].reshape(len(image_paths), -1)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)     # 不计直流分量
+    return low > median
+
+
+def cluster_hashes(hashes, threshold: int) -> list[list[int]]:
+    """
+    按输入顺序做 leader 聚类：每张图归入第一个与其代表图距离 ≤ threshold 的簇，否则自成新簇。
+    不做传递合并，避免一串渐变的照片被链成一簇。
+    """
+    dist = (hashes[:, None, :] != hashes[None, :, :]).sum(axis=-1)  # (N, N) 汉明距离
+    clusters: list[list[int]] = []
+    for i in range(len(hashes)):
+        for members in clusters:
+            if dist[members[0], i] <= threshold:
+                members.append(i)
+                break
+        else:
+            clusters.append([i])
+    return clusters
+
+
+def collapse_near_duplicates(image_paths: list, threshold: int = None) -> list[dict]:
+    """
+    返回簇列表 [{"representative": path, "members": [path, ...]}, ...]，按代表图在输入中的顺序排列。
+    """
+    singletons = [{"representative": p, "members": [p]} for p in image_paths]
+    if len(image_paths) < 2:
+        return singletons
+    try:
+        hashes = phash_many(image_paths)
+    except Exception as e:
+        print(f"[photo_dedup] 跳过近重复折叠: {e}")
+        return singletons
+    threshold = PHOTO_DEDUP_THRESHOLD if threshold is None else threshold
+    return [
+        {"representative": image_paths[c[0]], "members": [image_paths[i] for i in c]}
+        for c in cluster_hashes(hashes, threshold)
+    ]
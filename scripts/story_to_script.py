@@ -5,9 +5,10 @@ from __future__ import annotations
 将「故事标题 + 多个 events（每个含 title + 图片）」转为 MovieAgent 可用的 script_synopsis.json。
 
 流程：
-1. 对每个 event：用视觉模型看该 event 的每张图 + event title，生成图片描述。
+1. 对每个 event：先把连拍等近重复照片折叠成簇（photo_dedup.py），再用视觉模型看每簇代表图 + event title，生成图片描述。
 2. 对每个 event：用 LLM 根据「event title + 图片描述」生成该 event 的**编剧导演稿**（角色动作、怎么动、运镜等）。
 3. 把所有 event 的导演稿按顺序拼成整部剧本（MovieScript），并写入 script_synopsis.json。
+各 event 相互独立，并发执行（STORY_EVENT_CONCURRENCY）：某个 event 的图片描述一完成就开始写它的导演稿。
 
 输入 JSON 格式示例（如 story_input.json）：
 {
@@ -24,27 +25,40 @@ from __future__ import annotations
 用法：
   python scripts/story_to_script.py story_input.json -o dataset/布布一二_PittsburghTrip/script_synopsis.json --llm gpt4-o
   python scripts/story_to_script.py story_input.json --no-images   # 不使用图片，仅用 title/caption
+
+作为库调用（API 在进程内直接调用，复用已建好的 client）：
+  from story_to_script import generate_script_synopsis
+  generate_script_synopsis(data, output_path, llm="gpt4-o", progress_callback=cb)
 """
 
 import argparse
+import contextvars
 import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from image_normalize import is_derivative
+from photo_dedup import PHOTO_DEDUP, collapse_near_duplicates
+
+# 同时处理的 event 数（vision 请求另受进程级的 VISION_CONCURRENCY 总名额限制，不随 event 数翻倍）
+STORY_EVENT_CONCURRENCY = int(os.environ.get("STORY_EVENT_CONCURRENCY", "4"))
+
 
 def _scripts_dir() -> Path:
     return Path(__file__).resolve().parent
 
 
-def _describe_event_images(image_paths: list, event_title: str, vision_model: str):
-    """对单个 event 的图片做视觉描述。"""
+def _describe_event_images(image_paths: list, event_title: str, vision_model: str, cache_stats: dict = None):
+    """对单个 event 的图片做视觉描述（cache_stats 累加描述缓存命中情况）。"""
     if not image_paths:
         return []
     sd = _scripts_dir()
     if str(sd) not in sys.path:
         sys.path.insert(0, str(sd))
     from image_to_description import describe_images_batch
-    return describe_images_batch(image_paths, event_title=event_title, model=vision_model)
+    return describe_images_batch(image_paths, event_title=event_title, model=vision_model, cache_stats=cache_stats)
 
 
 def _director_script_for_event(event_title: str, image_descriptions: list, characters: list, llm: str):
@@ -71,6 +85,51 @@ def build_simple_synopsis(story_title: str, events: list, characters: list) -> s
     return " ".join(parts)
 
 
+def _process_event(idx: int, ev: dict, characters: list, llm: str, vision_model: str, no_images: bool) -> dict:
+    """单个 event：近重复折叠 -> 图片描述 -> 导演稿。各 event 之间互不依赖。"""
+    title = ev.get("title", "").strip()
+    caption = ev.get("caption", "").strip()
+    image_paths = ev.get("image_paths") or []
+    if no_images:
+        image_paths = []
+
+    # 1) 图片描述
+    image_descriptions = []
+    photo_clusters = []
+    event_cache_stats = {"hits": 0, "misses": 0}
+    if image_paths:
+        abs_paths = []
+        cwd = Path.cwd()
+        for p in image_paths:
+            path = Path(p)
+            if not path.is_absolute():
+                path = cwd / path
+            if path.exists():
+                abs_paths.append(str(path))
+        # 近重复照片只描述每簇的代表图
+        if PHOTO_DEDUP:
+            photo_clusters = collapse_near_duplicates(abs_paths)
+            abs_paths = [c["representative"] for c in photo_clusters]
+        image_descriptions = _describe_event_images(abs_paths, title, vision_model, event_cache_stats)
+
+    # 2) 该 event 的导演稿（含角色动作、运镜）；描述一完成就开始，不等其他 event
+    if image_descriptions or title or caption:
+        # 无图时把 caption 当“唯一描述”传给导演稿
+        if not image_descriptions and caption:
+            image_descriptions = [caption]
+        script_text = _director_script_for_event(title, image_descriptions, characters, llm=llm)
+    else:
+        script_text = f"【{title}】无描述与图片，保留为占位。"
+    return {
+        "event_index": idx + 1,
+        "event_title": title,
+        "image_descriptions": image_descriptions,
+        "director_script": script_text,
+        "vision_cache": event_cache_stats,
+        "photo_clusters": photo_clusters,
+    }
+
+
 def run_with_images_and_director_script(
     story_title: str,
     events: list,
@@ -78,51 +137,44 @@ def run_with_images_and_director_script(
     llm: str,
     vision_model: str,
     no_images: bool,
+    progress_callback=None,
+    cache_stats: dict = None,
+    max_workers: int = None,
 ) -> tuple[str, list[dict]]:
     """
     对每个 event：若有多图则先做图片描述，再生成导演稿；否则仅用 title/caption 生成导演稿。
+    各 event 并发处理（最多 max_workers 个，默认 STORY_EVENT_CONCURRENCY），结果仍按 event 顺序返回。
+    progress_callback(done, total, event_result) 在每个 event 完成后调用（可选，按完成顺序）。
+    cache_stats 若传入字典，会累加整个故事的图片描述缓存 hits / misses。
     返回 (完整 MovieScript 文本, 每个 event 的详情列表)。
     """
-    event_results = []
-    director_parts = []
+    total = len(events)
+    workers = max(1, min(max_workers or STORY_EVENT_CONCURRENCY, total or 1))
+    args = (characters, llm, vision_model, no_images)
 
-    for idx, ev in enumerate(events):
-        title = ev.get("title", "").strip()
-        caption = ev.get("caption", "").strip()
-        image_paths = ev.get("image_paths") or []
-        if no_images:
-            image_paths = []
-
-        # 1) 图片描述
-        image_descriptions = []
-        if image_paths:
-            abs_paths = []
-            cwd = Path.cwd()
-            for p in image_paths:
-                path = Path(p)
-                if not path.is_absolute():
-                    path = cwd / path
-                if path.exists():
-                    abs_paths.append(str(path))
-            image_descriptions = _describe_event_images(abs_paths, title, vision_model)
-
-        # 2) 该 event 的导演稿（含角色动作、运镜）
-        if image_descriptions or title or caption:
-            # 无图时把 caption 当“唯一描述”传给导演稿
-            if not image_descriptions and caption:
-                image_descriptions = [caption]
-            script_text = _director_script_for_event(title, image_descriptions, characters, llm=llm)
-        else:
-            script_text = f"【{title}】无描述与图片，保留为占位。"
-        director_parts.append(script_text)
-        event_results.append({
-            "event_index": idx + 1,
-            "event_title": title,
-            "image_descriptions": image_descriptions,
-            "director_script": script_text,
-        })
+    event_results = []
+    if workers == 1:
+        for idx, ev in enumerate(events):
+            event_results.append(_process_event(idx, ev, *args))
+            if progress_callback:
+                progress_callback(idx + 1, total, event_results[-1])
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="event") as pool:
+            # 每个 event 在提交线程的 context 拷贝里运行，用量仍记进当前 job 的 Meter（movie_agent/metering.py）
+            ctx = contextvars.copy_context()
+            futures = [pool.submit(ctx.copy().run, _process_event, idx, ev, *args) for idx, ev in enumerate(events)]
+            for done, fut in enumerate(as_completed(futures), 1):
+                if progress_callback:
+                    progress_callback(done, total, fut.result())
+            event_results = [f.result() for f in futures]
+
+    if cache_stats is not None:
+        for r in event_results:
+            for k, v in r["vision_cache"].items():
+                cache_stats[k] = cache_stats.get(k, 0) + v
 
     # 3) 整部剧本：按顺序拼接各 event 的导演稿，并加故事标题
+    director_parts = [r["director_script"] for r in event_results]
     full_script = f"{story_title}\n\n" + "\n\n".join(director_parts)
     return full_script, event_results
 
@@ -153,7 +205,10 @@ def load_story_input(input_path: str) -> tuple[Path, dict]:
                     image_paths = []
                     for ext in ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG"):
                         image_paths.extend(folder.glob(ext))
-                    ev["image_paths"] = [str(p.resolve()) for p in sorted(set(image_paths))]
+                    # 跳过 image_normalize 生成的 *.vision.jpg 派生图
+                    ev["image_paths"] = [
+                        str(p.resolve()) for p in sorted(set(image_paths)) if not is_derivative(p)
+                    ]
                     ev["_scan_dir"] = str(folder.resolve())
                 else:
                     ev["image_paths"] = []
@@ -171,41 +226,39 @@ def load_story_input(input_path: str) -> tuple[Path, dict]:
         return path.parent, data
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Story + Events（含图片）-> 编剧导演稿 -> script_synopsis.json")
-    parser.add_argument("input_json", type=str, help="输入：story_config.json 路径，或「我的故事」目录（内含 story_config.json 和 events_photos/）")
-    parser.add_argument("-o", "--output", type=str, default=None, help="输出 script_synopsis.json 路径")
-    parser.add_argument("--llm", type=str, default="gpt4-o", help="用于生成导演稿的 LLM，如 gpt4-o / deepseek-v3")
-    parser.add_argument("--vision-model", type=str, default="gpt-4o", help="用于看图的视觉模型，如 gpt-4o")
-    parser.add_argument("--no-images", action="store_true", help="不使用图片，仅用每个 event 的 title 和 caption 生成导演稿")
-    parser.add_argument("--save-events", type=str, default=None, help="可选：把每个 event 的导演稿与图片描述保存到此 JSON 文件")
-    args = parser.parse_args()
-
-    config_dir, data = load_story_input(args.input_json)
-
+def generate_script_synopsis(
+    data: dict,
+    output_path,
+    llm: str = "gpt4-o",
+    vision_model: str = "gpt-4o",
+    no_images: bool = False,
+    save_events=None,
+    progress_callback=None,
+    cache_stats: dict = None,
+    max_workers: int = None,
+) -> tuple[dict, list[dict]]:
+    """
+    库入口：story_config 数据 -> script_synopsis.json（以及可选的 events 详情 JSON）。
+    data 即 story_config（story_title / characters / events）。
+    cache_stats 若传入字典，会累加图片描述缓存的 hits / misses。
+    返回 (script_synopsis 字典, 每个 event 的详情列表)；出错时直接抛异常，由调用方处理。
+    """
     story_title = data.get("story_title", "未命名故事")
     characters = data.get("characters", ["布布", "一二"])
     events = data.get("events", [])
 
-    for i, ev in enumerate(events):
-        paths = ev.get("image_paths") or []
-        n = len(paths)
-        if n:
-            print(f"Event {i+1}「{ev.get('title', '')[:20]}…」: 使用 {n} 张图片生成描述并参与导演稿。")
-        else:
-            print(f"Event {i+1}「{ev.get('title', '')[:20]}…」: 未找到图片，仅用标题/caption 生成。")
-            if ev.get("_scan_dir"):
-                print(f"  （已扫描目录: {ev['_scan_dir']}）")
-
     if not events:
         synopsis = build_simple_synopsis(story_title, [], characters)
         event_results = []
     else:
         synopsis, event_results = run_with_images_and_director_script(
             story_title, events, characters,
-            llm=args.llm,
-            vision_model=args.vision_model,
-            no_images=args.no_images,
+            llm=llm,
+            vision_model=vision_model,
+            no_images=no_images,
+            progress_callback=progress_callback,
+            cache_stats=cache_stats,
+            max_workers=max_workers,
         )
 
     result = {
@@ -213,20 +266,54 @@ def main():
         "Character": characters,
     }
 
-    out_path = args.output or (config_dir.parent / "script_synopsis.json")
-    out_path = Path(out_path)
+    out_path = Path(output_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
     print("Wrote:", out_path)
 
-    if args.save_events and event_results:
-        events_path = Path(args.save_events)
+    if save_events and event_results:
+        events_path = Path(save_events)
         events_path.parent.mkdir(parents=True, exist_ok=True)
         with open(events_path, "w", encoding="utf-8") as f:
             json.dump({"story_title": story_title, "events": event_results}, f, ensure_ascii=False, indent=2)
         print("Wrote events:", events_path)
 
+    return result, event_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Story + Events（含图片）-> 编剧导演稿 -> script_synopsis.json")
+    parser.add_argument("input_json", type=str, help="输入：story_config.json 路径，或「我的故事」目录（内含 story_config.json 和 events_photos/）")
+    parser.add_argument("-o", "--output", type=str, default=None, help="输出 script_synopsis.json 路径")
+    parser.add_argument("--llm", type=str, default="gpt4-o", help="用于生成导演稿的 LLM，如 gpt4-o / deepseek-v3")
+    parser.add_argument("--vision-model", type=str, default="gpt-4o", help="用于看图的视觉模型，如 gpt-4o")
+    parser.add_argument("--no-images", action="store_true", help="不使用图片，仅用每个 event 的 title 和 caption 生成导演稿")
+    parser.add_argument("--save-events", type=str, default=None, help="可选：把每个 event 的导演稿与图片描述保存到此 JSON 文件")
+    parser.add_argument("--event-concurrency", type=int, default=None, help="同时处理的 event 数（默认 STORY_EVENT_CONCURRENCY）")
+    args = parser.parse_args()
+
+    config_dir, data = load_story_input(args.input_json)
+
+    for i, ev in enumerate(data.get("events", [])):
+        paths = ev.get("image_paths") or []
+        n = len(paths)
+        if n:
+            print(f"Event {i+1}「{ev.get('title', '')[:20]}…」: 使用 {n} 张图片生成描述并参与导演稿。")
+        else:
+            print(f"Event {i+1}「{ev.get('title', '')[:20]}…」: 未找到图片，仅用标题/caption 生成。")
+            if ev.get("_scan_dir"):
+                print(f"  （已扫描目录: {ev['_scan_dir']}）")
+
+    generate_script_synopsis(
+        data,
+        args.output or (config_dir.parent / "script_synopsis.json"),
+        llm=args.llm,
+        vision_model=args.vision_model,
+        no_images=args.no_images,
+        save_events=args.save_events,
+        max_workers=args.event_concurrency,
+    )
     return 0
 
 
@@ -0,0 +1,16 @@
+"""
+测试与运行时一样按顶层模块名 import：movie_agent/ 与 scripts/ 下的模块直接 import，api 按包 import。
+运行：python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+for p in (ROOT, ROOT / "movie_agent", ROOT / "scripts"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+# api.jobs 的后台写库线程跨测试存活：默认库指向本次测试的临时目录，不碰真实的 job 数据库
+os.environ.setdefault("JOBS_DB_PATH", str(Path(tempfile.mkdtemp(prefix="movieagent-tests-")) / "jobs.db"))
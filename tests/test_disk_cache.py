@@ -0,0 +1,47 @@
+"""disk_cache.DiskCache：覆盖写入时的字节计数与按 mtime 的 LRU 淘汰。"""
+import os
+
+from disk_cache import DiskCache
+
+
+def _key(i):
+    return f"{i:064x}"
+
+
+def _disk_bytes(cache):
+    return sum(e.stat().st_size for e in cache.root.glob("*/*.json"))
+
+
+def test_overwrite_counts_only_the_delta(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10 ** 6)
+    cache.put(_key(1), "x" * 100)
+    cache.put(_key(2), "y" * 10)
+    for size in (100, 300, 50, 50, 50):
+        cache.put(_key(1), "x" * size)
+    assert cache._approx_bytes == _disk_bytes(cache)
+    assert cache.get(_key(1)) == "x" * 50
+    cache.delete(_key(2))
+    assert cache._approx_bytes == _disk_bytes(cache)
+
+
+def test_rewrites_do_not_trigger_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for i in range(5):
+        cache.put(_key(i), "v" * 100)
+    for _ in range(50):
+        cache.put(_key(0), "v" * 100)
+    assert all(cache.get(_key(i)) == "v" * 100 for i in range(5))
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10 ** 6)
+    for i in range(6):
+        cache.put(_key(i), "v" * 100)
+        os.utime(cache._path(_key(i)), (1000 + i, 1000 + i))
+    entry = cache._path(_key(0)).stat().st_size
+    assert cache.get(_key(0)) is not None  # 命中刷新 mtime：0 变成最近使用
+    cache.max_bytes = entry * 5             # 目标 90% -> 只能留 4 条
+    cache.put(_key(6), "v" * 100)
+    kept = [i for i in range(7) if cache.get(_key(i)) is not None]
+    assert kept == [0, 4, 5, 6]
+    assert cache._approx_bytes == _disk_bytes(cache)
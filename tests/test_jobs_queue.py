@@ -0,0 +1,208 @@
+"""api/jobs.py 的 SQLite 队列（enqueue / claim / queue_position）与 scheduler 的排队上限。每个测试用一个临时数据库。"""
+import threading
+
+import pytest
+
+from api import jobs, scheduler
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(jobs, "_local", threading.local())
+    monkeypatch.setattr(jobs, "_schema_ready", False)
+    monkeypatch.setattr(jobs, "_pending", {})
+    return tmp_path / "jobs.db"
+
+
+def _enqueue(job_id, priority=0, max_queue=100, **payload):
+    jobs.create(job_id)
+    return jobs.enqueue(job_id, priority, payload or {"n": job_id}, max_queue)
+
+
+def test_priority_then_fifo(db):
+    for job_id, priority in [("a", 0), ("b", 0), ("c", 5), ("d", 0), ("e", 5)]:
+        _enqueue(job_id, priority)
+    order = []
+    while (claimed := jobs.claim(max_running=100)) is not None:
+        order.append(claimed[0])
+    assert order == ["c", "e", "a", "b", "d"]
+
+
+def test_claim_returns_payload_and_marks_running(db):
+    _enqueue("a", story_title="t", event_titles=["x"])
+    job_id, payload = jobs.claim(max_running=1)
+    assert (job_id, payload) == ("a", {"story_title": "t", "event_titles": ["x"]})
+    row = jobs.get("a")
+    assert row["status"] == "running" and row["queue_position"] is None
+    assert jobs.queue_stats() == {"queued": 0, "running": 1}
+
+
+def test_claim_respects_global_running_limit(db):
+    for job_id in "abc":
+        _enqueue(job_id)
+    assert jobs.claim(max_running=2)[0] == "a"
+    assert jobs.claim(max_running=2)[0] == "b"
+    assert jobs.claim(max_running=2) is None
+    jobs.update("a", status="done")
+    assert jobs.claim(max_running=2)[0] == "c"
+
+
+def test_unsubmitted_rows_are_not_claimed(db):
+    jobs.create("uploading")
+    assert jobs.claim(max_running=10) is None
+    assert jobs.get("uploading")["queue_position"] is None
+
+
+def test_concurrent_claims_never_share_a_job(db):
+    n = 60
+    for i in range(n):
+        _enqueue(f"j{i:03d}")
+    claimed, lock = [], threading.Lock()
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        while (c := jobs.claim(max_running=n)) is not None:
+            with lock:
+                claimed.append(c[0])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == [f"j{i:03d}" for i in range(n)]
+
+
+def test_queue_position_after_claims(db):
+    for job_id, priority in [("a", 0), ("b", 0), ("c", 1), ("d", 0)]:
+        _enqueue(job_id, priority)
+    assert [jobs.get(j)["queue_position"] for j in "abcd"] == [2, 3, 1, 4]
+    jobs.claim(max_running=10)  # c
+    jobs.claim(max_running=10)  # a
+    assert [jobs.get(j)["queue_position"] for j in "abcd"] == [None, 1, None, 2]
+    assert jobs.queue_position("d") == 2
+    assert jobs.queue_stats() == {"queued": 2, "running": 2}
+
+
+def test_enqueue_returns_position(db):
+    assert _enqueue("a") == 1
+    assert _enqueue("b") == 2
+    assert _enqueue("c", priority=3) == 1
+
+
+def test_scheduler_submit_rejects_when_queue_full(db):
+    s = scheduler.JobScheduler(lambda **kw: None, workers=1, max_queue=2)  # 不 start：任务留在队列里
+    for job_id in "ab":
+        jobs.create(job_id)
+        s.submit(job_id, story_title=job_id)
+    assert s.is_full()
+    jobs.create("c")
+    with pytest.raises(scheduler.QueueFullError):
+        s.submit("c", story_title="c")
+    assert jobs.get("c")["queue_position"] is None
+    # 另一个进程的 scheduler 看到的是同一个队列
+    other = scheduler.JobScheduler(lambda **kw: None, workers=1, max_queue=2)
+    assert other.is_full() and other.stats()["queued"] == 2
+    jobs.claim(max_running=1)
+    assert not s.is_full()
+    assert s.submit("c", story_title="c") == 2
+
+
+def test_scheduler_runs_claimed_jobs(db):
+    ran, done = [], threading.Event()
+
+    def fn(job_id, **kwargs):
+        ran.append((job_id, kwargs))
+        jobs.update(job_id, status="done")
+        if len(ran) == 2:
+            done.set()
+
+    s = scheduler.JobScheduler(fn, workers=2, max_queue=10)
+    for job_id in "ab":
+        jobs.create(job_id)
+        s.submit(job_id, n=job_id)
+    s.start()
+    try:
+        assert done.wait(5)
+    finally:
+        s.shutdown(wait=True)
+    assert sorted(ran) == [("a", {"n": "a"}), ("b", {"n": "b"})]
+
+
+# ── liveness / batched writes（user-001）──────────────────────────────────────
+
+def _set_owner(job_id, owner, heartbeat_age=None):
+    conn = jobs._conn()
+    conn.execute("UPDATE jobs SET owner = ? WHERE job_id = ?", (owner, job_id))
+    if heartbeat_age is not None:
+        conn.execute("INSERT OR REPLACE INTO instances (instance_id, heartbeat) VALUES (?, ?)",
+                     (owner, jobs.time.time() - heartbeat_age))
+
+
+def test_reconcile_fails_running_jobs_of_a_dead_worker_and_requeues_queued_ones(db):
+    _enqueue("running")
+    jobs.claim(max_running=10)
+    _enqueue("queued")
+    jobs.create("uploading")  # 还没上传完、没有 payload
+    _enqueue("alive", priority=1)
+    assert jobs.claim(max_running=10)[0] == "alive"
+    for job_id in ("running", "queued", "uploading"):
+        _set_owner(job_id, "dead-worker", heartbeat_age=10 * jobs.INSTANCE_LEASE)
+    _set_owner("alive", "live-worker", heartbeat_age=0)
+
+    assert jobs.reconcile() == 2
+    assert jobs.get("running")["status"] == "error"
+    assert "interrupted" in jobs.get("running")["error"]
+    assert jobs.get("uploading")["status"] == "error"
+    # 已入队的 job 留在队列里，任何活着的进程都能接着跑
+    assert jobs.get("queued")["status"] == "queued"
+    assert jobs.claim(max_running=10)[0] == "queued"
+    # 心跳新鲜的进程名下的 job 不受影响
+    assert jobs.get("alive")["status"] == "running"
+
+
+def test_reconcile_after_heartbeat_expires(db, monkeypatch):
+    _enqueue("a")
+    jobs.heartbeat()
+    jobs.claim(max_running=1)
+    assert jobs.reconcile() == 0
+    monkeypatch.setattr(jobs, "INSTANCE_LEASE", 0.0)
+    jobs.time.sleep(0.01)
+    assert jobs.reconcile() == 1
+    assert jobs.get("a")["status"] == "error"
+
+
+def test_flush_persists_batched_updates(db):
+    jobs.create("a")
+    jobs.update("a", progress=10, step="one")
+    jobs.update("a", progress=20, step="two")
+    row = jobs._conn().execute("SELECT progress, step FROM jobs WHERE job_id = 'a'").fetchone()
+    assert tuple(row) == (0, "")          # 还在进程内合并
+    assert jobs.get("a")["progress"] == 20  # 本进程的 get() 已能看到
+    jobs.flush()
+    row = jobs._conn().execute("SELECT progress, step FROM jobs WHERE job_id = 'a'").fetchone()
+    assert tuple(row) == (20, "two")
+    assert jobs._pending == {}
+
+
+def test_status_update_carries_pending_progress(db):
+    jobs.create("a")
+    jobs.update("a", progress=50, step="rendering")
+    jobs.update("a", status="done")
+    row = jobs._conn().execute("SELECT status, progress, step FROM jobs WHERE job_id = 'a'").fetchone()
+    assert tuple(row) == ("done", 50, "rendering")
+
+
+def test_writer_thread_flushes_in_background(db, monkeypatch):
+    monkeypatch.setattr(jobs, "PROGRESS_FLUSH_INTERVAL", 0.01)
+    jobs.create("a")
+    jobs.update("a", progress=30, step="bg")
+    for _ in range(200):
+        row = jobs._conn().execute("SELECT progress FROM jobs WHERE job_id = 'a'").fetchone()
+        if row["progress"] == 30:
+            break
+        jobs.time.sleep(0.01)
+    assert row["progress"] == 30
+    assert jobs._writer is not None and jobs._writer.is_alive()
@@ -0,0 +1,72 @@
+"""photo_dedup：汉明距离阈值边界、代表图选择、顺序保持，以及折叠后不丢照片。"""
+import numpy as np
+import pytest
+
+import photo_dedup
+from photo_dedup import cluster_hashes, collapse_near_duplicates
+
+
+def _hash(flipped=(), base=None):
+    h = np.zeros(64, dtype=bool) if base is None else base.copy()
+    h[list(flipped)] = ~h[list(flipped)]
+    return h
+
+
+def test_threshold_boundary_is_inclusive():
+    hashes = np.stack([_hash(), _hash(range(10)), _hash(range(11))])
+    assert cluster_hashes(hashes, threshold=10) == [[0, 1], [2]]
+    assert cluster_hashes(hashes, threshold=9) == [[0], [1, 2]]  # 1 与 2 只差 1 位
+    assert cluster_hashes(hashes, threshold=11) == [[0, 1, 2]]
+
+
+def test_leader_clustering_does_not_chain():
+    # 0-1 差 6 位，1-2 差 6 位，0-2 差 12 位：2 不能经由 1 并进 0 的簇
+    hashes = np.stack([_hash(), _hash(range(6)), _hash(range(12))])
+    assert cluster_hashes(hashes, threshold=8) == [[0, 1], [2]]
+
+
+def test_representative_is_first_member_and_order_is_kept():
+    a, b = _hash(), _hash(range(32, 64))
+    hashes = np.stack([b, a, _hash([0], base=b), _hash([1], base=a), a, _hash(range(16))])
+    clusters = cluster_hashes(hashes, threshold=4)
+    assert clusters == [[0, 2], [1, 3, 4], [5]]
+    assert [c[0] for c in clusters] == sorted(c[0] for c in clusters)
+
+
+def test_collapse_keeps_every_photo(monkeypatch):
+    paths = [f"p{i}.jpg" for i in range(7)]
+    bases = [_hash(), _hash(range(20, 40)), _hash(range(40, 64))]  # 三组彼此相差 ≥ 20 位
+    table = {p: _hash(range(i // 3), base=bases[i % 3]) for i, p in enumerate(paths)}
+    monkeypatch.setattr(photo_dedup, "phash_many", lambda ps: np.stack([table[p] for p in ps]))
+    clusters = collapse_near_duplicates(paths, threshold=3)
+    assert [c["representative"] for c in clusters] == ["p0.jpg", "p1.jpg", "p2.jpg"]
+    assert sorted(m for c in clusters for m in c["members"]) == sorted(paths)
+    assert clusters[0]["members"] == ["p0.jpg", "p3.jpg", "p6.jpg"]
+
+
+def test_collapse_falls_back_to_singletons(monkeypatch):
+    def broken(paths):
+        raise OSError("cannot decode")
+    monkeypatch.setattr(photo_dedup, "phash_many", broken)
+    paths = ["a.jpg", "b.jpg"]
+    assert collapse_near_duplicates(paths) == [{"representative": p, "members": [p]} for p in paths]
+
+
+def test_phash_on_real_images(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    def texture(seed):
+        small = np.random.default_rng(seed).integers(0, 256, (16, 16)).astype(np.uint8)
+        return np.asarray(Image.fromarray(small).resize((256, 256), Image.Resampling.BICUBIC), dtype=int)
+
+    a, b = texture(1), texture(2)
+    noise = np.random.default_rng(0).integers(-8, 9, a.shape)
+    paths = []
+    # a2 = a 加轻微噪声（连拍）；c = a 的反相（内容不同）
+    for name, arr in [("a", a), ("b", b), ("a2", a + noise), ("c", 255 - a)]:
+        p = tmp_path / f"{name}.png"
+        Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).save(p)
+        paths.append(str(p))
+    hashes = photo_dedup.phash_many(paths)
+    assert hashes.shape == (4, 64) and hashes.dtype == bool
+    clusters = collapse_near_duplicates(paths, threshold=10)
+    assert [c["members"] for c in clusters] == [[paths[0], paths[2]], [paths[1]], [paths[3]]]
@@ -0,0 +1,107 @@
+"""json_stream.JSONItemStream 与 llm_schema 的修复 / 校验。"""
+import json
+import random
+
+import pytest
+
+from json_stream import JSONItemStream
+from llm_schema import LLMOutputError, SchemaError, repair_json, validate_fused, validate_shot_annotation
+
+SHOTS = {
+    "Shot": {
+        "Shot 1": {"Involving Characters": ["布布"], "Plot/Visual Description": "他说：\"走吧\" {镜头推进}"},
+        "Shot 2": {"Involving Characters": [], "Plot/Visual Description": "a \\ backslash, a ] bracket and a } brace"},
+        "Shot 3": {"Involving Characters": ["一二"], "Plot/Visual Description": "ends with escaped quote \""},
+    }
+}
+
+
+def _collect(text, chunks):
+    items = []
+    stream = JSONItemStream(lambda path, obj: items.append((path, obj)))
+    pos = 0
+    for size in chunks:
+        stream.feed(text[pos:pos + size])
+        pos += size
+    stream.feed(text[pos:])
+    return items, stream
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_items_emitted_once_in_order_across_chunk_boundaries(seed):
+    text = "```json\n" + json.dumps(SHOTS, ensure_ascii=False, indent=2) + "\n```"
+    rng = random.Random(seed)
+    chunks = [rng.randint(1, 7) for _ in range(len(text))]
+    items, stream = _collect(text, chunks)
+    assert [path for path, _ in items] == [["Shot", f"Shot {i}"] for i in (1, 2, 3)]
+    assert [obj for _, obj in items] == list(SHOTS["Shot"].values())
+    assert stream.emitted == 3
+
+
+def test_single_character_chunks_with_escapes():
+    text = json.dumps(SHOTS, ensure_ascii=False)
+    items, _ = _collect(text, [1] * len(text))
+    assert [obj for _, obj in items] == list(SHOTS["Shot"].values())
+
+
+def test_nested_fused_paths():
+    fused = {"Scene": {"Scene 1": {"Plot": "p", "Shot Annotation": SHOTS}}}
+    items, _ = _collect(json.dumps(fused, ensure_ascii=False), [5] * 1000)
+    # Scene 1 自身闭合时也会回调，排在它的镜头之后
+    assert [path for path, _ in items] == [
+        ["Scene", "Scene 1", "Shot Annotation", "Shot", "Shot 1"],
+        ["Scene", "Scene 1", "Shot Annotation", "Shot", "Shot 2"],
+        ["Scene", "Scene 1", "Shot Annotation", "Shot", "Shot 3"],
+        ["Scene", "Scene 1"],
+    ]
+
+
+def test_truncated_item_is_not_emitted():
+    text = json.dumps(SHOTS, ensure_ascii=False)
+    cut = text.index('"Shot 3"') + 20
+    items, _ = _collect(text[:cut], [3] * cut)
+    assert [path[-1] for path, _ in items] == ["Shot 1", "Shot 2"]
+
+
+def test_repair_fenced_with_surrounding_text():
+    text = "Here is the plan:\n```json\n" + json.dumps(SHOTS, ensure_ascii=False) + "\n```\nHope this helps {:"
+    assert repair_json(text) == SHOTS
+
+
+def test_repair_trailing_commas():
+    assert repair_json('{"Shot": {"Shot 1": {"a": [1, 2,],},},}') == {"Shot": {"Shot 1": {"a": [1, 2]}}}
+
+
+def test_repair_truncated():
+    assert repair_json('{"Shot": {"Shot 1": {"Plot/Visual Description": "cut of') == {
+        "Shot": {"Shot 1": {"Plot/Visual Description": "cut of"}}
+    }
+    assert repair_json('{"a": [1, 2, {"b":') == {"a": [1, 2, {"b": None}]}
+
+
+def test_repair_keeps_braces_inside_strings():
+    assert repair_json('noise {"a": "} not the end {", "b": 1} trailing }') == {"a": "} not the end {", "b": 1}
+
+
+def test_repair_gives_up():
+    with pytest.raises(LLMOutputError):
+        repair_json("no json here")
+    with pytest.raises(LLMOutputError):
+        repair_json(None)
+
+
+def test_missing_shot_field_raises_schema_error():
+    validate_shot_annotation(SHOTS)
+    broken = {"Shot": {"Shot 1": {"Involving Characters": []}}}
+    with pytest.raises(SchemaError, match="Plot/Visual Description"):
+        validate_shot_annotation(broken)
+    with pytest.raises(SchemaError):
+        validate_shot_annotation({"Shot": {}})
+
+
+def test_fused_requires_shot_annotation():
+    scene = {k: "" for k in ("Involving Characters", "Plot", "Scene Description", "Emotional Tone",
+                             "Key Props", "Cinematography Notes")}
+    validate_fused({"Scene": {"Scene 1": {**scene, "Shot Annotation": SHOTS}}})
+    with pytest.raises(SchemaError):
+        validate_fused({"Scene": {"Scene 1": scene}})